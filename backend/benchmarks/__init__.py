@@ -0,0 +1,10 @@
+"""
+Standalone performance benchmarks.
+
+Run from the backend directory, e.g.::
+
+    python -m benchmarks.comment_tree
+
+Each benchmark builds its data in a throwaway test database, so it never
+touches db.sqlite3 or the database configured by DATABASE_URL.
+"""
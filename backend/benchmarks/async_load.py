@@ -0,0 +1,149 @@
+"""
+Load-test the read endpoints through the sync WSGI app and the async ASGI app.
+
+    python -m benchmarks.async_load [--workers 1] [--concurrency 32]
+                                    [--duration 10] [--db-latency 2]
+
+Builds a SQLite database with `generate_data`, then for each mode starts a
+real server with the same number of worker processes - gunicorn sync workers
+on core.wsgi, uvicorn on core.asgi - and drives the feed, post detail and
+leaderboard endpoints with `--concurrency` client threads for `--duration`
+seconds. Reports throughput and latency per mode.
+
+`--db-latency` adds that many milliseconds to every query (see
+benchmarks.server_settings) to model a database across the network. With a
+local SQLite file queries take microseconds and there is little waiting to
+overlap, so run with and without it.
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .common import BACKEND_DIR, percentile
+
+SERVERS = {
+    'wsgi': ['gunicorn', 'core.wsgi:application', '--workers', '{workers}', '--bind', '127.0.0.1:{port}'],
+    'asgi': ['uvicorn', 'core.asgi:application', '--workers', '{workers}', '--port', '{port}',
+             '--log-level', 'warning'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def manage(env, *args):
+    return subprocess.run(
+        [sys.executable, 'manage.py', *args], cwd=BACKEND_DIR, env=env,
+        check=True, capture_output=True, text=True,
+    ).stdout
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/api/leaderboard/')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def load(port, paths, headers, concurrency, duration):
+    """Hammer `paths` round-robin; return (latencies in ms, errors)."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(offset):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        own = []
+        failed = 0
+        i = offset
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            own.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(own)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes per server.")
+    parser.add_argument('--concurrency', type=int, default=32, help="Concurrent client connections.")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds of load per mode.")
+    parser.add_argument('--db-latency', type=float, default=2, help="Milliseconds added to every query.")
+    parser.add_argument('--modes', default='wsgi,asgi')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='benchmarks.server_settings',
+            BENCH_DATABASE=os.path.join(directory, 'bench.sqlite3'),
+            CACHE_DIR=os.path.join(directory, 'cache'),
+        )
+        env.pop('DATABASE_URL', None)
+        manage(env, 'migrate', '--noinput')
+        manage(env, 'generate_data', '--users', '200', '--posts', '1000', '--comments-per-post', '10')
+        token = manage(env, 'drf_create_token', 'user1').split()[2]
+        env['BENCH_DB_LATENCY_MS'] = str(args.db_latency)
+
+        paths = ['/api/posts/', '/api/posts/?page_size=50', '/api/posts/10/', '/api/posts/20/',
+                 '/api/leaderboard/']
+        headers = {'Authorization': f'Token {token}'}
+
+        print(f"{args.workers} worker(s), {args.concurrency} clients, {args.duration:.0f}s, "
+              f"+{args.db_latency:g}ms per query")
+        print(f"{'mode':<6}{'req/s':>10}{'p50':>10}{'p95':>10}{'errors':>8}")
+        for mode in args.modes.split(','):
+            port = free_port()
+            command = [part.format(workers=args.workers, port=port) for part in SERVERS[mode]]
+            server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_until_up(port)
+                load(port, paths, headers, args.concurrency, 1)  # warm up
+                latencies, errors = load(port, paths, headers, args.concurrency, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{mode:<6}{len(latencies) / args.duration:>10.1f}{percentile(latencies, 50):>8.1f}ms"
+                  f"{percentile(latencies, 95):>8.1f}ms{errors:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Compare CommentSerializer with the `build_comment_tree` fast path used by
+PostDetailView on large threads.
+
+    python -m benchmarks.comment_tree [--comments 10000] [--repeat 5]
+
+Three variants are timed, each including its comment query:
+
+* serializer          - select_related('author') plus CommentSerializer,
+                        which finds each reply's parent among the fetched
+                        comments
+* serializer+prefetch - the same serializer with parents preloaded as well
+* fast path           - .values_list() rows linked by build_comment_tree
+
+The JSON produced by every variant is checked to be byte-identical.
+"""
+import argparse
+import random
+import sys
+
+from .common import QueryCounter, setup_django, throwaway_database, timed
+
+
+def make_thread(post, users, count, shape, rng):
+    from feed.models import Comment
+
+    # Primary keys are assigned up front so replies can point at comments
+    # from the same bulk_create batch.
+    next_id = (Comment.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    created = []
+    batch = []
+    for comment_id in range(next_id, next_id + count):
+        if shape == 'deep':
+            # Long reply chains: keep answering the latest comment.
+            parent = created[-1] if created and rng.random() < 0.97 else None
+        else:
+            parent = rng.choice(created) if created and rng.random() < 0.7 else None
+        comment = Comment(
+            id=comment_id, author=rng.choice(users), post=post, parent=parent,
+            content='x' * rng.randint(20, 200),
+        )
+        created.append(comment)
+        batch.append(comment)
+        if len(batch) >= 500:
+            Comment.objects.bulk_create(batch)
+            batch = []
+    Comment.objects.bulk_create(batch)
+
+
+def run(count, repeat, shape):
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from rest_framework.renderers import JSONRenderer
+    from types import SimpleNamespace
+
+    from feed.models import Comment, Post
+    from feed.serializers import CommentSerializer, COMMENT_TREE_COLUMNS, build_comment_tree
+
+    rng = random.Random(42)
+    users = User.objects.bulk_create(User(username=f'bench{shape}{i}') for i in range(50))
+    post = Post.objects.create(author=users[0], content='benchmark')
+    make_thread(post, users, count, shape, rng)
+    request = SimpleNamespace(user=users[1])
+    renderer = JSONRenderer()
+
+    def serializer_path(queryset):
+        def render():
+            all_comments_map = {}
+            for comment in queryset.all():
+                all_comments_map.setdefault(comment.parent_id, []).append(comment)
+            context = {'request': request, 'all_comments_map': all_comments_map, 'liked_comment_ids': set()}
+            return renderer.render(CommentSerializer(all_comments_map.get(None, []), many=True, context=context).data)
+        return render
+
+    def fast_path():
+        rows = Comment.objects.filter(post=post).order_by('created_at').values_list(*COMMENT_TREE_COLUMNS)
+        return renderer.render(build_comment_tree(rows, post.id, set()))
+
+    base = Comment.objects.filter(post=post).order_by('created_at')
+    variants = [
+        ('serializer', serializer_path(base.select_related('author'))),
+        ('serializer+prefetch', serializer_path(base.select_related('author', 'parent__author'))),
+        ('fast path', fast_path),
+    ]
+
+    print(f"\n{count} comments, {shape} thread")
+    print(f"{'variant':<22}{'median':>12}{'queries':>10}{'speedup':>10}")
+    results = {}
+    for name, fn in variants:
+        counter = QueryCounter()
+        try:
+            with connection.execute_wrapper(counter):
+                seconds, output = timed(fn, repeat)
+        except RecursionError:
+            print(f"{name:<22}{'RecursionError':>12}")
+            continue
+        results[name] = (seconds, output)
+        speedup = f"{results['serializer'][0] / seconds:.1f}x" if 'serializer' in results else '-'
+        print(f"{name:<22}{seconds * 1000:>10.1f}ms{counter.count // repeat:>10}{speedup:>10}")
+
+    outputs = {output for _, output in results.values()}
+    if len(outputs) > 1:
+        print("ERROR: variants rendered different JSON", file=sys.stderr)
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    with throwaway_database():
+        ok = all([run(args.comments, args.repeat, shape) for shape in ('wide', 'deep')])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Time every API endpoint through the Django test client at several data sizes.
+
+    python -m benchmarks.endpoints [--scales small,medium] [--requests 50]
+                                   [--output results.json]
+                                   [--baseline baseline.json]
+
+For each scale a throwaway database is filled with `generate_data` and each
+scenario below is requested `--requests` times as an authenticated user,
+with token authentication.
+Per scenario the run records p50/p95 latency, SQL queries per request and
+peak Python memory of one request (tracemalloc, measured on a separate call
+so it does not skew the timings), and writes them all to `--output`.
+
+With `--baseline`, the run is compared against an earlier results file and
+exits non-zero when a scenario issues more queries, or when its p95 latency
+or peak memory grew by more than the tolerance.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import StringIO
+
+from .common import QueryCounter, percentile, setup_django, throwaway_database
+
+# generate_data arguments per scale.
+SCALES = {
+    'small': ['--users', '50', '--posts', '200', '--comments-per-post', '5'],
+    'medium': ['--users', '500', '--posts', '2000', '--comments-per-post', '10'],
+    'large': ['--users', '2000', '--posts', '10000', '--comments-per-post', '20',
+              '--likes-per-post', '10', '--likes-per-comment', '4'],
+}
+
+# Latency differences below this are noise on a shared machine.
+MIN_LATENCY_SLACK_MS = 2.0
+
+
+def scenarios(client):
+    """(name, setup, request) triples; `setup` runs untimed before each request."""
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from rest_framework.authtoken.models import Token
+
+    from feed import authentication
+    from feed.models import Comment, Post
+
+    viewer = User.objects.order_by('id').first()
+    token, _ = Token.objects.get_or_create(user=viewer)
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    post = Post.objects.order_by('-comments_count', 'id').first()
+    comment = Comment.objects.filter(post=post).order_by('-depth', 'id').first()
+    second_page = client.get('/api/posts/').data['next']
+
+    def noop():
+        pass
+
+    def forget_token():
+        authentication.invalidate(token.key)
+
+    return [
+        ('feed', noop, lambda: client.get('/api/posts/')),
+        ('feed token uncached', forget_token, lambda: client.get('/api/posts/')),
+        ('feed page 2', noop, lambda: client.get(second_page)),
+        ('post detail', noop, lambda: client.get(f'/api/posts/{post.id}/')),
+        ('post detail bounded', noop,
+         lambda: client.get(f'/api/posts/{post.id}/?limit=20&depth=3&replies=5')),
+        ('comment thread', noop, lambda: client.get(f'/api/comments/{comment.id}/')),
+        ('like post toggle', noop, lambda: client.post(f'/api/posts/{post.id}/like/')),
+        ('like comment toggle', noop, lambda: client.post(f'/api/comments/{comment.id}/like/')),
+        ('comment create', noop,
+         lambda: client.post(f'/api/posts/{post.id}/comments/', {'content': 'benchmark'}, format='json')),
+        ('reply create', noop,
+         lambda: client.post(f'/api/posts/{post.id}/comments/',
+                             {'content': 'benchmark', 'parent': comment.id}, format='json')),
+        ('leaderboard', noop, lambda: client.get('/api/leaderboard/')),
+        ('leaderboard cold', cache.clear, lambda: client.get('/api/leaderboard/')),
+        ('search', noop, lambda: client.get('/api/search/?q=django+index')),
+    ]
+
+
+def measure(setup, request, count):
+    from django.db import connection
+
+    latencies = []
+    queries = []
+    status = None
+    setup()
+    request()  # warm up
+    for _ in range(count):
+        setup()
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = time.perf_counter()
+            response = request()
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count)
+        status = response.status_code
+
+    setup()
+    tracemalloc.start()
+    try:
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': status,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'queries': max(queries),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_scale(scale, count):
+    from django.core.cache import cache
+    from django.core.management import call_command
+    from rest_framework.test import APIClient
+
+    with throwaway_database():
+        cache.clear()
+        call_command('generate_data', *SCALES[scale], stdout=StringIO())
+        client = APIClient()
+        results = {}
+        print(f"\n{scale}")
+        print(f"{'scenario':<22}{'status':>7}{'p50':>10}{'p95':>10}{'queries':>9}{'peak':>11}")
+        for name, setup, request in scenarios(client):
+            result = measure(setup, request, count)
+            results[name] = result
+            print(f"{name:<22}{result['status']:>7}{result['p50_ms']:>8.1f}ms{result['p95_ms']:>8.1f}ms"
+                  f"{result['queries']:>9}{result['peak_kb']:>9.0f}KB")
+        return results
+
+
+def compare(results, baseline, latency_tolerance, memory_tolerance):
+    """Return human-readable regressions of `results` against `baseline`."""
+    regressions = []
+    for scale, scenarios_ in results.items():
+        for name, current in scenarios_.items():
+            previous = baseline.get(scale, {}).get(name)
+            if previous is None:
+                continue
+            label = f"{scale} / {name}"
+            if current['queries'] > previous['queries']:
+                regressions.append(f"{label}: queries {previous['queries']} -> {current['queries']}")
+            allowed = max(previous['p95_ms'] * (1 + latency_tolerance),
+                          previous['p95_ms'] + MIN_LATENCY_SLACK_MS)
+            if current['p95_ms'] > allowed:
+                regressions.append(f"{label}: p95 {previous['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+            if current['peak_kb'] > previous['peak_kb'] * (1 + memory_tolerance):
+                regressions.append(f"{label}: peak memory {previous['peak_kb']:.0f}KB -> {current['peak_kb']:.0f}KB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='small,medium',
+                        help=f"Comma-separated scales out of {', '.join(SCALES)}.")
+    parser.add_argument('--requests', type=int, default=50, help="Timed requests per scenario.")
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help="Results file to compare against.")
+    parser.add_argument('--latency-tolerance', type=float, default=0.25,
+                        help="Allowed relative p95 growth (default: 0.25).")
+    parser.add_argument('--memory-tolerance', type=float, default=0.25,
+                        help="Allowed relative peak memory growth (default: 0.25).")
+    args = parser.parse_args()
+
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    unknown = set(scales) - set(SCALES)
+    if unknown:
+        parser.error(f"unknown scales: {', '.join(sorted(unknown))}")
+
+    setup_django()
+    results = {scale: run_scale(scale, args.requests) for scale in scales}
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'requests': args.requests,
+            'results': results,
+        }, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.latency_tolerance, args.memory_tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Leaderboard reads on a million ranked users.
+
+    python -m benchmarks.leaderboard [--users 1000000] [--repeat 5]
+
+A throwaway database gets `--users` users, each with karma in every window
+(heavy-tailed, so there are many ties near the bottom) and one hourly
+bucket. Times, for the 30d window:
+
+* bucket aggregate - top 5 by summing every bucket in the window, as a
+                     leaderboard without per-user rollups would
+* top 5            - `karma.leaderboard()` (uncached)
+* ranking page 1   - `GET /api/leaderboard/ranking/?window=30d`
+* ranking page mid - the same, from a cursor halfway down the ranking
+* rank: top/median/last - `GET /api/leaderboard/me/?window=30d`
+"""
+import argparse
+import random
+from datetime import timedelta
+
+from .common import setup_django, throwaway_database, timed
+
+BATCH = 10000
+
+
+def populate(count, rng):
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+
+    from feed import karma
+    from feed.models import KarmaBucket, KarmaWindow, UserKarma
+
+    now = timezone.now()
+    hour = karma.floor_hour(now)
+    for start in range(0, count, BATCH):
+        ids = range(start + 1, min(start + BATCH, count) + 1)
+        User.objects.bulk_create(User(id=i, username=f'user{i}', password='!') for i in ids)
+        scores = {i: int(rng.paretovariate(1.2) * 3) for i in ids}
+        UserKarma.objects.bulk_create(
+            UserKarma(user_id=i, karma_1h=score // 20, karma_24h=score // 5, karma_7d=score // 2, karma_30d=score)
+            for i, score in scores.items()
+        )
+        KarmaBucket.objects.bulk_create(
+            KarmaBucket(user_id=i, hour=hour - timedelta(hours=rng.randrange(30 * 24)), karma=score)
+            for i, score in scores.items()
+        )
+    for name in karma.WINDOWS:
+        KarmaWindow.objects.update_or_create(name=name, defaults={'hour': hour})
+    return now
+
+
+def run(args):
+    from django.contrib.auth.models import User
+    from django.db.models import Sum
+    from rest_framework.test import APIClient
+
+    from feed import karma
+    from feed.models import KarmaBucket, UserKarma
+    from feed.views import encode_ranking_cursor
+
+    with throwaway_database():
+        now = populate(args.users, random.Random(11))
+        client = APIClient()
+        ordered = UserKarma.objects.filter(karma_30d__gt=0).order_by('-karma_30d', 'user_id')
+        ranked = ordered.count()
+        middle_id, middle_karma = ordered.values_list('user_id', 'karma_30d')[ranked // 2]
+        last_id = ordered.values_list('user_id', flat=True)[ranked - 1]
+        top_id = ordered.values_list('user_id', flat=True)[0]
+        middle_rank, _ = karma.rank(middle_id, '30d')
+        # The cursor of the page ending with the median user (position and rank as far as needed).
+        cursor = encode_ranking_cursor(middle_karma, middle_id, ranked // 2 + 1, middle_rank)
+
+        def rank_of(user_id):
+            def request():
+                client.force_authenticate(User(id=user_id, username=f'user{user_id}'))
+                return client.get('/api/leaderboard/me/?window=30d')
+            return request
+
+        cases = [
+            ('bucket aggregate', lambda: list(
+                KarmaBucket.objects.filter(hour__gt=karma.floor_hour(now) - timedelta(days=30))
+                .values('user').annotate(total=Sum('karma')).order_by('-total', 'user')[:5]
+            )),
+            ('top 5', lambda: karma.leaderboard(limit=5, window='30d')),
+            ('ranking page 1', lambda: client.get('/api/leaderboard/ranking/?window=30d')),
+            ('ranking page mid', lambda: client.get(f'/api/leaderboard/ranking/?window=30d&cursor={cursor}')),
+            ('rank: top', rank_of(top_id)),
+            ('rank: median', rank_of(middle_id)),
+            ('rank: last', rank_of(last_id)),
+        ]
+        print(f"{args.users} users, {ranked} with 30d karma\n")
+        for name, fn in cases:
+            seconds, _ = timed(fn, args.repeat)
+            print(f"{name:<20}{seconds * 1000:>10.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
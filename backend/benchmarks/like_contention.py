@@ -0,0 +1,160 @@
+"""
+Concurrent like toggles on SQLite: Django's defaults against the tuned profile.
+
+    python -m benchmarks.like_contention [--workers 4] [--threads 4]
+                                         [--concurrency 32] [--duration 10]
+                                         [--db-latency 1]
+
+Builds a SQLite database with `generate_data`, then for each profile starts
+gunicorn (`--workers` processes of `--threads` threads, each thread with its
+own connection) on a copy of it and runs `--concurrency` clients for
+`--duration` seconds. Every client is a different user; most requests toggle
+a like on one of a few popular posts or comments, the rest read the feed
+(`--read-share`). Reports throughput, p95 latency and errors per kind.
+
+`--db-latency` adds that many milliseconds to every query (see
+benchmarks.server_settings), as a slow disk would. Transactions then hold
+their locks long enough to contend even on a single CPU.
+
+* defaults - rollback journal, deferred transactions, 5s timeout, no retries
+* tuned    - core.settings: WAL, synchronous=NORMAL, BEGIN IMMEDIATE, busy
+             timeout and `feed.db.retry_on_lock`
+
+Any error under the tuned profile is a lock that outlasted the timeout and
+every retry.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from .async_load import free_port, manage, wait_until_up
+from .common import BACKEND_DIR, percentile
+
+PROFILES = {
+    'defaults': {'BENCH_SQLITE_DEFAULTS': 'True', 'DATABASE_LOCK_RETRIES': '0'},
+    'tuned': {},
+}
+
+HOT_TARGETS = 20
+
+SETUP = """
+import json
+from rest_framework.authtoken.models import Token
+from django.contrib.auth.models import User
+from feed.models import Comment
+tokens = [Token.objects.get_or_create(user=user)[0].key for user in User.objects.order_by('id')[:{users}]]
+comments = list(Comment.objects.order_by('id').values_list('id', flat=True)[:{targets}])
+print(json.dumps({{'tokens': tokens, 'comments': comments}}))
+"""
+
+
+def requests_for(rng, comment_ids, read_share):
+    """An endless stream of (kind, method, path)."""
+    while True:
+        roll = rng.random()
+        if roll < read_share:
+            yield 'read', 'GET', '/api/posts/'
+        elif roll < read_share + (1 - read_share) * 0.75:
+            yield 'like', 'POST', f'/api/posts/{rng.randint(1, HOT_TARGETS)}/like/'
+        else:
+            yield 'like', 'POST', f'/api/comments/{rng.choice(comment_ids)}/like/'
+
+
+def load(port, tokens, comment_ids, read_share, duration):
+    """Run one client per token; return {kind: (latencies in ms, errors)}."""
+    results = {'like': ([], []), 'read': ([], [])}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(n, token):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        headers = {'Authorization': f'Token {token}', 'Content-Length': '0'}
+        own = {'like': ([], []), 'read': ([], [])}
+        for kind, method, path in requests_for(random.Random(n), comment_ids, read_share):
+            if time.monotonic() >= deadline:
+                break
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                own[kind][1].append('connection')
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                continue
+            if response.status >= 400:
+                own[kind][1].append(response.status)
+            else:
+                own[kind][0].append((time.perf_counter() - start) * 1000)
+        with lock:
+            for kind, (latencies, errors) in own.items():
+                results[kind][0].extend(latencies)
+                results[kind][1].extend(errors)
+
+    threads = [threading.Thread(target=client, args=(n, token)) for n, token in enumerate(tokens)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn worker processes.")
+    parser.add_argument('--threads', type=int, default=4, help="Threads per worker.")
+    parser.add_argument('--concurrency', type=int, default=32, help="Concurrent clients (distinct users).")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds of load per profile.")
+    parser.add_argument('--read-share', type=float, default=0.25, help="Share of requests reading the feed.")
+    parser.add_argument('--db-latency', type=float, default=1, help="Milliseconds added to every query.")
+    parser.add_argument('--profiles', default='defaults,tuned')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'source.sqlite3')
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='benchmarks.server_settings', BENCH_DATABASE=source,
+                   **PROFILES['defaults'])
+        env.pop('DATABASE_URL', None)
+        manage(env, 'migrate', '--noinput')
+        manage(env, 'generate_data', '--users', str(max(args.concurrency, 200)), '--posts', '1000',
+               '--comments-per-post', '5', '--likes-per-post', '0', '--likes-per-comment', '0')
+        output = manage(env, 'shell', '-c', SETUP.format(users=args.concurrency, targets=HOT_TARGETS))
+        data = json.loads(output.splitlines()[-1])
+
+        print(f"{args.workers} worker(s) x {args.threads} thread(s), {args.concurrency} clients, "
+              f"{args.duration:.0f}s, {args.read_share:.0%} reads, +{args.db_latency:g}ms per query")
+        print(f"{'profile':<10}{'kind':<6}{'req/s':>10}{'p95':>10}{'errors':>8}")
+        for profile in args.profiles.split(','):
+            database = os.path.join(directory, f'{profile}.sqlite3')
+            shutil.copy(source, database)
+            env = dict(os.environ, DJANGO_SETTINGS_MODULE='benchmarks.server_settings', BENCH_DATABASE=database,
+                       CACHE_DIR=os.path.join(directory, f'{profile}-cache'),
+                       BENCH_DB_LATENCY_MS=str(args.db_latency), **PROFILES[profile])
+            env.pop('DATABASE_URL', None)
+            port = free_port()
+            server = subprocess.Popen(
+                ['gunicorn', 'core.wsgi:application', '--workers', str(args.workers), '--threads',
+                 str(args.threads), '--bind', f'127.0.0.1:{port}', '--timeout', '120'],
+                cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                wait_until_up(port)
+                results = load(port, data['tokens'], data['comments'], args.read_share, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+            for kind, (latencies, errors) in results.items():
+                p95 = f"{percentile(latencies, 95):>8.1f}ms" if latencies else f"{'-':>10}"
+                print(f"{profile:<10}{kind:<6}{len(latencies) / args.duration:>10.1f}{p95}{len(errors):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Full-text search against a naive `content__icontains` scan.
+
+    python -m benchmarks.search [--posts 100000] [--comments-per-post 9] [--repeat 5]
+
+A throwaway database gets a corpus from `generate_data` (by default 100k
+posts and about 900k comments: a million rows), plus RARE_HITS posts and
+comments containing a word found nowhere else. For each query, times:
+
+* icontains  - what a search without an index would do: every word as a
+               `content__icontains` filter, newest 20 first
+* search     - `feed.search.search()`: the best 20 matches from the text
+               index, ranked
+* endpoint   - `GET /api/search/`, i.e. the search plus the page's rows
+
+generate_data draws from a vocabulary of ~30 words, so its words each
+match a large share of the corpus: those queries show the cost of ranking
+every match. The rare word shows the usual case of a selective query.
+"""
+import argparse
+import random
+from io import StringIO
+
+from .common import setup_django, throwaway_database, timed
+
+RARE_WORD = 'kubernetes'
+RARE_HITS = 10
+QUERIES = [RARE_WORD, f'django {RARE_WORD}', 'django', 'cache index']
+
+
+def plant_rare_word():
+    from django.contrib.auth.models import User
+    from feed.models import Comment, Post
+
+    rng = random.Random(7)
+    author = User.objects.order_by('id').first()
+    post_ids = list(Post.objects.values_list('id', flat=True)[:10000])
+    for i in range(RARE_HITS):
+        Post.objects.create(author=author, content=f"Running django on {RARE_WORD} cluster {i}")
+        Comment.objects.create(author=author, post_id=rng.choice(post_ids), content=f"Try {RARE_WORD} with django {i}")
+
+
+def icontains(model, words):
+    queryset = model.objects.all()
+    for word in words:
+        queryset = queryset.filter(content__icontains=word)
+    return list(queryset.order_by('-created_at').values_list('id', flat=True)[:20])
+
+
+def run(args):
+    from django.core.management import call_command
+    from rest_framework.test import APIClient
+
+    from feed import search
+    from feed.models import Comment, Post
+
+    with throwaway_database():
+        call_command(
+            'generate_data', '--users', '200', '--posts', str(args.posts),
+            '--comments-per-post', str(args.comments_per_post), '--likes-per-post', '0',
+            '--likes-per-comment', '0', stdout=StringIO(),
+        )
+        plant_rare_word()
+        print(f"{Post.objects.count()} posts, {Comment.objects.count()} comments\n")
+        client = APIClient()
+
+        print(f"{'query':<22}{'type':<10}{'icontains':>12}{'search':>12}{'endpoint':>12}{'matches':>10}")
+        for query in QUERIES:
+            words = search.terms(query)
+            for kind, model in (('posts', Post), ('comments', Comment)):
+                naive, _ = timed(lambda: icontains(model, words), args.repeat)
+                indexed, _ = timed(lambda: search.search(kind, words, limit=20), args.repeat)
+                endpoint, _ = timed(lambda: client.get('/api/search/', {'q': query, 'type': kind}), args.repeat)
+                matches = len(search.search(kind, words, limit=10 ** 9))
+                print(f"{query:<22}{kind:<10}{naive * 1000:>10.1f}ms{indexed * 1000:>10.1f}ms"
+                      f"{endpoint * 1000:>10.1f}ms{matches:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--comments-per-post', type=float, default=9)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
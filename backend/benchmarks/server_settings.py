@@ -0,0 +1,42 @@
+"""
+Settings for servers started by `benchmarks.async_load` and
+`benchmarks.like_contention`.
+
+Uses the SQLite file named by BENCH_DATABASE, with the options of the SQLite
+profile in core.settings unless BENCH_SQLITE_DEFAULTS=True asks for Django's
+defaults. BENCH_DB_LATENCY_MS adds a sleep to every query to stand in for the
+network round trip to a database server, which is where overlapping queries
+pays off.
+"""
+import os
+import time
+
+from django.db.backends.signals import connection_created
+
+from core.settings import *  # noqa: F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['BENCH_DATABASE'],
+        'OPTIONS': {} if os.environ.get('BENCH_SQLITE_DEFAULTS') == 'True' else DATABASES['default']['OPTIONS'],
+    }
+}
+
+DB_LATENCY = float(os.environ.get('BENCH_DB_LATENCY_MS', 0)) / 1000
+
+
+def _delay(execute, sql, params, many, context):
+    time.sleep(DB_LATENCY)
+    return execute(sql, params, many, context)
+
+
+def _install_delay(connection, **kwargs):
+    if _delay not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_delay)
+
+
+if DB_LATENCY:
+    connection_created.connect(_install_delay)
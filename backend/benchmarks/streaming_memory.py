@@ -0,0 +1,106 @@
+"""
+Peak memory of the post detail and the feed, buffered versus streamed.
+
+    python -m benchmarks.streaming_memory [--sizes 1000,10000,50000]
+
+For each size a throwaway database gets that many posts from `generate_data`,
+and one of them a thread of that many comments. Each variant is
+requested once through the test client with tracemalloc running, and its
+body consumed chunk by chunk without being kept, as a server writing to a
+socket would:
+
+* post detail          - the regular response: nested dicts, then one body
+* post detail stream   - `?stream=1`
+* feed export          - `GET /api/posts/export/` (NDJSON)
+
+Streamed peaks should stay flat as the size grows; buffered peaks grow with
+the payload.
+"""
+import argparse
+import random
+import tracemalloc
+from io import StringIO
+
+from .common import setup_django, throwaway_database
+
+
+def peak_kb(request):
+    """(peak KB, body bytes) of one request, its body consumed and dropped."""
+    tracemalloc.start()
+    try:
+        response = request()
+        size = 0
+        for chunk in (response.streaming_content if response.streaming else [response.content]):
+            size += len(chunk)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / 1024, size
+
+
+def make_thread(post, users, count, rng):
+    from feed.models import Comment, Post, path_segment
+
+    # Ids are assigned up front so paths can be set in the same bulk_create.
+    next_id = (Comment.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    created = []
+    batch = []
+    for comment_id in range(next_id, next_id + count):
+        parent = rng.choice(created[-50:]) if created and rng.random() < 0.7 else None
+        path = (parent.path if parent else '') + path_segment(comment_id)
+        comment = Comment(
+            id=comment_id, author=rng.choice(users), post=post, parent=parent,
+            content='x' * rng.randint(20, 200), path=path, depth=parent.depth + 1 if parent else 0,
+        )
+        created.append(comment)
+        batch.append(comment)
+        if len(batch) >= 2000:
+            Comment.objects.bulk_create(batch)
+            batch = []
+    Comment.objects.bulk_create(batch)
+    Post.objects.filter(pk=post.pk).update(comments_count=count)
+
+
+def run(size):
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from django.core.management import call_command
+    from rest_framework.test import APIClient
+
+    from feed.models import Post
+
+    with throwaway_database():
+        call_command('generate_data', '--users', '50', '--posts', str(size), '--comments-per-post', '0',
+                     stdout=StringIO())
+        post = Post.objects.order_by('id').first()
+        make_thread(post, list(User.objects.all()), size, random.Random(42))
+        client = APIClient()
+        variants = [
+            ('post detail', lambda: client.get(f'/api/posts/{post.id}/')),
+            ('post detail stream', lambda: client.get(f'/api/posts/{post.id}/?stream=1')),
+            ('feed export', lambda: client.get('/api/posts/export/')),
+        ]
+        results = {}
+        for name, request in variants:
+            cache.clear()
+            request()  # warm up imports and caches outside the measurement
+            cache.clear()
+            results[name] = peak_kb(request)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,50000',
+                        help="Comma-separated comment (and post) counts.")
+    args = parser.parse_args()
+
+    setup_django()
+    print(f"{'size':>8}  {'variant':<20}{'body':>12}{'peak':>12}")
+    for size in (int(size) for size in args.sizes.split(',')):
+        for name, (peak, body) in run(size).items():
+            print(f"{size:>8}  {name:<20}{body / 1024:>10.0f}KB{peak:>10.0f}KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+Per-route request metrics in the Prometheus text format.
+
+`MetricsMiddleware` records, for every request, its latency, the number of SQL
+queries and the time spent in them, the response size and the status code,
+labelled by the matched URL pattern (e.g. `api/posts/<int:pk>/`) so that the
+number of series stays bounded. Observations go into plain in-process counters
+and histogram buckets under a lock, which costs a few microseconds per request.
+
+`metrics_view` serves them at /metrics. Under a multi-process server such as
+gunicorn every worker has its own counters, so when `METRICS_DIR` is set each
+worker periodically writes a snapshot to `<METRICS_DIR>/<pid>-<random>.json`
+and the view sums the snapshots of all workers. Snapshots of workers that
+have exited are kept, under names no later process reuses, so that counters
+never go backwards. Hit/miss counts of the versioned caches in
+`feed.caching` are exported alongside.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+# name -> (help, buckets); observed in this order by Registry.observe.
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Request latency by route.', LATENCY_BUCKETS),
+    'http_request_db_queries': ('SQL queries per request by route.', QUERY_BUCKETS),
+    'http_request_db_duration_seconds': ('Time spent in SQL per request by route.', LATENCY_BUCKETS),
+    'http_response_size_bytes': ('Response body size by route.', SIZE_BUCKETS),
+}
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+class Registry:
+    """Counters and histograms of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        # Names this process's snapshot file. Pids are reused, and a new
+        # worker must not overwrite the snapshot of an exited one.
+        self.process_id = f'{self.pid}-{uuid.uuid4().hex}'
+        self.last_flush = time.monotonic()
+        # (method, route, status) -> requests
+        self.requests = {}
+        # histogram name -> {(method, route): [bucket counts..., +Inf count, sum]}
+        self.histograms = {name: {} for name in HISTOGRAMS}
+
+    def _check_fork(self):
+        if self.pid != os.getpid():
+            # Forked from a process that had already counted requests.
+            self.reset()
+
+    def observe(self, method, route, status, *values):
+        with self.lock:
+            self._check_fork()
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for (name, (_, buckets)), value in zip(HISTOGRAMS.items(), values):
+                if value is None:
+                    continue
+                series = self.histograms[name].get((method, route))
+                if series is None:
+                    series = self.histograms[name][(method, route)] = [0] * (len(buckets) + 2)
+                series[bisect_left(buckets, value)] += 1
+                series[-1] += value
+
+    def snapshot(self):
+        """JSON-serializable copy of the current values."""
+        with self.lock:
+            self._check_fork()
+            return {
+                'requests': [[*key, count] for key, count in self.requests.items()],
+                'histograms': {
+                    name: [[*key, list(series)] for key, series in values.items()]
+                    for name, values in self.histograms.items()
+                },
+            }
+
+    def flush(self, directory):
+        """Write this process's snapshot to `directory` atomically."""
+        self.last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        snapshot = self.snapshot()
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, os.path.join(directory, f'{self.process_id}.json'))
+
+
+registry = Registry()
+
+
+def merge(snapshots):
+    """Sum several snapshots into one."""
+    requests = {}
+    histograms = {name: {} for name in HISTOGRAMS}
+    for snapshot in snapshots:
+        for *key, count in snapshot['requests']:
+            key = tuple(key)
+            requests[key] = requests.get(key, 0) + count
+        for name, values in snapshot['histograms'].items():
+            if name not in histograms:
+                continue
+            for method, route, series in values:
+                total = histograms[name].get((method, route))
+                if total is None:
+                    histograms[name][(method, route)] = list(series)
+                else:
+                    histograms[name][(method, route)] = [a + b for a, b in zip(total, series)]
+    return requests, histograms
+
+
+def collect():
+    """Snapshots of this process and, with METRICS_DIR, of every other worker."""
+    snapshots = [registry.snapshot()]
+    directory = settings.METRICS_DIR
+    if not directory or not os.path.isdir(directory):
+        return snapshots
+    own = f'{registry.process_id}.json'
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json') or filename == own:
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # Unreadable or removed since listing; skip it this scrape.
+            continue
+    return snapshots
+
+
+def _labels(**labels):
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(requests, histograms):
+    lines = [
+        '# HELP http_requests_total Requests by route and status code.',
+        '# TYPE http_requests_total counter',
+    ]
+    for (method, route, status), count in sorted(requests.items()):
+        lines.append(f'http_requests_total{_labels(method=method, route=route, status=status)} {count}')
+
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (method, route), series in sorted(histograms[name].items()):
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), series):
+                cumulative += count
+                labels = _labels(method=method, route=route, le=bound)
+                lines.append(f'{name}_bucket{labels} {cumulative}')
+            labels = _labels(method=method, route=route)
+            lines.append(f'{name}_sum{labels} {_number(series[-1])}')
+            lines.append(f'{name}_count{labels} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def render_cache_stats():
+    # Cache outcome counters already live in the shared cache, so they cover
+    # every worker without merging.
+    from feed import caching
+
+    lines = [
+        '# HELP cache_requests_total Versioned cache lookups by namespace and outcome.',
+        '# TYPE cache_requests_total counter',
+    ]
+    for namespace in settings.METRICS_CACHE_NAMESPACES:
+        for outcome, count in caching.stats(namespace).items():
+            lines.append(f'cache_requests_total{_labels(namespace=namespace, outcome=outcome)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    body = render(*merge(collect())) + render_cache_stats()
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class QueryTimer:
+    """Number of queries of one request and the time spent running them."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# Timer of the request being handled. Under ASGI a request's queries run in
+# worker threads, each with its own connection objects, so the timer follows
+# the request as a context variable instead of being installed per request on
+# the connections of the current thread.
+_request_timer = ContextVar('metrics_request_timer', default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    timer = _request_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.seconds += time.perf_counter() - start
+        timer.count += 1
+
+
+def install_query_timer(connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+connection_created.connect(install_query_timer)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        # Connections opened before this module was imported.
+        for connection in connections.all():
+            install_query_timer(connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timer = QueryTimer()
+        token = _request_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timer.reset(token)
+        self.record(request, response, timer, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        token = _request_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timer.reset(token)
+        self.record(request, response, timer, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, timer, duration):
+        match = request.resolver_match
+        route = match.route if match is not None else UNMATCHED_ROUTE
+        if response.streaming:
+            size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+        else:
+            size = len(response.content)
+        registry.observe(
+            request.method, route, response.status_code,
+            duration, timer.count, timer.seconds, size,
+        )
+
+        directory = settings.METRICS_DIR
+        if directory and time.monotonic() - registry.last_flush >= settings.METRICS_FLUSH_INTERVAL:
+            registry.flush(directory)
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -52,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -93,18 +95,82 @@ if os.environ.get('DATABASE_URL'):
     DATABASES = {
         'default': dj_database_url.config(
             default=os.environ.get('DATABASE_URL'),
-            conn_max_age=600,
+            # Persistent connections are unsafe under ASGI, where each request's
+            # queries run in their own thread; set CONN_MAX_AGE only for WSGI.
+            conn_max_age=int(os.environ.get('CONN_MAX_AGE', 0)),
             conn_health_checks=True,
         )
     }
 else:
+    # Tuned for several workers writing at once. WAL lets reads run alongside
+    # the one writer, and synchronous=NORMAL only syncs at checkpoints (a power
+    # loss may drop the last commits, never corrupt the file). BEGIN IMMEDIATE
+    # takes the write lock when a transaction starts, so a writer waits up to
+    # SQLITE_TIMEOUT seconds for it rather than failing on its first write;
+    # see feed.db.retry_on_lock for what happens after that.
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': float(os.environ.get('SQLITE_TIMEOUT', 10)),
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    # 256MB of the file mapped, 64MB of page cache per connection.
+                    'PRAGMA mmap_size=268435456;'
+                    'PRAGMA cache_size=-65536;'
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+            },
         }
     }
 
+# Write transactions that time out on SQLite's lock are run again this many
+# times, after DATABASE_LOCK_RETRY_DELAY seconds doubling on each attempt.
+DATABASE_LOCK_RETRIES = int(os.environ.get('DATABASE_LOCK_RETRIES', 3))
+DATABASE_LOCK_RETRY_DELAY = float(os.environ.get('DATABASE_LOCK_RETRY_DELAY', 0.05))
+
+
+# Cache
+# In-process by default; set CACHE_DIR to share entries between worker
+# processes through the file-based backend.
+if os.environ.get('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'playto',
+        }
+    }
+
+# Seconds a cached leaderboard may be served; bounds how far it can lag the
+# rolling 24h window between like toggles.
+LEADERBOARD_CACHE_TTL = int(os.environ.get('LEADERBOARD_CACHE_TTL', 30))
+
+# Default users per page of GET /api/leaderboard/ranking/ (?page_size=, capped at 100)
+LEADERBOARD_PAGE_SIZE = int(os.environ.get('LEADERBOARD_PAGE_SIZE', 50))
+
+# Seconds a post's rendered comment tree stays cached. Entries are keyed by
+# the post's version, so new comments and likes never serve a stale tree;
+# the TTL only bounds how long trees of quiet posts occupy the cache.
+COMMENT_TREE_CACHE_TTL = int(os.environ.get('COMMENT_TREE_CACHE_TTL', 600))
+
+
+# Metrics (see core.metrics). With several worker processes, point
+# METRICS_DIR at a directory they share; each worker writes its counters
+# there at most every METRICS_FLUSH_INTERVAL seconds and /metrics sums them.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+METRICS_CACHE_NAMESPACES = ['leaderboard']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -152,10 +218,52 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'feed.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
 }
+
+# Token -> user lookups cached by feed.authentication: per process (an LRU of
+# TOKEN_CACHE_SIZE tokens) and in the shared cache. The per-process TTL bounds
+# how long another worker may still accept a deleted token.
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 60))
+TOKEN_SHARED_CACHE_TTL = int(os.environ.get('TOKEN_SHARED_CACHE_TTL', 300))
+
+# Deepest reply the API accepts. Comment paths grow ~4-6 characters per level
+# and must stay within the database's index entry size limit.
+MAX_COMMENT_DEPTH = int(os.environ.get('MAX_COMMENT_DEPTH', 250))
+
+# Comments per page on the comment paging endpoints, and the most a client
+# may ask for with ?limit= / ?depth= / ?replies=.
+COMMENT_PAGE_SIZE = int(os.environ.get('COMMENT_PAGE_SIZE', 20))
+MAX_COMMENT_PAGE_SIZE = 100
+
+# Write-behind like toggles (see feed.like_buffer): buffer toggles in memory
+# and write them in one transaction every LIKE_FLUSH_INTERVAL seconds (0: only
+# when LIKE_BUFFER_SIZE (user, target) pairs are pending). Only for a single
+# worker process: the first process to buffer a like locks LIKE_BUFFER_LOCK,
+# and likes sent to any other fail.
+LIKE_WRITE_BEHIND = os.environ.get('LIKE_WRITE_BEHIND', 'False') == 'True'
+LIKE_FLUSH_INTERVAL = float(os.environ.get('LIKE_FLUSH_INTERVAL', 1))
+LIKE_BUFFER_SIZE = int(os.environ.get('LIKE_BUFFER_SIZE', 500))
+LIKE_BUFFER_LOCK = os.environ.get('LIKE_BUFFER_LOCK') or os.path.join(tempfile.gettempdir(), 'feed-like-buffer.lock')
+
+# Most like/unlike operations accepted by one POST /api/likes/batch/.
+MAX_LIKE_BATCH = int(os.environ.get('MAX_LIKE_BATCH', 100))
+
+# Default number of posts per feed page (clients may pass ?page_size=, capped at 100)
+FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', 20))
+
+# Default number of results per search page (?page_size=, capped at 100)
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+
+# ?sort=hot (see feed.ranking): a post needs twice the engagement of one
+# HOT_HALF_LIFE_HOURS newer to rank level with it; a comment counts as
+# HOT_COMMENT_WEIGHT likes. Changing either takes `manage.py
+# refresh_hot_scores --all`.
+HOT_HALF_LIFE_HOURS = float(os.environ.get('HOT_HALF_LIFE_HOURS', 12))
+HOT_COMMENT_WEIGHT = int(os.environ.get('HOT_COMMENT_WEIGHT', 2))
@@ -18,6 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.authtoken import views
 from django.http import JsonResponse
+from .metrics import metrics_view
 
 def home(request):
     return JsonResponse({
@@ -35,4 +36,5 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('feed.urls')),
     path('api/auth/token/', views.obtain_auth_token),
+    path('metrics', metrics_view),
 ]
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class FeedConfig(AppConfig):
     name = 'feed'
+
+    def ready(self):
+        from . import signals  # noqa: F401
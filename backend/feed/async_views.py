@@ -0,0 +1,125 @@
+"""
+Async read endpoints for the ASGI application.
+
+GET requests on the feed, post detail and leaderboard are served by
+coroutines that look up the page or post through the async ORM, so one
+worker can keep many requests in flight while their queries wait on the
+database. The responses are built by the same functions as those of the
+sync DRF views (`feed_page_response`, `post_response` and
+`leaderboard_response` in feed.views), so the JSON bodies are identical.
+Every other method, and GETs asking for HTML (the browsable API), fall
+through to the sync DRF view of the same route.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404
+from rest_framework import exceptions
+from rest_framework.authentication import get_authorization_header
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import exception_handler
+
+from .authentication import aget_user
+from .pagination import PostFeedPagination
+from .views import (
+    PostListView, PostDetailView, LeaderboardView, feed_page_response, leaderboard_response, not_modified,
+    post_response, post_validators, set_validators,
+)
+
+renderer = JSONRenderer()
+
+
+def render(response):
+    """Prepare a DRF Response for rendering as JSON outside of an APIView."""
+    response.accepted_renderer = renderer
+    response.accepted_media_type = renderer.media_type
+    response.renderer_context = {}
+    return response
+
+
+async def authenticate(request):
+    """Async equivalent of the CachedTokenAuthentication + SessionAuthentication pair."""
+    # Set by APIClient.force_authenticate in tests, as DRF's Request honours it.
+    forced = getattr(request, '_force_auth_user', None)
+    if forced is not None:
+        return forced
+
+    auth = get_authorization_header(request).split()
+    if auth and auth[0].lower() == b'token':
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed('Invalid token header. No credentials provided.')
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain spaces.')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(
+                'Invalid token header. Token string should not contain invalid characters.'
+            )
+        return await aget_user(key)
+    return await request.auser()
+
+
+def wants_html(request):
+    """Whether a GET is for the browsable API, which only the sync DRF views render."""
+    return request.GET.get('format') == 'api' or 'text/html' in request.headers.get('Accept', '')
+
+
+def async_reads(sync_view):
+    """
+    Serve JSON GETs with the decorated coroutine, rendering the DRF Response
+    it returns, and anything else with `sync_view`.
+    """
+    fallback = sync_to_async(sync_view)
+
+    def decorator(handler):
+        @wraps(handler)
+        async def view(request, *args, **kwargs):
+            if request.method != 'GET' or wants_html(request):
+                return await fallback(request, *args, **kwargs)
+            api_request = Request(request, authenticators=())
+            try:
+                api_request.user = await authenticate(request)
+                response = await handler(api_request, *args, **kwargs)
+            except exceptions.AuthenticationFailed as exc:
+                exc.auth_header = 'Token'
+                response = exception_handler(exc, {'request': api_request})
+            except Exception as exc:
+                response = exception_handler(exc, {'request': api_request})
+                if response is None:
+                    raise
+            # 304s and streamed bodies are plain Django responses.
+            return render(response) if isinstance(response, Response) else response
+
+        # Unsafe methods go to the DRF view, which enforces CSRF itself.
+        view.csrf_exempt = True
+        return view
+
+    return decorator
+
+
+@async_reads(PostListView.as_view())
+async def post_list(request):
+    paginator = PostFeedPagination()
+    posts = await paginator.apaginate_queryset(PostListView.queryset.with_liked(request.user), request)
+    return feed_page_response(request, posts, paginator)
+
+
+@async_reads(PostDetailView.as_view())
+async def post_detail(request, pk):
+    post = await aget_object_or_404(PostDetailView.queryset.with_liked(request.user), pk=pk)
+    validators = post_validators(request, [post], dated=True)
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+    # The comment page or the cached tree and the user's likes on it: a few
+    # small queries, made in one thread hop.
+    return set_validators(await sync_to_async(post_response)(request, post), validators)
+
+
+@async_reads(LeaderboardView.as_view())
+async def leaderboard(request):
+    # Usually a cache hit; on a miss the rollup queries run in a worker thread.
+    return await sync_to_async(leaderboard_response)(request)
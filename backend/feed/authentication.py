@@ -0,0 +1,136 @@
+"""
+Token authentication without a database query per request.
+
+`CachedTokenAuthentication` is a drop-in replacement for DRF's
+`TokenAuthentication`. Token -> user lookups are kept in a bounded LRU of
+this process for TOKEN_CACHE_TTL seconds, and in the shared Django cache for
+TOKEN_SHARED_CACHE_TTL seconds, so only the first request with a token on a
+worker (or on the whole deployment, with a shared backend) joins Token and
+User.
+
+Deleting a token and saving a user (e.g. deactivating it) invalidate the
+entries through `feed.signals`. That clears the shared cache and this
+process's LRU, at once and again when the transaction commits; other
+processes' LRUs keep the entry for at most TOKEN_CACHE_TTL seconds. DRF
+has no token rotation of its own: a rotated token is a new Token row and
+the deletion of the old one.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+class LRUCache:
+    """Thread-safe mapping of at most `size` entries, each kept for `ttl` seconds."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+tokens = LRUCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+def _cache_key(key):
+    # Keep raw tokens out of cache keys (and file names of file-based caches).
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def _forget(key):
+    tokens.delete(key)
+    cache.delete(_cache_key(key))
+
+
+def invalidate(key):
+    """Forget the user cached for token `key`."""
+    # Now, and again on commit: until then a concurrent request can still
+    # read the token row and cache it for TOKEN_SHARED_CACHE_TTL seconds.
+    _forget(key)
+    transaction.on_commit(lambda: _forget(key))
+
+
+def invalidate_user(user):
+    """Forget the cached lookups of `user`'s token."""
+    for key in Token.objects.filter(user=user).values_list('key', flat=True):
+        invalidate(key)
+
+
+def _check(user):
+    if user is None:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if not user.is_active:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    return user
+
+
+def _load(key):
+    user = cache.get(_cache_key(key))
+    if user is None:
+        token = Token.objects.select_related('user').filter(key=key).first()
+        if token is None:
+            return None
+        user = token.user
+        cache.set(_cache_key(key), user, settings.TOKEN_SHARED_CACHE_TTL)
+    tokens.set(key, user)
+    return user
+
+
+def get_user(key):
+    """The active user of token `key`; raises AuthenticationFailed."""
+    user = tokens.get(key)
+    if user is None:
+        user = _load(key)
+    return _check(user)
+
+
+async def aget_user(key):
+    """`get_user` for async views; only a miss of the local LRU leaves the event loop."""
+    user = tokens.get(key)
+    if user is None:
+        user = await sync_to_async(_load)(key)
+    return _check(user)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        user = get_user(key)
+        # request.auth, as TokenAuthentication sets it, without loading the row.
+        return user, Token(key=key, user=user)
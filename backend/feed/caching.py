@@ -0,0 +1,90 @@
+"""
+Versioned read-through caching on top of Django's cache framework.
+
+A cached value is stored together with the namespace version it was computed
+for. Writers invalidate by bumping the version (`bump_version`) instead of
+deleting keys, which is a single atomic `incr` on backends that support it.
+Readers recompute on a version mismatch or when the entry's TTL has passed;
+only the worker that wins the recompute lock does the work, while the others
+keep serving the previous value. Works with any backend, including locmem and
+file-based caches.
+"""
+import time
+
+from django.core.cache import cache
+
+# How long an expired entry is kept around to be served while one worker
+# recomputes it.
+STALE_GRACE = 300
+
+
+def _incr(key, delta=1):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        if cache.add(key, delta, timeout=None):
+            return delta
+        return cache.incr(key, delta)
+
+
+def get_version(namespace):
+    key = f'{namespace}:version'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_version(namespace):
+    """Invalidate every entry cached under `namespace`."""
+    _incr(f'{namespace}:version')
+
+
+def stats(namespace):
+    return {
+        outcome: cache.get(f'{namespace}:{outcome}', 0)
+        for outcome in ('hits', 'misses', 'stale')
+    }
+
+
+def get_or_compute(namespace, compute, ttl, lock_timeout=10, poll_interval=0.05, entry_name=None):
+    """
+    Return `(value, outcome)` for the entry cached under `namespace`, where
+    outcome is 'hit', 'stale' or 'miss'. `compute` is called only on a miss,
+    and at most one caller at a time recomputes the entry. A namespace may
+    hold several entries, told apart by `entry_name`; bumping its version
+    invalidates them all.
+    """
+    prefix = f'{namespace}:{entry_name}' if entry_name is not None else namespace
+    data_key = f'{prefix}:data'
+    lock_key = f'{prefix}:lock'
+    version = get_version(namespace)
+    entry = cache.get(data_key)
+    if entry is not None and entry[0] == version and entry[1] > time.time():
+        _incr(f'{namespace}:hits')
+        return entry[2], 'hit'
+
+    locked = cache.add(lock_key, 1, lock_timeout)
+    if not locked:
+        # Another worker is recomputing. Serve what we have, or wait briefly
+        # for its result rather than piling onto the database.
+        if entry is not None:
+            _incr(f'{namespace}:stale')
+            return entry[2], 'stale'
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline and cache.get(lock_key) is not None:
+            time.sleep(poll_interval)
+            entry = cache.get(data_key)
+            if entry is not None and entry[0] == version:
+                _incr(f'{namespace}:hits')
+                return entry[2], 'hit'
+
+    _incr(f'{namespace}:misses')
+    try:
+        value = compute()
+        cache.set(data_key, (version, time.time() + ttl, value), timeout=ttl + STALE_GRACE)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value, 'miss'
@@ -0,0 +1,52 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Post, Comment, PostLike, CommentLike, post_activity
+from .ranking import refresh_hot_scores
+
+# (model, counter field, counted model, FK from counted model to `model`)
+COUNTERS = [
+    (Post, 'likes_count', PostLike, 'post'),
+    (Post, 'comments_count', Comment, 'post'),
+    (Comment, 'likes_count', CommentLike, 'comment'),
+]
+
+
+def actual_count(source, fk):
+    """Correlated subquery counting `source` rows that point at the outer row."""
+    return Coalesce(
+        Subquery(
+            source.objects.filter(**{fk: OuterRef('pk')})
+            .order_by().values(fk).annotate(n=Count('*')).values('n')
+        ),
+        0,
+        output_field=IntegerField(),
+    )
+
+
+def reconcile_counters(dry_run=False):
+    """
+    Recompute every denormalized counter from the source tables and rewrite
+    the rows that drifted. Returns {'Model.field': drifted_row_count}.
+    """
+    drift = {}
+    for model, field, source, fk in COUNTERS:
+        drifted = model.objects.annotate(
+            actual=actual_count(source, fk)
+        ).exclude(**{field: F('actual')})
+        count = drifted.count()
+        if count and not dry_run:
+            # Repaired counts change what the feed and post detail serve.
+            if model is Post:
+                post_ids = list(drifted.values_list('pk', flat=True))
+                Post.objects.filter(pk__in=post_ids).update(
+                    **{field: actual_count(source, fk)}, **post_activity(comments=field == 'comments_count')
+                )
+                refresh_hot_scores(Post.objects.filter(pk__in=post_ids))
+            else:
+                Post.objects.filter(pk__in=drifted.values('post_id')).update(**post_activity(comments=True))
+                model.objects.filter(pk__in=drifted.values('pk')).update(
+                    **{field: actual_count(source, fk)}
+                )
+        drift[f'{model.__name__}.{field}'] = count
+    return drift
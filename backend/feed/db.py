@@ -0,0 +1,50 @@
+"""
+Retrying write transactions that lose SQLite's write lock.
+
+SQLite lets one connection write at a time. With the profile in
+core.settings (WAL, `transaction_mode: IMMEDIATE`) a transaction takes the
+write lock in its BEGIN and waits up to the busy timeout for it, so writers
+queue instead of failing halfway through. A writer still waiting when the
+timeout runs out gets "database is locked" before it has done anything, so
+the transaction can simply run again: `retry_on_lock` does that a few times,
+after a growing, randomized delay so that retries do not arrive in step.
+
+Other databases make writers wait on row locks and never raise this error;
+the decorator then only costs a function call.
+"""
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+LOCK_ERRORS = ('database is locked', 'database table is locked')
+
+
+def is_lock_error(error):
+    return connection.vendor == 'sqlite' and any(message in str(error) for message in LOCK_ERRORS)
+
+
+def retry_on_lock(func):
+    """
+    Run `func`, which should make its writes in one transaction of its own,
+    again when it fails on the write lock: at most DATABASE_LOCK_RETRIES
+    more times, after DATABASE_LOCK_RETRY_DELAY seconds doubling each time.
+    Called inside a transaction it runs once, as only the outermost block
+    can be restarted.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if connection.in_atomic_block:
+            return func(*args, **kwargs)
+        for attempt in range(settings.DATABASE_LOCK_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if not is_lock_error(error):
+                    raise
+            delay = settings.DATABASE_LOCK_RETRY_DELAY * 2 ** attempt
+            time.sleep(random.uniform(delay / 2, delay))
+        return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,333 @@
+"""
+Incrementally maintained karma leaderboard.
+
+Every like that earns karma has a row in the `KarmaEvent` ledger and is
+rolled up into a per-user `KarmaBucket` for its clock hour. `UserKarma` holds
+each user's score for a rolling window as the sum of the buckets newer than
+`window hour - window length`: new karma is added as it lands, and when the
+clock passes an hour boundary the buckets that fell out of the window are
+subtracted (see `advance_window`). Reading the leaderboard is then a small
+indexed lookup instead of a join over every like.
+
+Stored scores cover whole hours, so the oldest hour of a window only
+partially overlaps it; that slice is read from the ledger (`_window`). It
+holds at most an hour of likes, so a ranking page is an index scan of the
+window's column merged with those few users, and a user's rank is an
+indexed count of the users above them (see `ranking` and `rank`).
+"""
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncHour
+from django.utils import timezone
+
+from . import caching
+from .models import PostLike, CommentLike, KarmaEvent, KarmaBucket, UserKarma, KarmaWindow
+
+POINTS = {
+    KarmaEvent.POST_LIKE: 5,
+    KarmaEvent.COMMENT_LIKE: 1,
+}
+
+# Window name -> length. Each window has a `karma_<name>` column on UserKarma.
+WINDOWS = {
+    '1h': timedelta(hours=1),
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+}
+DEFAULT_WINDOW = '24h'
+
+HOUR = timedelta(hours=1)
+
+# Cache namespace of the leaderboards (one entry per window); bumped
+# whenever karma changes.
+LEADERBOARD_CACHE = 'leaderboard'
+
+BATCH_SIZE = 1000
+
+
+def floor_hour(dt):
+    return dt.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _increment(model, lookup, deltas):
+    """Add `deltas` ({column: n}) to the row matching `lookup`, creating it if needed."""
+    changes = {column: F(column) + delta for column, delta in deltas.items()}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Lost a race with a concurrent insert; the row exists now.
+        model.objects.filter(**lookup).update(**changes)
+
+
+def advance_window(name, now=None):
+    """
+    Slide window `name` forward to the current hour, expiring the buckets
+    that fell out of it. Returns the window's hour.
+    """
+    length = WINDOWS[name]
+    hour = floor_hour(now or timezone.now())
+    window = KarmaWindow.objects.filter(name=name).first()
+    if window is None:
+        window, _ = KarmaWindow.objects.get_or_create(name=name, defaults={'hour': hour})
+    if window.hour >= hour:
+        return window.hour
+
+    with transaction.atomic():
+        window = KarmaWindow.objects.select_for_update().get(name=name)
+        if window.hour >= hour:
+            return window.hour
+        column = f'karma_{name}'
+        expired = KarmaBucket.objects.filter(
+            hour__gt=window.hour - length, hour__lte=hour - length
+        )
+        expired_total = Subquery(
+            expired.filter(user=OuterRef('user'))
+            .order_by().values('user').annotate(total=Sum('karma')).values('total')
+        )
+        UserKarma.objects.filter(user__in=expired.values('user')).update(
+            **{column: F(column) - Coalesce(expired_total, 0)}
+        )
+        window.hour = hour
+        window.save(update_fields=['hour'])
+    return hour
+
+
+def advance_windows(now=None):
+    """`advance_window` for every window, in one query while none is behind; returns {name: hour}."""
+    hour = floor_hour(now or timezone.now())
+    hours = dict(KarmaWindow.objects.values_list('name', 'hour'))
+    return {
+        name: hours[name] if name in hours and hours[name] >= hour else advance_window(name, now)
+        for name in WINDOWS
+    }
+
+
+def invalidate_leaderboard():
+    # Bump now so readers in this process stop using the cached ranking, and
+    # again on commit in case one of them recomputed it before we committed.
+    caching.bump_version(LEADERBOARD_CACHE)
+    transaction.on_commit(lambda: caching.bump_version(LEADERBOARD_CACHE))
+
+
+def apply_karma(recipient_id, points, at):
+    """Add `points` (negative to remove) earned at time `at` to a user's karma."""
+    invalidate_leaderboard()
+    hour = floor_hour(at)
+    # Advance first: expiring the bucket after adding to it would subtract
+    # these points from the window as well as skip them below.
+    window_hours = advance_windows()
+    _increment(KarmaBucket, {'user_id': recipient_id, 'hour': hour}, {'karma': points})
+
+    deltas = {}
+    for name, length in WINDOWS.items():
+        if hour > window_hours[name] - length:
+            deltas[f'karma_{name}'] = points
+    if deltas:
+        _increment(UserKarma, {'user_id': recipient_id}, deltas)
+
+
+def record_like(source, like_id, recipient_id, created_at, new=False):
+    """
+    Ledger a like (new or re-timestamped) and credit the recipient. Pass
+    `new=True` for a like that was just inserted to skip the ledger lookup.
+    """
+    points = POINTS[source]
+    event = None if new else KarmaEvent.objects.filter(source=source, source_id=like_id).first()
+    if event is None:
+        KarmaEvent.objects.create(
+            recipient_id=recipient_id, source=source, source_id=like_id,
+            points=points, created_at=created_at,
+        )
+        apply_karma(recipient_id, points, created_at)
+    elif event.created_at != created_at or event.recipient_id != recipient_id:
+        apply_karma(event.recipient_id, -event.points, event.created_at)
+        apply_karma(recipient_id, points, created_at)
+        event.recipient_id = recipient_id
+        event.points = points
+        event.created_at = created_at
+        event.save(update_fields=['recipient', 'points', 'created_at'])
+
+
+def forget_like(source, like_id):
+    """Remove a deleted like from the ledger and take back its karma."""
+    event = KarmaEvent.objects.filter(source=source, source_id=like_id).first()
+    if event is not None:
+        apply_karma(event.recipient_id, -event.points, event.created_at)
+        event.delete()
+
+
+def _apply_grouped(events, sign):
+    """Apply karma for [(recipient_id, points, created_at)], one update per recipient and hour."""
+    totals = Counter()
+    for recipient_id, points, created_at in events:
+        totals[(recipient_id, floor_hour(created_at))] += sign * points
+    for (recipient_id, hour), points in totals.items():
+        apply_karma(recipient_id, points, hour)
+
+
+def record_new_likes(source, likes):
+    """Ledger just-inserted likes, given as [(like_id, recipient_id, created_at)], in bulk."""
+    if not likes:
+        return
+    points = POINTS[source]
+    KarmaEvent.objects.bulk_create([
+        KarmaEvent(recipient_id=recipient_id, source=source, source_id=like_id,
+                   points=points, created_at=created_at)
+        for like_id, recipient_id, created_at in likes
+    ])
+    _apply_grouped([(recipient_id, points, created_at) for _, recipient_id, created_at in likes], 1)
+
+
+def forget_likes(source, like_ids):
+    """`forget_like` for many deleted likes at once."""
+    if not like_ids:
+        return
+    events = KarmaEvent.objects.filter(source=source, source_id__in=like_ids)
+    rows = list(events.values_list('recipient_id', 'points', 'created_at'))
+    events.delete()
+    _apply_grouped(rows, -1)
+
+
+def _window(name, now):
+    """
+    (column, exact totals) of window `name`: its UserKarma column, and the
+    karma in the window of every user with karma in its partially covered
+    oldest hour, whose stored score misses that slice.
+    """
+    length = WINDOWS[name]
+    column = f'karma_{name}'
+    hour = advance_window(name, now)
+
+    # Stored scores cover the buckets after `hour - length`. The oldest hour
+    # only partially overlaps the window, so read that slice from the ledger.
+    partial = dict(
+        KarmaEvent.objects.filter(created_at__gte=now - length, created_at__lt=hour - length + HOUR)
+        .values_list('recipient').annotate(total=Sum('points')).order_by()
+    )
+    stored = dict(UserKarma.objects.filter(user_id__in=list(partial)).values_list('user_id', column))
+    return column, {user_id: stored.get(user_id, 0) + points for user_id, points in partial.items()}
+
+
+def ranking(window=DEFAULT_WINDOW, limit=5, after=None, now=None):
+    """
+    The next `limit` users with karma earned from likes created in the last
+    `window`, as [(user_id, karma)] by karma descending then user id, after
+    the (karma, user_id) pair `after`.
+    """
+    now = now or timezone.now()
+    column, exact = _window(window, now)
+
+    def comes_after(user_id, karma):
+        return after is None or (-karma, user_id) > (-after[0], after[1])
+
+    # Everyone else's total is their stored score: read them in index order.
+    stored = UserKarma.objects.filter(**{f'{column}__gt': 0}).exclude(user_id__in=list(exact))
+    if after is not None:
+        stored = stored.filter(**{f'{column}__lte': after[0]}).filter(
+            Q(**{f'{column}__lt': after[0]}) | Q(**{column: after[0], 'user_id__gt': after[1]})
+        )
+    rows = list(stored.order_by(f'-{column}', 'user_id').values_list('user_id', column)[:limit])
+    rows += [(user_id, karma) for user_id, karma in exact.items() if karma > 0 and comes_after(user_id, karma)]
+    return sorted(rows, key=lambda row: (-row[1], row[0]))[:limit]
+
+
+def rank(user_id, window=DEFAULT_WINDOW, now=None):
+    """
+    (rank, karma) of a user in `window`: 1 + the number of users with more
+    karma, so that ties share a rank. Rank is None without karma.
+    """
+    now = now or timezone.now()
+    column, exact = _window(window, now)
+    karma = exact.get(user_id)
+    if karma is None:
+        karma = UserKarma.objects.filter(user_id=user_id).values_list(column, flat=True).first() or 0
+    if karma <= 0:
+        return None, karma
+    above = UserKarma.objects.filter(**{f'{column}__gt': karma}).exclude(user_id__in=list(exact)).count()
+    above += sum(1 for total in exact.values() if total > karma)
+    return above + 1, karma
+
+
+def leaderboard(limit=5, now=None, window=DEFAULT_WINDOW):
+    """
+    Top `limit` users by karma earned from likes created in the last
+    `window`, as [{'username': ..., 'karma': ...}] ordered by karma descending.
+    """
+    ranked = ranking(window, limit, now=now)
+    usernames = dict(
+        User.objects.filter(pk__in=[user_id for user_id, _ in ranked]).values_list('id', 'username')
+    )
+    return [{'username': usernames[user_id], 'karma': karma} for user_id, karma in ranked]
+
+
+def _batched(iterable, size=BATCH_SIZE):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def rebuild_karma(now=None):
+    """
+    Rebuild the ledger, hourly buckets and window scores from the like tables.
+    Streams rows in batches so memory stays flat on large tables.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        UserKarma.objects.all().delete()
+        KarmaBucket.objects.all().delete()
+        KarmaEvent.objects.all().delete()
+        KarmaWindow.objects.all().delete()
+
+        sources = [
+            (KarmaEvent.POST_LIKE, PostLike.objects.values_list('id', 'post__author_id', 'created_at')),
+            (KarmaEvent.COMMENT_LIKE, CommentLike.objects.values_list('id', 'comment__author_id', 'created_at')),
+        ]
+        for source, rows in sources:
+            events = (
+                KarmaEvent(
+                    recipient_id=recipient_id, source=source, source_id=like_id,
+                    points=POINTS[source], created_at=created_at,
+                )
+                for like_id, recipient_id, created_at in rows.order_by().iterator(chunk_size=BATCH_SIZE)
+            )
+            for batch in _batched(events):
+                KarmaEvent.objects.bulk_create(batch)
+
+        buckets = (
+            KarmaBucket(user_id=user_id, hour=hour, karma=karma)
+            for user_id, hour, karma in KarmaEvent.objects.annotate(hour=TruncHour('created_at'))
+            .values_list('recipient', 'hour').annotate(karma=Sum('points')).order_by()
+            .iterator(chunk_size=BATCH_SIZE)
+        )
+        for batch in _batched(buckets):
+            KarmaBucket.objects.bulk_create(batch)
+
+        hour = floor_hour(now)
+        for name, length in WINDOWS.items():
+            KarmaWindow.objects.create(name=name, hour=hour)
+        columns = [f'karma_{name}' for name in WINDOWS]
+        scores = (
+            UserKarma(user_id=user_id, **{
+                column: total or 0 for column, total in zip(columns, totals)
+            })
+            for user_id, *totals in KarmaBucket.objects.values_list('user').annotate(**{
+                f'karma_{name}': Sum('karma', filter=Q(hour__gt=hour - length))
+                for name, length in WINDOWS.items()
+            }).order_by().iterator(chunk_size=BATCH_SIZE)
+        )
+        for batch in _batched(scores):
+            UserKarma.objects.bulk_create(batch)
+        invalidate_leaderboard()
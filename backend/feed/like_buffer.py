@@ -0,0 +1,298 @@
+"""
+Write-behind buffer for like toggles (settings.LIKE_WRITE_BEHIND).
+
+In this mode a toggle, or a batch of like/unlike operations, reads the
+targets and the user's current likes (one SELECT per target type) and
+records the new states in memory instead of writing them. States are
+collapsed per (type, user, target): toggling twice cancels out, and only the
+final state of each pair is written. A background thread flushes the buffer
+every LIKE_FLUSH_INTERVAL seconds, or as soon as it holds LIKE_BUFFER_SIZE
+pairs, through `feed.likes.apply_likes` in a single transaction, so a burst of
+likes on one hot post costs one commit instead of one per like.
+
+Reads overlay the pending states with `overlay`, so users see their own
+likes, and the counters include everyone's pending likes, before the flush.
+Flushing is idempotent (`apply_likes` only counts rows it actually inserts
+or deletes), so a stale read of the database can make a pending count
+briefly off, but never the stored counters. A state is always recorded
+against the database it was read from: a toggle whose read raced a flush's
+commit reads again, and when a flush fails, the states recorded on top of
+it are rebased on the database it left unchanged.
+
+The buffer lives in the process, so this mode needs a single worker: a
+toggle in another worker would build on a database state that misses this
+one's pending likes, and two clicks split between workers could both like.
+The first process to buffer a like takes a lock on the file
+LIKE_BUFFER_LOCK, held until it exits, and likes sent to any other process
+on the machine raise ImproperlyConfigured. (Where fcntl is missing, as on
+Windows, nothing is checked.)
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef
+from django.http import Http404
+
+from .likes import TARGETS, apply_likes
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer:
+    """Pending like states of this process, and the thread that flushes them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (kind, user_id, target_id) -> (liked, liked in the database when read)
+        self.pending = {}
+        # (kind, target_id) -> likes_count change the pending states make
+        self.deltas = Counter()
+        # The same for the batch being written by `flush`, still overlaid
+        # until its transaction commits.
+        self.in_flight = {}
+        self.in_flight_deltas = Counter()
+        # Bumped by every flush that commits: reads from an older generation
+        # may miss what it wrote.
+        self.generation = 0
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        # The open LIKE_BUFFER_LOCK, and the process holding its lock.
+        self.lock_file = None
+        self.lock_pid = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    @property
+    def has_pending(self):
+        """Whether reads may differ from the database (see `overlay`)."""
+        return bool(self.pending or self.in_flight)
+
+    def _read(self, kind, user_id, target_ids):
+        """{target_id: (likes_count, liked)} from the database, for the targets that exist."""
+        target = TARGETS[kind]
+        liked = target.like_model.objects.filter(**{'user_id': user_id, target.column: OuterRef('pk')})
+        rows = (
+            target.target_model.objects.filter(pk__in=target_ids)
+            .annotate(liked=Exists(liked)).values_list('pk', 'likes_count', 'liked')
+        )
+        return {target_id: (likes_count, was_liked) for target_id, likes_count, was_liked in rows}
+
+    def _record(self, kind, user_id, target_id, likes_count, was_liked, liked=None):
+        """
+        Record the pair's new state, `liked` or (None) the opposite of its
+        current one, given the database state read before; returns (liked,
+        likes_count, whether the buffer is full). Call with `self.lock` held.
+        """
+        key = (kind, user_id, target_id)
+        target_key = (kind, target_id)
+        # A batch being flushed decides the database state this one builds
+        # on, and the state is kept even when it matches, for `flush` to
+        # rebase should that batch fail.
+        in_flight = key in self.in_flight
+        if in_flight:
+            was_liked = self.in_flight[key][0]
+        entry = self.pending.get(key)
+        if liked is None:
+            liked = not (entry[0] if entry else was_liked)
+        if entry:
+            del self.pending[key]
+            self.deltas[target_key] -= entry[0] - entry[1]
+        if liked != was_liked or in_flight:
+            self.pending[key] = (liked, was_liked)
+            self.deltas[target_key] += liked - was_liked
+        likes_count += self.deltas[target_key] + self.in_flight_deltas[target_key]
+        return liked, likes_count, len(self.pending) >= settings.LIKE_BUFFER_SIZE
+
+    def _recorded(self, full):
+        """Flush a full buffer, and make sure the flusher runs."""
+        if full:
+            if self.start():
+                self.wakeup.set()
+            else:
+                self.flush()
+        else:
+            self.start()
+
+    def claim(self):
+        """Lock LIKE_BUFFER_LOCK for this process, or raise ImproperlyConfigured if another holds it."""
+        path = settings.LIKE_BUFFER_LOCK
+        if fcntl is None or (self.lock_pid == os.getpid() and self.lock_file.name == path):
+            return
+        with self.lock:
+            if self.lock_pid == os.getpid() and self.lock_file.name == path:
+                return
+            # Closed first: closing any descriptor of a file drops the
+            # process's locks on it, including one just taken.
+            if self.lock_file is not None:
+                self.lock_file.close()
+                self.lock_file = self.lock_pid = None
+            lock_file = open(path, 'a')
+            try:
+                # A POSIX lock belongs to the process: forked workers do not share it.
+                fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise ImproperlyConfigured(
+                    f'LIKE_WRITE_BEHIND needs a single worker process, but another one holds {path}.'
+                )
+            self.lock_file, self.lock_pid = lock_file, os.getpid()
+
+    def release(self):
+        """Drop this process's lock on LIKE_BUFFER_LOCK, if it holds one."""
+        with self.lock:
+            if self.lock_file is not None:
+                self.lock_file.close()
+                self.lock_file = self.lock_pid = None
+
+    def toggle(self, kind, user_id, target_id):
+        """Buffered equivalent of `feed.likes.toggle_like`: returns (liked, likes_count)."""
+        self.claim()
+        while True:
+            generation = self.generation
+            row = self._read(kind, user_id, [target_id]).get(target_id)
+            if row is None:
+                target = TARGETS[kind]
+                raise Http404(f'No {target.target_model._meta.object_name} matches the given query.')
+            with self.lock:
+                # A flush committed since the read, which may have missed it.
+                if self.generation != generation:
+                    continue
+                liked, likes_count, full = self._record(kind, user_id, target_id, *row)
+                break
+        self._recorded(full)
+        return liked, likes_count
+
+    def apply(self, user_id, operations):
+        """
+        Buffered equivalent of `feed.likes.apply_likes`, with the same
+        results: sets the state of each pair, pending toggles included.
+        """
+        self.claim()
+        wanted = {}
+        for kind, target_id, liked in operations:
+            wanted[(kind, target_id)] = liked
+        while True:
+            generation = self.generation
+            rows = {
+                kind: self._read(kind, user_id, [target_id for k, target_id in wanted if k == kind])
+                for kind in {kind for kind, _ in wanted}
+            }
+            results = []
+            full = False
+            with self.lock:
+                # As in `toggle`: read again after a flush's commit.
+                if self.generation != generation:
+                    continue
+                for (kind, target_id), liked in wanted.items():
+                    row = rows[kind].get(target_id)
+                    if row is None:
+                        results.append({'type': kind, 'id': target_id, 'error': 'Not found.'})
+                        continue
+                    liked, likes_count, full = self._record(kind, user_id, target_id, *row, liked=liked)
+                    results.append({'type': kind, 'id': target_id, 'liked': liked, 'likes_count': likes_count})
+                break
+        self._recorded(full)
+        return results
+
+    def overlay(self, kind, user, nodes):
+        """
+        Apply the pending states to serialized posts or comments (dicts with
+        'id', 'likes_count' and 'is_liked'; comments' 'replies' included).
+        """
+        if not self.has_pending:
+            return nodes
+        user_id = user.id if user.is_authenticated else None
+        with self.lock:
+            stack = list(nodes)
+            while stack:
+                node = stack.pop()
+                target_key = (kind, node['id'])
+                node['likes_count'] += self.deltas[target_key] + self.in_flight_deltas[target_key]
+                key = (kind, user_id, node['id'])
+                entry = self.pending.get(key) or self.in_flight.get(key)
+                if entry is not None:
+                    node['is_liked'] = entry[0]
+                stack.extend(node.get('replies', ()))
+        return nodes
+
+    def flush(self):
+        """Write the pending states in one transaction; returns how many were written."""
+        with self.flush_lock:
+            with self.lock:
+                self.in_flight, self.pending = self.pending, {}
+                self.in_flight_deltas, self.deltas = self.deltas, Counter()
+            if not self.in_flight:
+                return 0
+
+            by_user = defaultdict(list)
+            for (kind, user_id, target_id), (liked, _) in self.in_flight.items():
+                by_user[user_id].append((kind, target_id, liked))
+            try:
+                with transaction.atomic():
+                    for user_id, operations in by_user.items():
+                        apply_likes(user_id, operations)
+            except Exception:
+                # Put the batch back. States recorded on top of it since
+                # assumed it written: rebase them on the database as it is.
+                with self.lock:
+                    for key, (liked, was_liked) in self.in_flight.items():
+                        target_key = (key[0], key[2])
+                        entry = self.pending.pop(key, None)
+                        if entry is not None:
+                            self.deltas[target_key] -= entry[0] - entry[1]
+                            liked = entry[0]
+                        if liked != was_liked:
+                            self.pending[key] = (liked, was_liked)
+                            self.deltas[target_key] += liked - was_liked
+                    self.in_flight, self.in_flight_deltas = {}, Counter()
+                raise
+
+            with self.lock:
+                written = len(self.in_flight)
+                self.in_flight, self.in_flight_deltas = {}, Counter()
+                self.generation += 1
+            return written
+
+    def start(self):
+        """Start the flusher thread unless LIKE_FLUSH_INTERVAL is 0; returns whether it runs."""
+        if not settings.LIKE_FLUSH_INTERVAL:
+            return False
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self.run, name='like-flusher', daemon=True)
+                    self.thread.start()
+        return True
+
+    def run(self):
+        while True:
+            self.wakeup.wait(settings.LIKE_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing buffered likes failed')
+            finally:
+                close_old_connections()
+
+
+buffer = LikeBuffer()
+
+
+@atexit.register
+def _flush_at_exit():
+    if buffer.pending:
+        buffer.flush()
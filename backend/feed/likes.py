@@ -0,0 +1,251 @@
+"""
+Like toggles in as few statements as possible.
+
+A toggle first tries `INSERT ... ON CONFLICT DO NOTHING RETURNING`, inserting
+only if the target exists. If the like was already there, it is removed with
+`DELETE ... RETURNING`. Liking costs one statement on the like table and
+unliking two, with no read of the like row first and no savepoint. The
+target's counter is then adjusted by an `UPDATE ... RETURNING`, which also
+yields the new count for the response and the author who earns the karma.
+
+The same statement bumps the version of the post (for a comment like, a
+second one that of its post and its comments_version), which the feed and post detail ETags derive
+from, and moves a liked post's hot score (see `feed.ranking`).
+
+The unique (user, target) constraint decides concurrent toggles: an insert
+that loses a race affects no rows and leaves the counter alone, so the
+counter can never drift from the like table.
+
+`apply_likes` does the same for a batch of like/unlike operations, with one
+multi-row statement of each kind per target type.
+
+These statements bypass the model save/delete signals, so karma is credited
+here directly rather than by `feed.signals`.
+
+Both run again if their transaction times out on SQLite's write lock (see
+`feed.db.retry_on_lock`).
+"""
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.http import Http404
+from django.utils import timezone
+
+from . import karma, ranking
+from .db import retry_on_lock
+from .models import Post, Comment, PostLike, CommentLike, KarmaEvent
+
+# `post_column`: the target table's column holding the id of the post whose
+# version a like on the target bumps.
+LikeTarget = namedtuple('LikeTarget', ['like_model', 'target_model', 'column', 'source', 'post_column'])
+
+TARGETS = {
+    'post': LikeTarget(PostLike, Post, 'post_id', KarmaEvent.POST_LIKE, 'id'),
+    'comment': LikeTarget(CommentLike, Comment, 'comment_id', KarmaEvent.COMMENT_LIKE, 'post_id'),
+}
+
+
+def _tables(target):
+    quote = connection.ops.quote_name
+    return quote(target.like_model._meta.db_table), quote(target.target_model._meta.db_table)
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _touch(target, changed_ids, now):
+    """SET clause and params bumping the version of changed posts (see `Post.version`)."""
+    if target.target_model is not Post or not changed_ids:
+        return '', []
+    changed = _placeholders(changed_ids)
+    return (
+        f', version = version + CASE WHEN id IN ({changed}) THEN 1 ELSE 0 END'
+        f', last_activity_at = CASE WHEN id IN ({changed}) THEN %s ELSE last_activity_at END',
+        [*changed_ids, *changed_ids, connection.ops.adapt_datetimefield_value(now)],
+    )
+
+
+def _rescore(target, delta_sql, delta_params):
+    """SET clause and params moving the hot score of liked posts by `delta_sql` likes."""
+    if target.target_model is not Post:
+        return '', []
+    return ', ' + ranking.hot_score_increment_sql(delta_sql), delta_params * 2
+
+
+def touch_posts(cursor, post_ids, now):
+    """Bump the version and comments_version of `post_ids`, whose comments were liked."""
+    if not post_ids:
+        return
+    _, post_table = _tables(TARGETS['post'])
+    cursor.execute(
+        f'UPDATE {post_table} SET version = version + 1, comments_version = comments_version + 1, '
+        f'last_activity_at = %s '
+        f'WHERE id IN ({_placeholders(post_ids)})',
+        [connection.ops.adapt_datetimefield_value(now), *post_ids],
+    )
+
+
+def _adjust_count(cursor, target, target_id, delta, now):
+    """
+    Add `delta` to the target's likes_count and bump its post's version;
+    returns (likes_count, author_id).
+    """
+    _, target_table = _tables(target)
+    touch, touch_params = _touch(target, [target_id], now)
+    rescore, rescore_params = _rescore(target, '%s', [delta])
+    cursor.execute(
+        f'UPDATE {target_table} SET likes_count = likes_count + %s{touch}{rescore} WHERE id = %s '
+        f'RETURNING likes_count, author_id, {target.post_column}',
+        [delta, *touch_params, *rescore_params, target_id],
+    )
+    likes_count, author_id, post_id = cursor.fetchone()
+    if target.target_model is not Post:
+        touch_posts(cursor, [post_id], now)
+    return likes_count, author_id
+
+
+def insert_like(cursor, target, user_id, target_id, created_at):
+    """Insert the like unless it exists (or the target does not); returns its id or None."""
+    like_table, target_table = _tables(target)
+    cursor.execute(
+        f'INSERT INTO {like_table} (user_id, {target.column}, created_at) '
+        f'SELECT %s, id, %s FROM {target_table} WHERE id = %s '
+        f'ON CONFLICT (user_id, {target.column}) DO NOTHING RETURNING id',
+        [user_id, connection.ops.adapt_datetimefield_value(created_at), target_id],
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def delete_like(cursor, target, user_id, target_id):
+    """Delete the like if it exists; returns its id or None."""
+    like_table, _ = _tables(target)
+    cursor.execute(
+        f'DELETE FROM {like_table} WHERE user_id = %s AND {target.column} = %s RETURNING id',
+        [user_id, target_id],
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+@retry_on_lock
+def toggle_like(kind, user_id, target_id, now=None):
+    """
+    Like the post or comment (`kind`) `target_id` for `user_id`, or unlike it
+    if already liked. Returns (liked, likes_count); raises Http404 if the
+    target does not exist.
+    """
+    target = TARGETS[kind]
+    created_at = now or timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        like_id = insert_like(cursor, target, user_id, target_id, created_at)
+        if like_id is not None:
+            likes_count, author_id = _adjust_count(cursor, target, target_id, 1, created_at)
+            karma.record_like(target.source, like_id, author_id, created_at, new=True)
+            return True, likes_count
+
+        like_id = delete_like(cursor, target, user_id, target_id)
+        if like_id is not None:
+            likes_count, _ = _adjust_count(cursor, target, target_id, -1, created_at)
+            karma.forget_like(target.source, like_id)
+            return False, likes_count
+
+    # Either the target does not exist, or a concurrent toggle removed the
+    # like between our two statements.
+    likes_count = target.target_model.objects.filter(pk=target_id).values_list('likes_count', flat=True).first()
+    if likes_count is None:
+        raise Http404(f'No {target.target_model._meta.object_name} matches the given query.')
+    return False, likes_count
+
+
+def insert_likes(cursor, target, user_id, target_ids, created_at):
+    """Insert the likes that do not exist yet on existing targets; returns {target_id: like_id}."""
+    like_table, target_table = _tables(target)
+    cursor.execute(
+        f'INSERT INTO {like_table} (user_id, {target.column}, created_at) '
+        f'SELECT %s, id, %s FROM {target_table} WHERE id IN ({_placeholders(target_ids)}) '
+        f'ON CONFLICT (user_id, {target.column}) DO NOTHING RETURNING {target.column}, id',
+        [user_id, connection.ops.adapt_datetimefield_value(created_at), *target_ids],
+    )
+    return dict(cursor.fetchall())
+
+
+def delete_likes(cursor, target, user_id, target_ids):
+    """Delete the user's likes on `target_ids`; returns {target_id: like_id} of the deleted rows."""
+    like_table, _ = _tables(target)
+    cursor.execute(
+        f'DELETE FROM {like_table} WHERE user_id = %s AND {target.column} IN ({_placeholders(target_ids)}) '
+        f'RETURNING {target.column}, id',
+        [user_id, *target_ids],
+    )
+    return dict(cursor.fetchall())
+
+
+def _adjust_counts(cursor, target, deltas, now):
+    """
+    Add {target_id: delta} to the targets' likes_count in one statement and
+    bump the version of the posts that changed; returns {target_id:
+    (likes_count, author_id)} for the targets that exist.
+    """
+    _, target_table = _tables(target)
+    ids = list(deltas)
+    changed_ids = [target_id for target_id, delta in deltas.items() if delta]
+    delta = f"CASE id {' '.join(['WHEN %s THEN %s'] * len(ids))} ELSE 0 END"
+    delta_params = [value for item in deltas.items() for value in item]
+    touch, touch_params = _touch(target, changed_ids, now)
+    rescore, rescore_params = _rescore(target, delta, delta_params)
+    cursor.execute(
+        f'UPDATE {target_table} SET likes_count = likes_count + {delta}{touch}{rescore} '
+        f'WHERE id IN ({_placeholders(ids)}) RETURNING id, likes_count, author_id, {target.post_column}',
+        delta_params + touch_params + rescore_params + ids,
+    )
+    rows = cursor.fetchall()
+    if target.target_model is not Post:
+        touch_posts(cursor, sorted({post_id for target_id, _, _, post_id in rows if deltas[target_id]}), now)
+    return {target_id: (likes_count, author_id) for target_id, likes_count, author_id, _ in rows}
+
+
+@retry_on_lock
+def apply_likes(user_id, operations, now=None):
+    """
+    Apply [(kind, target_id, liked)] operations for `user_id` in one
+    transaction. Operations are idempotent: liking a liked target or
+    unliking an unliked one changes nothing, and the last operation on a
+    target wins. Returns one result per distinct target, in order of first
+    appearance: {'type', 'id', 'liked', 'likes_count'}, or {'type', 'id',
+    'error'} when the target does not exist.
+    """
+    created_at = now or timezone.now()
+    wanted = {}
+    for kind, target_id, liked in operations:
+        wanted[(kind, target_id)] = liked
+
+    counts = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        for kind, target in TARGETS.items():
+            to_like = [target_id for (k, target_id), liked in wanted.items() if k == kind and liked]
+            to_unlike = [target_id for (k, target_id), liked in wanted.items() if k == kind and not liked]
+            if not to_like and not to_unlike:
+                continue
+            inserted = insert_likes(cursor, target, user_id, to_like, created_at) if to_like else {}
+            deleted = delete_likes(cursor, target, user_id, to_unlike) if to_unlike else {}
+
+            deltas = dict.fromkeys(to_like + to_unlike, 0)
+            deltas.update(dict.fromkeys(inserted, 1))
+            deltas.update(dict.fromkeys(deleted, -1))
+            current = _adjust_counts(cursor, target, deltas, created_at)
+            counts.update({(kind, target_id): values[0] for target_id, values in current.items()})
+
+            karma.record_new_likes(target.source, [
+                (like_id, current[target_id][1], created_at) for target_id, like_id in inserted.items()
+            ])
+            karma.forget_likes(target.source, list(deleted.values()))
+
+    results = []
+    for (kind, target_id), liked in wanted.items():
+        if (kind, target_id) not in counts:
+            results.append({'type': kind, 'id': target_id, 'error': 'Not found.'})
+        else:
+            results.append({'type': kind, 'id': target_id, 'liked': liked, 'likes_count': counts[(kind, target_id)]})
+    return results
@@ -0,0 +1,201 @@
+import math
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from feed.karma import rebuild_karma
+from feed.models import Post, Comment, PostLike, CommentLike, path_segment
+from feed.ranking import hot_score
+
+WORDS = (
+    "community feed thread reply karma post like great idea agree thanks "
+    "question answer build ship design data query index cache fast slow "
+    "python django react today tomorrow really maybe always never"
+).split()
+
+
+class BulkInserter:
+    """Collects model instances and writes them with bulk_create in batches."""
+
+    def __init__(self, model, batch_size):
+        self.model = model
+        self.batch_size = batch_size
+        self.batch = []
+        self.count = 0
+
+    def add(self, obj):
+        self.batch.append(obj)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.model.objects.bulk_create(self.batch)
+            self.count += len(self.batch)
+            self.batch = []
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk_create keep the generated created_at instead of auto_now_add."""
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def next_id(model):
+    return (model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a deterministic synthetic dataset: users, posts, threaded "
+        "comments and likes spread over a time range. Rows are streamed into "
+        "batched bulk_create calls, so memory stays flat at any size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1, help="Random seed (default: 1).")
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--posts', type=int, default=3)
+        parser.add_argument('--comments-per-post', type=float, default=6,
+                            help="Mean comments per post (exponentially distributed).")
+        parser.add_argument('--reply-prob', type=float, default=0.7,
+                            help="Probability that a comment is a reply rather than top-level.")
+        parser.add_argument('--chain-prob', type=float, default=0.3,
+                            help="Probability that a reply answers the latest comment "
+                                 "(deep chains) instead of a random earlier one (wide trees).")
+        parser.add_argument('--max-depth', type=int, default=8, help="Deepest reply level.")
+        parser.add_argument('--likes-per-post', type=float, default=3,
+                            help="Mean likes per post (exponentially distributed, capped by --users).")
+        parser.add_argument('--likes-per-comment', type=float, default=1.5,
+                            help="Mean likes per comment.")
+        parser.add_argument('--days', type=float, default=7,
+                            help="Spread content over this many days before --end.")
+        parser.add_argument('--end', help="ISO timestamp of the newest activity (default: now).")
+        parser.add_argument('--password', default='pass123', help="Password of every generated user.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError("--users must be at least 1.")
+        end = timezone.now()
+        if options['end']:
+            end = datetime.fromisoformat(options['end'])
+            if timezone.is_naive(end):
+                end = timezone.make_aware(end)
+        self.rng = random.Random(options['seed'])
+        self.end = end
+        self.start = end - timedelta(days=options['days'])
+        self.options = options
+        started = time.monotonic()
+
+        with transaction.atomic(), explicit_timestamps(Post, Comment, PostLike, CommentLike):
+            counts = self.generate()
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [User, Post, Comment]):
+                    cursor.execute(sql)
+        rebuild_karma()
+
+        self.stdout.write(self.style.SUCCESS(
+            "Generated {users} users, {posts} posts, {comments} comments, "
+            "{post_likes} post likes and {comment_likes} comment likes in {seconds:.1f}s.".format(
+                seconds=time.monotonic() - started, **counts
+            )
+        ))
+
+    def text(self, low, high):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(low, high))).capitalize()
+
+    def after(self, moment):
+        """A random time between `moment` and the end of the range."""
+        return moment + (self.end - moment) * self.rng.random()
+
+    def amount(self, mean, cap):
+        if mean <= 0:
+            return 0
+        return min(cap, int(self.rng.expovariate(1 / mean)))
+
+    def generate(self):
+        options = self.options
+        rng = self.rng
+        batch_size = options['batch_size']
+
+        users = BulkInserter(User, batch_size)
+        posts = BulkInserter(Post, batch_size)
+        comments = BulkInserter(Comment, batch_size)
+        post_likes = BulkInserter(PostLike, batch_size)
+        comment_likes = BulkInserter(CommentLike, batch_size)
+
+        password = make_password(options['password'])
+        first_user = next_id(User)
+        user_count = options['users']
+        for user_id in range(first_user, first_user + user_count):
+            users.add(User(
+                id=user_id, username=f'user{user_id}', password=password,
+                date_joined=self.start,
+            ))
+        users.flush()
+
+        def random_user():
+            return first_user + rng.randrange(user_count)
+
+        def likers(mean):
+            return [first_user + i for i in rng.sample(range(user_count), self.amount(mean, user_count))]
+
+        post_id = next_id(Post)
+        comment_id = next_id(Comment)
+        span = (self.end - self.start).total_seconds()
+        for _ in range(options['posts']):
+            post_created = self.start + timedelta(seconds=span * rng.random())
+            thread = []  # (id, path, depth, created_at) of this post's comments
+            for _ in range(self.amount(options['comments_per_post'], math.inf)):
+                parent = None
+                if thread and rng.random() < options['reply_prob']:
+                    parent = thread[-1] if rng.random() < options['chain_prob'] else rng.choice(thread)
+                    if parent[2] >= options['max_depth']:
+                        parent = None
+                created = self.after(parent[3] if parent else post_created)
+                path = (parent[1] if parent else '') + path_segment(comment_id)
+                depth = parent[2] + 1 if parent else 0
+                likes = likers(options['likes_per_comment'])
+                comments.add(Comment(
+                    id=comment_id, author_id=random_user(), post_id=post_id,
+                    parent_id=parent[0] if parent else None, content=self.text(3, 30),
+                    created_at=created, likes_count=len(likes), path=path, depth=depth,
+                ))
+                for user_id in likes:
+                    comment_likes.add(CommentLike(user_id=user_id, comment_id=comment_id, created_at=self.after(created)))
+                thread.append((comment_id, path, depth, created))
+                comment_id += 1
+
+            likes = likers(options['likes_per_post'])
+            posts.add(Post(
+                id=post_id, author_id=random_user(), content=self.text(8, 60),
+                created_at=post_created, likes_count=len(likes), comments_count=len(thread),
+                hot_score=hot_score(len(likes), len(thread), post_created),
+            ))
+            for user_id in likes:
+                post_likes.add(PostLike(user_id=user_id, post_id=post_id, created_at=self.after(post_created)))
+            post_id += 1
+
+        for inserter in (posts, comments, post_likes, comment_likes):
+            inserter.flush()
+
+        return {
+            'users': users.count, 'posts': posts.count, 'comments': comments.count,
+            'post_likes': post_likes.count, 'comment_likes': comment_likes.count,
+        }
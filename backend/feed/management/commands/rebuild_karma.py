@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from feed.karma import rebuild_karma
+from feed.models import KarmaEvent, UserKarma
+
+
+class Command(BaseCommand):
+    help = "Rebuild the karma ledger, hourly rollups and leaderboard windows from the like tables."
+
+    def handle(self, *args, **options):
+        rebuild_karma()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {KarmaEvent.objects.count()} karma event(s) for {UserKarma.objects.count()} user(s)."
+        ))
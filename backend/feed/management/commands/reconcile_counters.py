@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from feed.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = "Backfill and repair the denormalized like/comment counters on Post and Comment."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report how many rows have drifted.",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        drift = reconcile_counters(dry_run=dry_run)
+        for counter, count in drift.items():
+            self.stdout.write(f"{counter}: {count} row(s) {'out of sync' if dry_run else 'fixed'}")
+        if not dry_run:
+            self.stdout.write(self.style.SUCCESS("Counters reconciled."))
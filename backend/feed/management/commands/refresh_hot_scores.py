@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from feed.models import Post
+from feed.ranking import refresh_hot_scores
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the hot score of recently active posts from their counters. "
+        "Run periodically to repair scores of likes and comments written outside "
+        "the API; run with --all after changing HOT_HALF_LIFE_HOURS or HOT_COMMENT_WEIGHT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=48,
+                            help="Refresh posts with activity in the last HOURS hours (default: 48).")
+        parser.add_argument('--all', action='store_true', help="Refresh every post.")
+
+    def handle(self, *args, **options):
+        posts = Post.objects.all()
+        if not options['all']:
+            posts = posts.filter(last_activity_at__gte=timezone.now() - timedelta(hours=options['hours']))
+        updated = refresh_hot_scores(posts)
+        self.stdout.write(self.style.SUCCESS(f"Refreshed the hot score of {updated} post(s)."))
@@ -0,0 +1,54 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:40
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('feed', 'Post')
+    Comment = apps.get_model('feed', 'Comment')
+    PostLike = apps.get_model('feed', 'PostLike')
+    CommentLike = apps.get_model('feed', 'CommentLike')
+
+    def count_of(source, fk):
+        return Coalesce(
+            Subquery(
+                source.objects.filter(**{fk: OuterRef('pk')})
+                .order_by().values(fk).annotate(n=Count('*')).values('n')
+            ),
+            0,
+            output_field=IntegerField(),
+        )
+
+    Post.objects.update(
+        likes_count=count_of(PostLike, 'post'),
+        comments_count=count_of(Comment, 'post'),
+    )
+    Comment.objects.update(likes_count=count_of(CommentLike, 'comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0002_post_feed_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 6.0.2 on 2026-10-18 11:05
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+
+def backfill_karma(apps, schema_editor):
+    PostLike = apps.get_model('feed', 'PostLike')
+    CommentLike = apps.get_model('feed', 'CommentLike')
+    KarmaEvent = apps.get_model('feed', 'KarmaEvent')
+    KarmaBucket = apps.get_model('feed', 'KarmaBucket')
+    UserKarma = apps.get_model('feed', 'UserKarma')
+    KarmaWindow = apps.get_model('feed', 'KarmaWindow')
+
+    for like_model, source, points, author in [
+        (PostLike, 'post_like', 5, 'post__author_id'),
+        (CommentLike, 'comment_like', 1, 'comment__author_id'),
+    ]:
+        KarmaEvent.objects.bulk_create(
+            (
+                KarmaEvent(recipient_id=recipient_id, source=source, source_id=like_id,
+                           points=points, created_at=created_at)
+                for like_id, recipient_id, created_at in like_model.objects.values_list('id', author, 'created_at')
+            ),
+            batch_size=1000,
+        )
+
+    KarmaBucket.objects.bulk_create(
+        (
+            KarmaBucket(user_id=user_id, hour=hour, karma=karma)
+            for user_id, hour, karma in KarmaEvent.objects.annotate(hour=TruncHour('created_at'))
+            .values_list('recipient', 'hour').annotate(karma=Sum('points')).order_by()
+        ),
+        batch_size=1000,
+    )
+
+    hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+    KarmaWindow.objects.create(name='24h', hour=hour)
+    UserKarma.objects.bulk_create(
+        (
+            UserKarma(user_id=user_id, karma_24h=karma or 0)
+            for user_id, karma in KarmaBucket.objects.values_list('user').annotate(
+                karma=Sum('karma', filter=Q(hour__gt=hour - timedelta(hours=24)))
+            ).order_by()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('feed', '0003_denormalized_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KarmaWindow',
+            fields=[
+                ('name', models.CharField(max_length=8, primary_key=True, serialize=False)),
+                ('hour', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserKarma',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rolling_karma', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('karma_24h', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-karma_24h'], name='feed_userkarma_24h_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='KarmaBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('karma', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='karma_buckets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour'], name='feed_karmabucket_hour_idx')],
+                'unique_together': {('user', 'hour')},
+            },
+        ),
+        migrations.CreateModel(
+            name='KarmaEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('post_like', 'Post like'), ('comment_like', 'Comment like')], max_length=16)),
+                ('source_id', models.BigIntegerField()),
+                ('points', models.SmallIntegerField()),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='karma_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('source', 'source_id')},
+            },
+        ),
+        migrations.RunPython(backfill_karma, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def path_segment(pk):
+    digits = ''
+    while True:
+        pk, remainder = divmod(pk, 36)
+        digits = DIGITS[remainder] + digits
+        if not pk:
+            return DIGITS[len(digits)] + digits
+
+
+def backfill_paths(apps, schema_editor):
+    Comment = apps.get_model('feed', 'Comment')
+    paths = {}
+    pending = list(Comment.objects.order_by('id').values_list('id', 'parent_id'))
+    while pending:
+        deferred = []
+        updates = []
+        for comment_id, parent_id in pending:
+            if parent_id is None:
+                paths[comment_id] = (path_segment(comment_id), 0)
+            elif parent_id in paths:
+                parent_path, parent_depth = paths[parent_id]
+                paths[comment_id] = (parent_path + path_segment(comment_id), parent_depth + 1)
+            else:
+                # Parent has a higher id; place it on the next pass.
+                deferred.append((comment_id, parent_id))
+                continue
+            path, depth = paths[comment_id]
+            updates.append(Comment(id=comment_id, path=path, depth=depth))
+        Comment.objects.bulk_update(updates, ['path', 'depth'], batch_size=1000)
+        if len(deferred) == len(pending):
+            break
+        pending = deferred
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0004_karma_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='feed_comment_post_path_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.2 on 2026-10-18 05:45
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_last_activity(apps, schema_editor):
+    Post = apps.get_model('feed', 'Post')
+    Post.objects.update(last_activity_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0005_comment_materialized_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_last_activity, migrations.RunPython.noop),
+    ]
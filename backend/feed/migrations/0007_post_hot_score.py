@@ -0,0 +1,36 @@
+# Generated by Django 6.0.2 on 2026-10-18 06:10
+
+import feed.ranking
+from django.db import migrations, models
+
+
+def backfill_hot_score(apps, schema_editor):
+    Post = apps.get_model('feed', 'Post')
+    posts = list(Post.objects.only('id', 'likes_count', 'comments_count', 'created_at'))
+    for post in posts:
+        post.hot_score = feed.ranking.hot_score(post.likes_count, post.comments_count, post.created_at)
+    Post.objects.bulk_update(posts, ['hot_score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0006_post_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='hot_score',
+            field=models.FloatField(default=feed.ranking.new_post_score),
+        ),
+        migrations.RunPython(backfill_hot_score, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-hot_score', '-id'], name='feed_post_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-likes_count', '-id'], name='feed_post_top_idx'),
+        ),
+    ]
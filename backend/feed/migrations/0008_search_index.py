@@ -0,0 +1,47 @@
+# Generated by Django 6.0.2 on 2026-10-18 07:30
+
+from django.db import migrations
+
+from feed.search import create_sqlite_triggers
+
+TABLES = ('feed_post', 'feed_comment')
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            if vendor == 'sqlite':
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {table}_fts USING fts5("
+                    f"content, content='{table}', content_rowid='id', tokenize='porter unicode61')"
+                )
+                create_sqlite_triggers(cursor, table)
+                cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+            elif vendor == 'postgresql':
+                cursor.execute(
+                    f"CREATE INDEX {table}_search_idx ON {table} USING GIN (to_tsvector('english', content))"
+                )
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            if vendor == 'sqlite':
+                for event in ('insert', 'delete', 'update'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{event}')
+                cursor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+            elif vendor == 'postgresql':
+                cursor.execute(f'DROP INDEX IF EXISTS {table}_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0007_post_hot_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:15
+
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+NEW_WINDOWS = {
+    '1h': timedelta(hours=1),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+}
+
+
+def backfill_windows(apps, schema_editor):
+    """Score the new windows from the hourly buckets, as `rebuild_karma` would."""
+    KarmaBucket = apps.get_model('feed', 'KarmaBucket')
+    KarmaWindow = apps.get_model('feed', 'KarmaWindow')
+    UserKarma = apps.get_model('feed', 'UserKarma')
+
+    hour = timezone.now().astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    longest = max(NEW_WINDOWS.values())
+    scored = UserKarma.objects.values('user_id')
+    UserKarma.objects.bulk_create(
+        [UserKarma(user_id=user_id) for user_id in
+         KarmaBucket.objects.filter(hour__gt=hour - longest).exclude(user_id__in=scored)
+         .values_list('user_id', flat=True).distinct()],
+        batch_size=1000,
+    )
+    for name, length in NEW_WINDOWS.items():
+        KarmaWindow.objects.update_or_create(name=name, defaults={'hour': hour})
+        total = Subquery(
+            KarmaBucket.objects.filter(user=OuterRef('user'), hour__gt=hour - length)
+            .order_by().values('user').annotate(total=Sum('karma')).values('total')
+        )
+        UserKarma.objects.update(**{f'karma_{name}': Coalesce(total, 0)})
+
+
+def drop_windows(apps, schema_editor):
+    KarmaWindow = apps.get_model('feed', 'KarmaWindow')
+    KarmaWindow.objects.filter(name__in=NEW_WINDOWS).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='userkarma',
+            name='feed_userkarma_24h_idx',
+        ),
+        migrations.AddField(
+            model_name='userkarma',
+            name='karma_1h',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userkarma',
+            name='karma_30d',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userkarma',
+            name='karma_7d',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_windows, drop_windows),
+        migrations.AddIndex(
+            model_name='userkarma',
+            index=models.Index(fields=['-karma_1h', 'user'], name='feed_userkarma_1h_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userkarma',
+            index=models.Index(fields=['-karma_24h', 'user'], name='feed_userkarma_24h_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userkarma',
+            index=models.Index(fields=['-karma_7d', 'user'], name='feed_userkarma_7d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userkarma',
+            index=models.Index(fields=['-karma_30d', 'user'], name='feed_userkarma_30d_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+from feed.search import create_sqlite_triggers
+
+
+def restore_search_triggers(apps, schema_editor):
+    # Adding the column rebuilds feed_post on SQLite, which drops its triggers.
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            create_sqlite_triggers(cursor, 'feed_post')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0009_leaderboard_windows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(restore_search_triggers, restore_search_triggers),
+    ]
@@ -1,20 +1,136 @@
 from django.db import models
+from django.db.models import Exists, F, OuterRef, Value
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .ranking import new_post_score
+
+class PostQuerySet(models.QuerySet):
+    def with_liked(self, user):
+        """
+        Annotate `liked`: whether `user` liked each post, as a correlated
+        EXISTS on the (user, post) unique index, so the cost follows the
+        rows fetched rather than how many posts the user ever liked.
+        """
+        if not user.is_authenticated:
+            return self.annotate(liked=Value(False))
+        return self.annotate(liked=Exists(PostLike.objects.filter(user=user, post=OuterRef('pk'))))
+
 
 class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized counters, maintained with F() updates by the like/comment
+    # views and repaired by `manage.py reconcile_counters`.
+    likes_count = models.IntegerField(default=0)
+    comments_count = models.IntegerField(default=0)
+    # Bumped, with last_activity_at, whenever the post's detail view changes:
+    # a comment is added or the post or one of its comments is (un)liked.
+    # The ETag validators of the feed and detail views, and the detail
+    # view's Last-Modified.
+    version = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    # Bumped only when the comment tree changes: a comment is added or one
+    # of the post's comments is (un)liked. Keys the cached comment tree,
+    # which likes of the post itself leave as it is.
+    comments_version = models.PositiveIntegerField(default=0)
+    # Ranking of ?sort=hot (see feed.ranking), moved by the same statements
+    # as likes_count and comments_count.
+    hot_score = models.FloatField(default=new_post_score)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Backs the keyset-paginated feed: ORDER BY created_at DESC, id DESC
+            models.Index(fields=['-created_at', '-id'], name='feed_post_created_id_idx'),
+            # ... and its ?sort=hot and ?sort=top orderings
+            models.Index(fields=['-hot_score', '-id'], name='feed_post_hot_idx'),
+            models.Index(fields=['-likes_count', '-id'], name='feed_post_top_idx'),
+        ]
 
     def __str__(self):
         return f"Post by {self.author.username} at {self.created_at}"
 
+def post_activity(comments=False):
+    """`update()` kwargs that mark posts as changed; `comments`: their comment trees too."""
+    changes = {'version': F('version') + 1, 'last_activity_at': timezone.now()}
+    if comments:
+        changes['comments_version'] = F('comments_version') + 1
+    return changes
+
+PATH_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+# Sorts after every path segment (segments start with their length, '1'-'9').
+PATH_END = 'a'
+
+
+def path_segment(pk):
+    """
+    Encode a comment id as a materialized-path segment: its base36 digits
+    prefixed by their count. Segments compare like the ids they encode and no
+    segment is a prefix of another, so a node's descendants are exactly the
+    paths in [path, path + PATH_END).
+    """
+    digits = ''
+    while True:
+        pk, remainder = divmod(pk, 36)
+        digits = PATH_DIGITS[remainder] + digits
+        if not pk:
+            return PATH_DIGITS[len(digits)] + digits
+
+
+class CommentQuerySet(models.QuerySet):
+    def subtree(self, comment, include_self=True, max_depth=None):
+        """`comment` and its descendants, as one range scan on (post, path)."""
+        queryset = self.filter(post_id=comment.post_id, path__lt=comment.path + PATH_END)
+        if include_self:
+            queryset = queryset.filter(path__gte=comment.path)
+        else:
+            queryset = queryset.filter(path__gt=comment.path)
+        if max_depth is not None:
+            queryset = queryset.filter(depth__lte=comment.depth + max_depth)
+        return queryset
+
+    def in_thread_order(self):
+        """Depth-first order: every comment directly followed by its replies."""
+        return self.order_by('path')
+
+    def with_liked(self, user):
+        """Annotate `liked`, as `PostQuerySet.with_liked` does for posts."""
+        if not user.is_authenticated:
+            return self.annotate(liked=Value(False))
+        return self.annotate(liked=Exists(CommentLike.objects.filter(user=user, comment=OuterRef('pk'))))
+
+
 class Comment(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    likes_count = models.IntegerField(default=0)
+    # Materialized path: the path_segment() of every ancestor, then of this
+    # comment. Set right after the comment is first inserted.
+    path = models.TextField(default='', blank=True)
+    depth = models.PositiveIntegerField(default=0)
+
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path'], name='feed_comment_post_path_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        if creating and self.parent_id:
+            self.depth = self.parent.depth + 1
+        super().save(*args, **kwargs)
+        if creating and not self.path:
+            parent_path = self.parent.path if self.parent_id else ''
+            self.path = parent_path + path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
 
     def __str__(self):
         return f"Comment by {self.author.username} on {self.post.id}"
@@ -34,3 +150,62 @@ class CommentLike(models.Model):
 
     class Meta:
         unique_together = ('user', 'comment')
+
+class KarmaEvent(models.Model):
+    """
+    Karma ledger: one row per like that currently earns its target's author
+    karma. Maintained by `feed.likes` (API toggles) and `feed.signals` (ORM
+    saves/deletes), and rebuilt by `manage.py rebuild_karma`.
+    """
+    POST_LIKE = 'post_like'
+    COMMENT_LIKE = 'comment_like'
+    SOURCE_CHOICES = [
+        (POST_LIKE, 'Post like'),
+        (COMMENT_LIKE, 'Comment like'),
+    ]
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='karma_events')
+    source = models.CharField(max_length=16, choices=SOURCE_CHOICES)
+    source_id = models.BigIntegerField()
+    points = models.SmallIntegerField()
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('source', 'source_id')
+
+class KarmaBucket(models.Model):
+    """Per-user karma rollup for one clock hour of the ledger."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='karma_buckets')
+    hour = models.DateTimeField()
+    karma = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'hour')
+        indexes = [
+            models.Index(fields=['hour'], name='feed_karmabucket_hour_idx'),
+        ]
+
+class UserKarma(models.Model):
+    """Rolling-window karma per user, one column per `feed.karma.WINDOWS` entry, kept current by `feed.karma`."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='rolling_karma')
+    karma_1h = models.IntegerField(default=0)
+    karma_24h = models.IntegerField(default=0)
+    karma_7d = models.IntegerField(default=0)
+    karma_30d = models.IntegerField(default=0)
+
+    class Meta:
+        # Back the ranking pages (ORDER BY karma DESC, user_id) and rank lookups.
+        indexes = [
+            models.Index(fields=['-karma_1h', 'user'], name='feed_userkarma_1h_idx'),
+            models.Index(fields=['-karma_24h', 'user'], name='feed_userkarma_24h_idx'),
+            models.Index(fields=['-karma_7d', 'user'], name='feed_userkarma_7d_idx'),
+            models.Index(fields=['-karma_30d', 'user'], name='feed_userkarma_30d_idx'),
+        ]
+
+class KarmaWindow(models.Model):
+    """
+    Sliding-window state: the clock hour up to which buckets have been
+    expired from the matching `UserKarma` column.
+    """
+    name = models.CharField(max_length=8, primary_key=True)
+    hour = models.DateTimeField()
@@ -0,0 +1,219 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import NotFound, ValidationError as RequestValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on a composite, unique ordering.
+
+    Each page is fetched with a `WHERE (a, b) < (cursor_a, cursor_b)` range
+    condition instead of an OFFSET, so with an index on the ordering columns
+    fetching page N costs the same as fetching page 1. Cursors are opaque to
+    clients: a urlsafe base64 encoding of the boundary row's ordering values.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    # Must end in a unique column so that the ordering is total.
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = settings.FEED_PAGE_SIZE
+        if self.page_size_query_param:
+            try:
+                requested = int(request.query_params[self.page_size_query_param])
+                if requested > 0:
+                    page_size = requested
+            except (KeyError, ValueError):
+                pass
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finish_page(list(self.page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """`paginate_queryset` for async views, fetching the page with the async ORM."""
+        return self.finish_page([obj async for obj in self.page_queryset(queryset, request, view)])
+
+    def page_queryset(self, queryset, request, view=None):
+        """The queryset of the requested page plus one row to detect a next page."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.current_ordering = self.get_ordering(request, queryset, view)
+        self.fields = [
+            (name.lstrip('-'), name.startswith('-')) for name in self.current_ordering
+        ]
+
+        cursor = self.decode_cursor(request, queryset.model)
+        self.has_cursor = cursor is not None
+        self.reverse = cursor is not None and cursor[1]
+
+        order_by = []
+        for name, descending in self.fields:
+            descending = descending != self.reverse
+            order_by.append(f'-{name}' if descending else name)
+        queryset = queryset.order_by(*order_by)
+
+        if cursor is not None:
+            queryset = queryset.filter(self._after(cursor[0], self.reverse))
+        return queryset[:self.page_size + 1]
+
+    def finish_page(self, results):
+        has_extra = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_extra
+        else:
+            self.has_next = has_extra
+            self.has_previous = self.has_cursor
+
+        self.page = results
+        return results
+
+    def _after(self, values, reverse):
+        """Lexicographic "comes after `values`" condition for the ordering."""
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.fields, values):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        # Implied by the above, but a plain range on the leading column lets
+        # the database scan the ordering's index from the cursor on, instead
+        # of collecting each branch of the OR and sorting the union.
+        (name, descending), value = self.fields[0], values[0]
+        lookup = 'lte' if descending != reverse else 'gte'
+        return Q(**{f'{name}__{lookup}': value}) & condition
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            raw_values = payload['p']
+            if len(raw_values) != len(self.fields):
+                raise ValueError
+            values = [
+                model._meta.get_field(name).to_python(raw)
+                for (name, _), raw in zip(self.fields, raw_values)
+            ]
+            return values, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, ValidationError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj, reverse):
+        values = []
+        for name, _ in self.fields:
+            value = getattr(obj, name)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            values.append(value)
+        payload = {'p': values}
+        if reverse:
+            payload['r'] = 1
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(payload, separators=(',', ':')).encode('ascii')
+        ).decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class PostFeedPagination(KeysetPagination):
+    """
+    The feed, newest first or by `?sort=`:
+
+    * new - ORDER BY created_at DESC, id DESC
+    * hot - ORDER BY hot_score DESC, id DESC (see feed.ranking)
+    * top - the most liked posts created within `?window=` (default: day)
+
+    Each ordering has a matching index, so every page is a range scan of it.
+    `top` pages of windows up to `range_scan_window` instead read the window's
+    range of the created_at index and sort it: the likes index would have to
+    be walked past every more-liked older post. Longer windows usually hold
+    most posts, so those read the likes index until they have a page.
+    """
+    ordering = ('-created_at', '-id')
+    sort_query_param = 'sort'
+    window_query_param = 'window'
+    orderings = {
+        'new': ('-created_at', '-id'),
+        'hot': ('-hot_score', '-id'),
+        'top': ('-likes_count', '-id'),
+    }
+    windows = {
+        'day': timedelta(days=1),
+        'week': timedelta(weeks=1),
+        'month': timedelta(days=30),
+        'year': timedelta(days=365),
+        'all': None,
+    }
+    range_scan_window = timedelta(days=30)
+
+    def _choice(self, request, param, choices, default):
+        value = request.query_params.get(param, default)
+        if value not in choices:
+            raise RequestValidationError({param: [f"Must be one of: {', '.join(choices)}."]})
+        return value
+
+    def get_ordering(self, request, queryset, view):
+        return self.orderings[self._choice(request, self.sort_query_param, self.orderings, 'new')]
+
+    def page_queryset(self, queryset, request, view=None):
+        if self._choice(request, self.sort_query_param, self.orderings, 'new') == 'top':
+            window = self.windows[self._choice(request, self.window_query_param, self.windows, 'day')]
+            if window is not None:
+                now = timezone.now()
+                queryset = queryset.filter(created_at__gte=now - window)
+                if window <= self.range_scan_window:
+                    # Bounded on both sides, the range is selective enough
+                    # for the planner to scan it rather than the likes index.
+                    queryset = queryset.filter(created_at__lte=now)
+        return super().page_queryset(queryset, request, view)
@@ -0,0 +1,85 @@
+"""
+The "hot" score behind `GET /api/posts/?sort=hot`.
+
+    hot_score = log2(1 + likes + HOT_COMMENT_WEIGHT * comments)
+                + (created_at - HOT_EPOCH) / HOT_HALF_LIFE_HOURS
+
+Age decay is relative: a post needs twice the engagement of one
+HOT_HALF_LIFE_HOURS newer to rank level with it. Measuring age from a fixed
+epoch rather than from now gives every post the same ranking as decaying
+all scores to the present, but a score then only changes when the post gets
+a like or a comment. The like and comment statements move it along with the
+counters (`hot_score_increment_sql`, `hot_score_after`), so the feed is an
+index scan on (hot_score, id) whose keyset cursors stay valid between pages.
+
+`refresh_hot_scores` recomputes scores from the counters, for
+`manage.py refresh_hot_scores` and `reconcile_counters`: it repairs writes
+that bypass the views and the rounding of incremental updates.
+"""
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Ln
+from django.utils import timezone
+
+HOT_EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+LN2 = math.log(2)
+
+
+def hot_score(likes_count, comments_count, created_at):
+    # Counters that drifted below zero (see reconcile_counters) count as none.
+    engagement = max(1 + likes_count + settings.HOT_COMMENT_WEIGHT * comments_count, 1)
+    age_term = (created_at - HOT_EPOCH).total_seconds() / (settings.HOT_HALF_LIFE_HOURS * 3600)
+    return math.log2(engagement) + age_term
+
+
+def new_post_score():
+    """Score of a post created now, without likes or comments (the field default)."""
+    return hot_score(0, 0, timezone.now())
+
+
+def _log_engagement_sql(added='0'):
+    engagement = f'1 + likes_count + {int(settings.HOT_COMMENT_WEIGHT)} * comments_count + ({added})'
+    return f'LN(CASE WHEN {engagement} > 1 THEN {engagement} ELSE 1 END)'
+
+
+def hot_score_increment_sql(likes_delta):
+    """
+    SET clause moving a post's hot_score by the likes added by the SQL
+    expression `likes_delta`, which it contains twice (pass its params
+    twice). Columns on the right of a SET read their old values, so it may
+    share the statement that updates likes_count.
+    """
+    return (
+        f'hot_score = hot_score + ({_log_engagement_sql(likes_delta)} - {_log_engagement_sql()}) / {LN2!r}'
+    )
+
+
+def hot_score_after(likes=0, comments=0):
+    """`update()` value of hot_score once `likes` likes and `comments` comments are added."""
+    engagement = 1 + F('likes_count') + settings.HOT_COMMENT_WEIGHT * F('comments_count')
+    added = likes + settings.HOT_COMMENT_WEIGHT * comments
+    return F('hot_score') + (
+        Ln(Greatest(engagement + added, Value(1))) - Ln(Greatest(engagement, Value(1)))
+    ) / Value(LN2)
+
+
+def refresh_hot_scores(queryset, batch_size=500):
+    """Recompute the hot_score of the posts in `queryset`; returns how many changed."""
+    from .models import Post
+
+    rows = queryset.order_by('id').values_list('id', 'likes_count', 'comments_count', 'created_at', 'hot_score')
+    updated = 0
+    last_id = 0
+    while batch := list(rows.filter(id__gt=last_id)[:batch_size]):
+        changed = []
+        for post_id, likes_count, comments_count, created_at, current in batch:
+            score = hot_score(likes_count, comments_count, created_at)
+            if not math.isclose(score, current, abs_tol=1e-9):
+                changed.append(Post(id=post_id, hot_score=score))
+        Post.objects.bulk_update(changed, ['hot_score'])
+        updated += len(changed)
+        last_id = batch[-1][0]
+    return updated
@@ -0,0 +1,129 @@
+"""
+Full-text search over posts and comments, on the database's own text index.
+
+* SQLite: FTS5 tables `feed_post_fts` / `feed_comment_fts`, indexing the
+  `content` of `feed_post` / `feed_comment` with the porter stemmer. They
+  are external-content tables (the text is not stored twice) kept in sync
+  by triggers, so bulk_create, raw SQL and cascading deletes are indexed as
+  well as model saves. Results are ranked by bm25().
+* PostgreSQL: GIN indexes on `to_tsvector('english', content)`, ranked by
+  ts_rank_cd(). The index is on an expression of the row, so there is
+  nothing to keep in sync.
+
+Both are created by migration 0008. Note that on SQLite, a migration that
+makes Django rebuild `feed_post` or `feed_comment` (most AlterField
+operations) drops their triggers; it must run `create_sqlite_triggers`
+again.
+
+Every word of the query must match a word of the content, in any order;
+both are stemmed, so "optimizing" finds "optimized". Pages are ordered by
+(rank, id) and continue from the last result's pair, so new matches do not
+shift pages that were already served.
+"""
+import base64
+import json
+import re
+
+from django.db import connection
+from rest_framework.exceptions import NotFound
+
+from .models import Post, Comment
+
+# At most this many words of a query are searched for.
+MAX_TERMS = 16
+
+TABLES = {
+    'posts': Post._meta.db_table,
+    'comments': Comment._meta.db_table,
+}
+
+
+def terms(query):
+    """The words of a user's query, stripped of any search syntax."""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def _sqlite_match(table, words, after, limit):
+    # Quoted, each word is a plain token rather than FTS5 syntax.
+    match = ' '.join(f'"{word}"' for word in words)
+    where = 'WHERE (score, id) > (%s, %s)' if after else ''
+    return (
+        f'SELECT id, score FROM ('
+        f'  SELECT rowid AS id, bm25({table}_fts) AS score FROM {table}_fts WHERE {table}_fts MATCH %s'
+        f') {where} ORDER BY score, id LIMIT %s',
+        [match, *(after or []), limit],
+    )
+
+
+def _postgresql_match(table, words, after, limit):
+    # Negated, so that as with bm25() lower scores rank higher.
+    query = ' '.join(words)
+    where = 'WHERE (score, id) > (%s, %s)' if after else ''
+    return (
+        f'SELECT id, score FROM ('
+        f"  SELECT id, -ts_rank_cd(to_tsvector('english', content), query) AS score"
+        f"  FROM {table}, plainto_tsquery('english', %s) query"
+        f"  WHERE to_tsvector('english', content) @@ query"
+        f') matches {where} ORDER BY score, id LIMIT %s',
+        [query, *(after or []), limit],
+    )
+
+
+BACKENDS = {
+    'sqlite': _sqlite_match,
+    'postgresql': _postgresql_match,
+}
+
+
+def search(kind, words, after=None, limit=20):
+    """
+    [(id, score)] of the best `limit` posts or comments (`kind`) matching
+    every one of `words`, best first, after the (score, id) pair `after`.
+    """
+    sql, params = BACKENDS[connection.vendor](TABLES[kind], words, after, limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def encode_cursor(score, result_id):
+    payload = json.dumps({'s': score, 'i': result_id}, separators=(',', ':')).encode('ascii')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_cursor(request):
+    encoded = request.query_params.get('cursor')
+    if encoded is None:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        score, result_id = payload['s'], payload['i']
+        if not isinstance(score, (int, float)) or not isinstance(result_id, int):
+            raise ValueError
+        return [score, result_id]
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        raise NotFound('Invalid cursor')
+
+
+def create_sqlite_triggers(cursor, table):
+    """(Re)create the triggers keeping `table`_fts in sync with `table`."""
+    fts = f'{table}_fts'
+    for event in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_{event}')
+    cursor.execute(
+        f'CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN '
+        f'  INSERT INTO {fts} (rowid, content) VALUES (new.id, new.content); '
+        f'END'
+    )
+    cursor.execute(
+        f'CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN '
+        f"  INSERT INTO {fts} ({fts}, rowid, content) VALUES ('delete', old.id, old.content); "
+        f'END'
+    )
+    # Only edits of the text itself: counters and versions change far more often.
+    cursor.execute(
+        f'CREATE TRIGGER {fts}_update AFTER UPDATE OF content ON {table} BEGIN '
+        f"  INSERT INTO {fts} ({fts}, rowid, content) VALUES ('delete', old.id, old.content); "
+        f'  INSERT INTO {fts} (rowid, content) VALUES (new.id, new.content); '
+        f'END'
+    )
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import Post, Comment, PostLike, CommentLike
 from django.contrib.auth.models import User
+from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 from django.db.models import Sum, Count, Q
@@ -13,25 +14,40 @@ class UserSerializer(serializers.ModelSerializer):
 class CommentSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     replies = serializers.SerializerMethodField()
-    likes_count = serializers.SerializerMethodField()
+    likes_count = serializers.IntegerField(read_only=True)
     is_liked = serializers.SerializerMethodField()
 
     post = serializers.PrimaryKeyRelatedField(read_only=True)
-    parent_author = serializers.CharField(source='parent.author.username', read_only=True, allow_null=True)
+    parent_author = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
         fields = ['id', 'author', 'post', 'parent', 'parent_author', 'content', 'created_at', 'likes_count', 'is_liked', 'replies']
 
-    def get_likes_count(self, obj):
-        return getattr(obj, 'likes_count', 0)
-
     def get_replies(self, obj):
         all_comments = self.context.get('all_comments_map')
         if all_comments and obj.id in all_comments:
             return CommentSerializer(all_comments[obj.id], many=True, context=self.context).data
         return []
 
+    def get_parent_author(self, obj):
+        if obj.parent_id is None:
+            return None
+        # Over a whole thread the parent is one of the comments already
+        # fetched (with their authors); reading `obj.parent` would load it and
+        # its author again for every reply.
+        all_comments = self.context.get('all_comments_map')
+        if all_comments:
+            comments_by_id = self.context.get('comments_by_id')
+            if comments_by_id is None:
+                comments_by_id = self.context['comments_by_id'] = {
+                    comment.id: comment for siblings in all_comments.values() for comment in siblings
+                }
+            parent = comments_by_id.get(obj.parent_id)
+            if parent is not None:
+                return parent.author.username
+        return obj.parent.author.username
+
     def get_is_liked(self, obj):
         user = self.context.get('request').user
         if user.is_authenticated:
@@ -39,29 +55,113 @@ class CommentSerializer(serializers.ModelSerializer):
             return obj.id in liked_comment_ids
         return False
 
+# Columns fetched with `.values_list()` for `build_comment_tree`.
+COMMENT_TREE_COLUMNS = (
+    'id', 'parent_id', 'content', 'created_at', 'likes_count', 'author_id', 'author__username',
+)
+
+_created_at_field = serializers.DateTimeField()
+
+
+def build_comment_tree(rows, post_id, liked_comment_ids=frozenset(),
+                       root_parent_id=None, root_parent_author=None):
+    """
+    Fast path for `CommentSerializer` over a whole thread.
+
+    Takes `COMMENT_TREE_COLUMNS` tuples and returns the nested list of
+    top-level comments as plain dicts, rendering to the same JSON as
+    `CommentSerializer(top_level, many=True)`. The tree is linked in a
+    single pass without recursion, so neither thread size nor depth pays for
+    DRF field machinery or the recursion limit.
+
+    For a subtree, pass the parent id (and its author's username) of the
+    subtree root(s) as `root_parent_id` / `root_parent_author`.
+    """
+    nodes = {}
+    linked = []
+    for comment_id, parent_id, content, created_at, likes_count, author_id, username in rows:
+        node = {
+            'id': comment_id,
+            'author': {'id': author_id, 'username': username},
+            'post': post_id,
+            'parent': parent_id,
+            'parent_author': None,
+            'content': content,
+            'created_at': _created_at_field.to_representation(created_at),
+            'likes_count': likes_count,
+            'is_liked': comment_id in liked_comment_ids,
+            'replies': [],
+        }
+        nodes[comment_id] = node
+        linked.append(node)
+
+    top_level = []
+    for node in linked:
+        parent_id = node['parent']
+        if parent_id == root_parent_id:
+            node['parent_author'] = root_parent_author
+            top_level.append(node)
+        elif parent_id in nodes:
+            parent = nodes[parent_id]
+            node['parent_author'] = parent['author']['username']
+            parent['replies'].append(node)
+    return top_level
+
+
+def mark_liked(nodes, liked_comment_ids):
+    """Set `is_liked` on a `build_comment_tree` result built without liked ids."""
+    if not liked_comment_ids:
+        return nodes
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        node['is_liked'] = node['id'] in liked_comment_ids
+        stack.extend(node['replies'])
+    return nodes
+
+
 class PostSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
-    likes_count = serializers.SerializerMethodField()
+    likes_count = serializers.IntegerField(read_only=True)
     is_liked = serializers.SerializerMethodField()
-    comments_count = serializers.SerializerMethodField()
+    comments_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Post
         fields = ['id', 'author', 'content', 'created_at', 'likes_count', 'is_liked', 'comments_count']
 
-    def get_likes_count(self, obj):
-        return getattr(obj, 'likes_count', 0)
+    def get_is_liked(self, obj):
+        # Annotated by Post.objects.with_liked(); absent on new posts.
+        return bool(getattr(obj, 'liked', False))
 
-    def get_comments_count(self, obj):
-        return getattr(obj, 'comments_count', 0)
+class CommentResultSerializer(serializers.ModelSerializer):
+    """A comment on its own, without its thread (search results)."""
+    author = UserSerializer(read_only=True)
+    is_liked = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'author', 'post', 'parent', 'content', 'created_at', 'likes_count', 'is_liked']
 
     def get_is_liked(self, obj):
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            liked_post_ids = self.context.get('liked_post_ids', set())
-            return obj.id in liked_post_ids
-        return False
+        # Annotated by Comment.objects.with_liked().
+        return bool(getattr(obj, 'liked', False))
 
 class LeaderboardSerializer(serializers.Serializer):
     username = serializers.CharField()
     karma = serializers.IntegerField()
+
+class RankedUserSerializer(serializers.Serializer):
+    rank = serializers.IntegerField(allow_null=True)
+    username = serializers.CharField()
+    karma = serializers.IntegerField()
+
+class LikeOperationSerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=['post', 'comment'])
+    id = serializers.IntegerField(min_value=1)
+    action = serializers.ChoiceField(choices=['like', 'unlike'])
+
+class LikeBatchSerializer(serializers.Serializer):
+    operations = serializers.ListField(
+        child=LikeOperationSerializer(), allow_empty=False, max_length=settings.MAX_LIKE_BATCH
+    )
@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import authentication, karma
+from .models import PostLike, CommentLike, KarmaEvent
+
+
+@receiver(post_save, sender=PostLike)
+def post_like_saved(sender, instance, **kwargs):
+    karma.record_like(KarmaEvent.POST_LIKE, instance.pk, instance.post.author_id, instance.created_at)
+
+
+@receiver(post_delete, sender=PostLike)
+def post_like_deleted(sender, instance, **kwargs):
+    karma.forget_like(KarmaEvent.POST_LIKE, instance.pk)
+
+
+@receiver(post_save, sender=CommentLike)
+def comment_like_saved(sender, instance, **kwargs):
+    karma.record_like(KarmaEvent.COMMENT_LIKE, instance.pk, instance.comment.author_id, instance.created_at)
+
+
+@receiver(post_delete, sender=CommentLike)
+def comment_like_deleted(sender, instance, **kwargs):
+    karma.forget_like(KarmaEvent.COMMENT_LIKE, instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    authentication.invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # e.g. deactivated: cached token lookups must not keep it logged in.
+    if not created:
+        authentication.invalidate_user(instance)
@@ -0,0 +1,137 @@
+"""
+Streaming JSON for payloads that grow without bound.
+
+`?stream=1` on the post detail streams the post with its whole comment tree,
+and `GET /api/posts/export/` streams every post as NDJSON. Rows are read in
+chunks from a server-side cursor (`QuerySet.iterator()`) and written out as
+they arrive, so neither the nested Python structure nor the rendered bytes of
+the whole payload are ever held in memory: peak memory follows the chunk
+size and the thread's depth, not its size.
+
+The comment tree is read in thread order (`Comment.path`), so every
+comment's replies follow it directly and a node can be closed as soon as a
+row outside its subtree arrives. Its JSON is that of the regular response,
+except that siblings come in id order rather than creation order.
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+from .like_buffer import buffer as like_buffer
+from .models import Comment
+from .serializers import _created_at_field
+
+# Rows fetched per round trip, and bytes buffered before a chunk is sent.
+CHUNK_ROWS = 2000
+CHUNK_BYTES = 64 * 1024
+
+_encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps(value):
+    """JSON exactly as DRF's JSONRenderer writes it."""
+    return _encoder.encode(value)
+
+
+def buffered(pieces):
+    """Join small string pieces into encoded chunks of about CHUNK_BYTES."""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_BYTES:
+            yield ''.join(buffer).encode()
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def comment_tree_pieces(post_data, user):
+    """The post detail JSON of `post_data` with its full comment tree, in pieces."""
+    rows = (
+        Comment.objects.filter(post_id=post_data['id'])
+        .with_liked(user)
+        .in_thread_order()
+        .values_list('id', 'parent_id', 'content', 'created_at', 'likes_count', 'author_id',
+                     'author__username', 'liked')
+        .iterator(chunk_size=CHUNK_ROWS)
+    )
+
+    yield dumps({**post_data, 'comments': []})[:-2]  # up to and including "comments":[
+    # Open nodes, outermost first: [id, author username, has replies].
+    stack = []
+    has_top_level = False
+    for comment_id, parent_id, content, created_at, likes_count, author_id, username, liked in rows:
+        while stack and stack[-1][0] != parent_id:
+            stack.pop()
+            yield ']}'
+        if stack:
+            parent = stack[-1]
+            separator = ',' if parent[2] else ''
+            parent[2] = True
+            parent_author = parent[1]
+        elif parent_id is None:
+            separator = ',' if has_top_level else ''
+            has_top_level = True
+            parent_author = None
+        else:
+            continue  # parent not in this thread; the regular view drops these too
+        node = {
+            'id': comment_id,
+            'author': {'id': author_id, 'username': username},
+            'post': post_data['id'],
+            'parent': parent_id,
+            'parent_author': parent_author,
+            'content': content,
+            'created_at': _created_at_field.to_representation(created_at),
+            'likes_count': likes_count,
+            'is_liked': bool(liked),
+            'replies': [],
+        }
+        like_buffer.overlay('comment', user, [node])
+        yield separator + dumps(node)[:-2]  # leave "replies":[ open
+        stack.append([comment_id, username, False])
+    yield ']}' * len(stack)
+    yield ']}'
+
+
+def feed_export_pieces(queryset, user):
+    """One JSON line per post of `queryset` (annotated by `with_liked`), as PostSerializer renders it."""
+    rows = queryset.values_list(
+        'id', 'author_id', 'author__username', 'content', 'created_at', 'likes_count', 'liked',
+        'comments_count',
+    ).iterator(chunk_size=CHUNK_ROWS)
+    for post_id, author_id, username, content, created_at, likes_count, liked, comments_count in rows:
+        post = {
+            'id': post_id,
+            'author': {'id': author_id, 'username': username},
+            'content': content,
+            'created_at': _created_at_field.to_representation(created_at),
+            'likes_count': likes_count,
+            'is_liked': bool(liked),
+            'comments_count': comments_count,
+        }
+        like_buffer.overlay('post', user, [post])
+        yield dumps(post) + '\n'
+
+
+async def _aiterate(chunks):
+    # One thread hop per chunk, on the thread that owns the DB connection.
+    done = object()
+    while (chunk := await sync_to_async(next, thread_sensitive=True)(chunks, done)) is not done:
+        yield chunk
+
+
+def streaming_response(request, pieces, content_type):
+    """
+    Stream `pieces` (an iterator of str), buffered into chunks. ASGI servers
+    get an async iterator, WSGI servers a plain one, so neither side has to
+    collect the whole body first.
+    """
+    chunks = buffered(pieces)
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        chunks = _aiterate(chunks)
+    return StreamingHttpResponse(chunks, content_type=content_type)
@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 from django.db import connection
 from django.test.utils import override_settings
+from django.core.cache import cache
 from datetime import timedelta
 from rest_framework.test import APIClient
 from .models import Post, Comment, PostLike, CommentLike
@@ -11,6 +12,7 @@ class LeaderboardTestCase(TestCase):
     """Test that leaderboard only counts karma from last 24 hours"""
     
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         # Create test users
         self.user1 = User.objects.create_user('testuser1', password='testpass123')
@@ -310,3 +312,2453 @@ class ThreadedCommentsTestCase(TestCase):
         for i in range(4):
             self.assertEqual(len(current['replies']), 1, f"Level {i} should have 1 reply")
             current = current['replies'][0]
+
+
+class FeedPaginationTestCase(TestCase):
+    """Test keyset (cursor) pagination of the post feed"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        # Several posts share a timestamp so the id tie-breaker matters
+        now = timezone.now()
+        for i in range(25):
+            post = Post.objects.create(author=self.user, content=f"Post {i}")
+            post.created_at = now - timedelta(minutes=i // 3)
+            post.save()
+        self.expected_ids = list(
+            Post.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+
+    def test_walk_all_pages_forward(self):
+        """Following next links yields every post exactly once, in feed order"""
+        seen = []
+        url = '/api/posts/?page_size=10'
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(p['id'] for p in response.data['results'])
+            url = response.data['next']
+            pages += 1
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, self.expected_ids)
+
+    def test_previous_link_returns_previous_page(self):
+        """The previous cursor of page 2 yields page 1 again"""
+        first = self.client.get('/api/posts/?page_size=10').data
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+
+        self.assertEqual([p['id'] for p in back['results']], self.expected_ids[:10])
+        self.assertEqual([p['id'] for p in second['results']], self.expected_ids[10:20])
+
+    @override_settings(FEED_PAGE_SIZE=7)
+    def test_default_page_size_from_settings(self):
+        """Page size defaults to FEED_PAGE_SIZE and is capped"""
+        response = self.client.get('/api/posts/')
+        self.assertEqual(len(response.data['results']), 7)
+
+        response = self.client.get('/api/posts/?page_size=100000')
+        self.assertEqual(len(response.data['results']), 25)
+
+    def test_invalid_cursor(self):
+        """A tampered cursor is rejected instead of crashing"""
+        response = self.client.get('/api/posts/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_deep_page_query_count_is_constant(self):
+        """Fetching a deep page costs the same number of queries as the first"""
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get('/api/posts/?page_size=5')
+        url = response.data['next']
+        for _ in range(3):
+            url = self.client.get(url).data['next']
+        with CaptureQueriesContext(connection) as deep_page:
+            self.client.get(url)
+
+        self.assertEqual(len(deep_page), len(first_page))
+        self.assertNotIn('OFFSET', deep_page.captured_queries[-1]['sql'].upper())
+
+
+class HotRankingTestCase(TestCase):
+    """Test the ?sort=hot and ?sort=top feed orderings"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def make_posts(self, ages_in_hours):
+        """Posts created the given number of hours ago, with matching hot scores."""
+        from feed.ranking import refresh_hot_scores
+
+        now = timezone.now()
+        posts = []
+        for i, age in enumerate(ages_in_hours):
+            post = Post.objects.create(author=self.user, content=f"Post {i}")
+            Post.objects.filter(pk=post.pk).update(created_at=now - timedelta(hours=age))
+            posts.append(post)
+        refresh_hot_scores(Post.objects.all())
+        return posts
+
+    def walk(self, url):
+        """Ids of every post reached by following next links from `url`."""
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.data)
+            seen.extend(post['id'] for post in response.data['results'])
+            url = response.data['next']
+        return seen
+
+    def assertScoreMatchesCounters(self, post):
+        from feed.ranking import hot_score
+
+        post.refresh_from_db()
+        self.assertAlmostEqual(post.hot_score, hot_score(post.likes_count, post.comments_count, post.created_at))
+
+    def test_score_moves_with_likes_and_comments(self):
+        """Toggles, batches and comments keep the stored score equal to the formula"""
+        post, other = self.make_posts([3, 5])
+        liker = User.objects.create_user('liker', password='pass')
+
+        self.client.post(f'/api/posts/{post.id}/like/')
+        self.assertScoreMatchesCounters(post)
+        self.client.force_authenticate(liker)
+        self.client.post('/api/likes/batch/', {'operations': [
+            {'type': 'post', 'id': post.id, 'action': 'like'},
+            {'type': 'post', 'id': other.id, 'action': 'like'},
+        ]}, format='json')
+        self.assertScoreMatchesCounters(post)
+        self.assertScoreMatchesCounters(other)
+        self.client.post(f'/api/posts/{post.id}/comments/', {'content': 'Hi'}, format='json')
+        self.assertScoreMatchesCounters(post)
+        self.client.post(f'/api/posts/{post.id}/like/')
+        self.assertScoreMatchesCounters(post)
+        self.assertEqual(post.likes_count, 1)
+        self.assertEqual(post.comments_count, 1)
+
+    def test_hot_feed_order_and_pages(self):
+        """?sort=hot walks every post once, by score, trading engagement against age"""
+        posts = self.make_posts([1, 12, 30, 2, 48, 6, 24, 0])
+        users = [User.objects.create_user(f'fan{i}', password='pass') for i in range(8)]
+        for post, fans in zip(posts, [0, 8, 8, 1, 2, 3, 0, 0]):
+            for user in users[:fans]:
+                self.client.force_authenticate(user)
+                self.client.post(f'/api/posts/{post.id}/like/')
+        self.client.force_authenticate(self.user)
+
+        expected = list(Post.objects.order_by('-hot_score', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/posts/?sort=hot&page_size=3'), expected)
+        # An old post with many likes outranks a new one with none
+        self.assertLess(expected.index(posts[1].id), expected.index(posts[7].id))
+        # ... but not one nearly as liked and much newer
+        self.assertLess(expected.index(posts[3].id), expected.index(posts[4].id))
+
+    def test_top_window(self):
+        """?sort=top ranks by likes within the window, newest first by default"""
+        posts = self.make_posts([1, 2, 30, 24 * 10])
+        users = [User.objects.create_user(f'fan{i}', password='pass') for i in range(4)]
+        for post, fans in zip(posts, [1, 2, 3, 4]):
+            for user in users[:fans]:
+                self.client.force_authenticate(user)
+                self.client.post(f'/api/posts/{post.id}/like/')
+
+        self.assertEqual(self.walk('/api/posts/?sort=top&page_size=1'), [posts[1].id, posts[0].id])
+        self.assertEqual(
+            self.walk('/api/posts/?sort=top&window=week&page_size=1'), [posts[2].id, posts[1].id, posts[0].id]
+        )
+        self.assertEqual(self.walk('/api/posts/?sort=top&window=all'), [p.id for p in reversed(posts)])
+
+    def test_invalid_sort_and_window(self):
+        """Unknown sorts and windows are rejected"""
+        self.assertEqual(self.client.get('/api/posts/?sort=best').status_code, 400)
+        self.assertEqual(self.client.get('/api/posts/?sort=top&window=decade').status_code, 400)
+
+    def test_pages_are_index_scans(self):
+        """Ranked pages, first or deep, read their index in order rather than sorting the table"""
+        from django.test import RequestFactory
+        from rest_framework.request import Request
+        from feed.pagination import PostFeedPagination
+        from feed.views import PostListView
+
+        self.make_posts(range(10))
+        for sort, index in (('new', 'feed_post_created_id_idx'), ('hot', 'feed_post_hot_idx'), ('top', 'feed_post_top_idx')):
+            cursor_url = self.client.get(f'/api/posts/?sort={sort}&window=all&page_size=3').data['next']
+            for url in (f'/api/posts/?sort={sort}&window=all&page_size=3', cursor_url):
+                request = Request(RequestFactory().get(url))
+                queryset = PostFeedPagination().page_queryset(PostListView.queryset.with_liked(self.user), request)
+                plan = queryset.explain()
+                self.assertIn(index, plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_short_top_windows_scan_their_range(self):
+        """Top pages of a day, week or month read the window's range of the created_at index"""
+        from django.test import RequestFactory
+        from rest_framework.request import Request
+        from feed.pagination import PostFeedPagination
+        from feed.views import PostListView
+
+        self.make_posts(range(10))
+        for window in ('day', 'week', 'month'):
+            cursor_url = self.client.get(f'/api/posts/?sort=top&window={window}&page_size=3').data['next']
+            for url in (f'/api/posts/?sort=top&window={window}&page_size=3', cursor_url):
+                request = Request(RequestFactory().get(url))
+                queryset = PostFeedPagination().page_queryset(PostListView.queryset.with_liked(self.user), request)
+                plan = queryset.explain()
+                self.assertIn('feed_post_created_id_idx (created_at>? AND created_at<?)', plan, f"{window}: {plan}")
+
+    def test_refresh_command(self):
+        """refresh_hot_scores repairs scores of recently active posts, or all with --all"""
+        from io import StringIO
+        from django.core.management import call_command
+        from django.db.models import F
+        from feed.ranking import hot_score
+
+        recent, quiet = self.make_posts([1, 24 * 5])
+        Post.objects.filter(pk=quiet.pk).update(last_activity_at=timezone.now() - timedelta(days=5))
+        # e.g. likes written by a bulk import, bypassing the like endpoints
+        Post.objects.update(likes_count=F('likes_count') + 3)
+
+        call_command('refresh_hot_scores', stdout=StringIO())
+        self.assertScoreMatchesCounters(recent)
+        quiet.refresh_from_db()
+        self.assertNotAlmostEqual(quiet.hot_score, hot_score(quiet.likes_count, quiet.comments_count, quiet.created_at))
+        call_command('refresh_hot_scores', '--all', stdout=StringIO())
+        self.assertScoreMatchesCounters(quiet)
+
+
+class SearchTestCase(TestCase):
+    """Test full-text search over posts and comments"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(author=self.user, content="Optimizing Django queries with indexes")
+
+    def search(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_finds_posts_by_stemmed_words(self):
+        """Every word must match, in any order and any inflection"""
+        Post.objects.create(author=self.user, content="Django templates")
+        ids = [post['id'] for post in self.search('/api/search/?q=optimized+django')['results']]
+        self.assertEqual(ids, [self.post.id])
+        self.assertEqual(self.search('/api/search/?q=query+index')['results'][0]['content'], self.post.content)
+        self.assertEqual(self.search('/api/search/?q=django+react')['results'], [])
+
+    def test_index_follows_edits_and_deletes(self):
+        """Edited and deleted rows, and rows from bulk_create, are searchable as they are now"""
+        Post.objects.bulk_create([Post(author=self.user, content=f"Bulk loaded caching post {i}") for i in range(3)])
+        self.assertEqual(len(self.search('/api/search/?q=caching')['results']), 3)
+
+        Post.objects.filter(pk=self.post.pk).update(content="Caching rendered trees")
+        self.assertEqual(self.search('/api/search/?q=django')['results'], [])
+        self.assertEqual(len(self.search('/api/search/?q=caching')['results']), 4)
+
+        Post.objects.filter(content__startswith="Bulk").delete()
+        self.assertEqual([post['id'] for post in self.search('/api/search/?q=caching')['results']], [self.post.id])
+
+    def test_counter_updates_leave_index_alone(self):
+        """Likes still work, and only edits of the content reindex a row"""
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        results = self.search('/api/search/?q=django')['results']
+        self.assertEqual(results[0]['likes_count'], 1)
+        self.assertTrue(results[0]['is_liked'])
+
+    def test_comments(self):
+        """?type=comments searches comment text, cascading deletes included"""
+        comment = Comment.objects.create(author=self.user, post=self.post, content="Which indexes help here?")
+        Comment.objects.create(author=self.user, post=self.post, parent=comment, content="Covering ones")
+        results = self.search('/api/search/?q=indexes&type=comments')['results']
+        self.assertEqual([c['id'] for c in results], [comment.id])
+        self.assertEqual(results[0]['post'], self.post.id)
+        self.assertEqual(results[0]['author']['username'], 'testuser')
+
+        self.post.delete()
+        self.assertEqual(self.search('/api/search/?q=covering&type=comments')['results'], [])
+
+    def test_ranked_pages(self):
+        """Better matches come first, and following next links yields each match once"""
+        for i in range(7):
+            Post.objects.create(author=self.user, content=f"Post {i} mentions sqlite once among many other words")
+        best = Post.objects.create(author=self.user, content="sqlite sqlite sqlite")
+
+        first = self.search('/api/search/?q=sqlite&page_size=3')
+        self.assertEqual(first['results'][0]['id'], best.id)
+        seen = [post['id'] for post in first['results']]
+        url = first['next']
+        while url:
+            page = self.search(url)
+            seen.extend(post['id'] for post in page['results'])
+            url = page['next']
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(len(set(seen)), 8)
+
+    def test_query_syntax_is_text(self):
+        """Operators and quotes in the query are searched as plain words"""
+        self.assertEqual(len(self.search('/api/search/?q=django" OR (NEAR*')['results']), 0)
+        self.assertEqual(len(self.search('/api/search/?q="django" -queries:*')['results']), 1)
+
+    def test_invalid_parameters(self):
+        """Empty queries, unknown types and tampered cursors are rejected"""
+        self.assertEqual(self.client.get('/api/search/?q=%20!').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/?q=django&type=users').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/?q=django&cursor=nope').status_code, 404)
+
+    def test_constant_queries(self):
+        """Match ids, then one query for the page's rows, however many match"""
+        for i in range(30):
+            Post.objects.create(author=User.objects.create(username=f'author{i}'), content=f"django {i}")
+        with self.assertNumQueries(2):
+            self.search('/api/search/?q=django&page_size=25')
+
+
+class DenormalizedCountersTestCase(TestCase):
+    """Test the stored likes_count / comments_count columns"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.post = Post.objects.create(author=self.user, content="Test post")
+        self.client.force_authenticate(user=self.user)
+
+    def test_like_toggles_update_counters(self):
+        """Like and unlike adjust the stored counters in place"""
+        comment = Comment.objects.create(author=self.user, post=self.post, content="Test")
+
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.client.post(f'/api/comments/{comment.id}/like/')
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(comment.likes_count, 1)
+
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.client.post(f'/api/comments/{comment.id}/like/')
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+        self.assertEqual(comment.likes_count, 0)
+
+    def test_comment_create_updates_counter(self):
+        """Creating a comment through the API bumps comments_count"""
+        response = self.client.post(f'/api/posts/{self.post.id}/comments/', {'content': 'Hi'})
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get(f'/api/posts/{self.post.id}/')
+        self.assertEqual(response.data['comments_count'], 1)
+
+    def test_reads_do_not_aggregate(self):
+        """Feed and detail reads fetch counters as plain columns"""
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/posts/')
+            self.client.get(f'/api/posts/{self.post.id}/')
+        for query in queries.captured_queries:
+            self.assertNotIn('COUNT(', query['sql'].upper())
+
+    def test_reconcile_counters_command(self):
+        """The management command repairs drifted counters"""
+        from io import StringIO
+        from django.core.management import call_command
+
+        other = User.objects.create_user('other', password='testpass123')
+        comment = Comment.objects.create(author=other, post=self.post, content="Test")
+        PostLike.objects.create(user=other, post=self.post)
+        CommentLike.objects.create(user=self.user, comment=comment)
+        Post.objects.filter(pk=self.post.pk).update(likes_count=42)
+
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('Post.likes_count: 1 row(s) out of sync', out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 42)
+
+        call_command('reconcile_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertEqual(comment.likes_count, 1)
+
+
+def buffer_lock_path(test):
+    """A LIKE_BUFFER_LOCK of the test's own, removed after it."""
+    import os
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+    return os.path.join(directory, 'like-buffer.lock')
+
+
+def aggregate_karma(now, length=timedelta(hours=24)):
+    """Reference karma of the `length` before `now`, computed straight from the like tables"""
+    from django.db.models import Count, F, IntegerField, Q
+    from django.db.models.functions import Coalesce
+
+    cutoff = now - length
+    users = User.objects.annotate(
+        post_karma=Coalesce(
+            Count('posts__likes', filter=Q(posts__likes__created_at__gte=cutoff), distinct=True),
+            0, output_field=IntegerField()
+        ) * 5,
+        comment_karma=Coalesce(
+            Count('comments__likes', filter=Q(comments__likes__created_at__gte=cutoff), distinct=True),
+            0, output_field=IntegerField()
+        ),
+    ).annotate(karma=F('post_karma') + F('comment_karma')).filter(karma__gt=0)
+    return {u.username: u.karma for u in users}
+
+
+class RollingKarmaTestCase(TestCase):
+    """Test the incrementally maintained karma ledger and sliding window"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='testpass123')
+        self.fan = User.objects.create_user('fan', password='testpass123')
+        self.post = Post.objects.create(author=self.author, content="Test post")
+
+    def test_window_expires_old_buckets(self):
+        """Karma drops out once its hour slides past the 24h window"""
+        from feed import karma
+        from feed.models import UserKarma
+
+        now = timezone.now()
+        PostLike.objects.create(user=self.fan, post=self.post)
+
+        self.assertEqual(karma.leaderboard(now=now + timedelta(hours=23)),
+                         [{'username': 'author', 'karma': 5}])
+        self.assertEqual(karma.leaderboard(now=now + timedelta(hours=25)), [])
+        self.assertEqual(UserKarma.objects.get(user=self.author).karma_24h, 0)
+
+    def test_unlike_removes_karma(self):
+        """Unliking through the API takes the karma back"""
+        self.client.force_authenticate(user=self.fan)
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(self.client.get('/api/leaderboard/').data[0]['karma'], 5)
+
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(self.client.get('/api/leaderboard/').data, [])
+
+    def test_unlike_as_the_like_expires(self):
+        """A like taken back in the hour its bucket leaves the window takes its karma with it"""
+        from unittest import mock
+        from feed import karma, likes
+        from feed.models import UserKarma
+
+        liked_at = karma.floor_hour(timezone.now()) + timedelta(minutes=50)
+        # The unlike is the first karma change since the like, so it advances
+        # the window past the like's bucket.
+        for at in (liked_at, liked_at + timedelta(hours=23, minutes=15)):
+            with mock.patch('feed.karma.timezone.now', return_value=at):
+                likes.toggle_like('post', self.fan.id, self.post.id, now=at)
+
+        self.assertEqual(UserKarma.objects.get(user=self.author).karma_24h, 0)
+        self.assertEqual(karma.leaderboard(now=liked_at + timedelta(hours=23, minutes=15)), [])
+
+    def test_matches_aggregate_query(self):
+        """Rollups agree with a full aggregate, including the partial oldest hour"""
+        import random
+        from feed import karma
+
+        rng = random.Random(7)
+        authors = [User.objects.create_user(f'a{i}', password='x') for i in range(6)]
+        likers = [User.objects.create_user(f'l{i}', password='x') for i in range(8)]
+        now = timezone.now()
+        for author in authors:
+            post = Post.objects.create(author=author, content="p")
+            comment = Comment.objects.create(author=rng.choice(authors), post=post, content="c")
+            for liker in rng.sample(likers, 5):
+                for like in (PostLike.objects.create(user=liker, post=post),
+                             CommentLike.objects.create(user=liker, comment=comment)):
+                    like.created_at = now - timedelta(minutes=rng.randint(0, 48 * 60))
+                    like.save()
+
+        for offset in (0, 30, 90):
+            at = now + timedelta(minutes=offset)
+            expected = aggregate_karma(at)
+            board = karma.leaderboard(limit=100, now=at)
+            self.assertEqual({row['username']: row['karma'] for row in board}, expected)
+
+    def test_rebuild_karma_command(self):
+        """rebuild_karma restores the rollups from the like tables"""
+        from io import StringIO
+        from django.core.management import call_command
+        from feed.models import KarmaEvent, KarmaBucket, UserKarma
+
+        comment = Comment.objects.create(author=self.fan, post=self.post, content="Test")
+        PostLike.objects.create(user=self.fan, post=self.post)
+        CommentLike.objects.create(user=self.author, comment=comment)
+        KarmaEvent.objects.all().delete()
+        KarmaBucket.objects.all().delete()
+        UserKarma.objects.all().delete()
+
+        call_command('rebuild_karma', stdout=StringIO())
+
+        self.assertEqual(KarmaEvent.objects.count(), 2)
+        response = self.client.get('/api/leaderboard/')
+        self.assertEqual(
+            [(row['username'], row['karma']) for row in response.data],
+            [('author', 5), ('fan', 1)],
+        )
+
+
+class MultiWindowLeaderboardTestCase(TestCase):
+    """Test the 1h / 24h / 7d / 30d leaderboards, ranking pages and rank lookups"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def make_likes(self, authors=8, likers=6, seed=3):
+        """Likes on each author's post and comment, spread over the last 40 days."""
+        import random
+
+        rng = random.Random(seed)
+        self.authors = [User.objects.create_user(f'a{i}', password='x') for i in range(authors)]
+        likers = [User.objects.create_user(f'l{i}', password='x') for i in range(likers)]
+        self.now = timezone.now()
+        for author in self.authors:
+            post = Post.objects.create(author=author, content="p")
+            comment = Comment.objects.create(author=author, post=post, content="c")
+            for liker in rng.sample(likers, rng.randint(1, len(likers))):
+                for like in (PostLike.objects.create(user=liker, post=post),
+                             CommentLike.objects.create(user=liker, comment=comment)):
+                    # Clustered near the window edges, where the partial hour matters
+                    age = rng.choice([rng.uniform(0, 2), rng.uniform(22, 26), rng.uniform(0, 24 * 40)])
+                    like.created_at = self.now - timedelta(hours=age)
+                    like.save()
+
+    def expected_ranking(self, now, length):
+        """[(rank, username, karma)] from the reference aggregate, ties sharing a rank."""
+        ids = dict(User.objects.values_list('username', 'id'))
+        rows = sorted(aggregate_karma(now, length).items(), key=lambda item: (-item[1], ids[item[0]]))
+        ranked = []
+        for position, (username, points) in enumerate(rows, 1):
+            rank = ranked[-1][0] if ranked and ranked[-1][2] == points else position
+            ranked.append((rank, username, points))
+        return ranked
+
+    def assert_windows_match(self, at):
+        """Every window's ranking and ranks at `at` agree with the reference aggregate."""
+        from feed import karma
+
+        usernames = dict(User.objects.values_list('id', 'username'))
+        for window, length in karma.WINDOWS.items():
+            board = karma.ranking(window, limit=100, now=at)
+            expected = self.expected_ranking(at, length)
+            self.assertEqual([(usernames[user_id], points) for user_id, points in board],
+                             [(username, points) for _, username, points in expected], f"{window} at {at}")
+            for user_id, points in board:
+                rank = next(rank for rank, username, _ in expected if username == usernames[user_id])
+                self.assertEqual(karma.rank(user_id, window, now=at), (rank, points), f"{window} {user_id}")
+
+    def test_windows_match_aggregate(self):
+        """Every window agrees with a full aggregate as the clock moves on"""
+        self.make_likes()
+        for offset in (0, 40, 100, 24 * 60 + 30):
+            self.assert_windows_match(self.now + timedelta(minutes=offset))
+
+    def test_unlike_across_hour_boundaries(self):
+        """Likes taken back after the clock passes an hour leave every window exact"""
+        from unittest import mock
+        from feed import karma, likes
+
+        authors = [User.objects.create_user(f'a{i}', password='x') for i in range(3)]
+        fans = [User.objects.create_user(f'f{i}', password='x') for i in range(2)]
+        posts = [Post.objects.create(author=author, content="p") for author in authors]
+        comments = [Comment.objects.create(author=author, post=posts[0], content="c") for author in authors]
+        # Minutes past the current hour (the windows never move back), and the
+        # toggles made then: each unlike lands in a later hour than its like,
+        # the last one after the like's hour left the 24h window.
+        start = karma.floor_hour(timezone.now())
+        steps = [
+            (50, [('post', fan, post) for fan in fans for post in posts]
+                 + [('comment', fans[0], comment) for comment in comments]),
+            (65, [('post', fans[0], posts[0]), ('comment', fans[0], comments[1])]),
+            (3 * 60 + 10, [('post', fans[1], posts[1])]),
+            (24 * 60 + 55, [('post', fans[0], posts[2]), ('comment', fans[0], comments[2])]),
+        ]
+        for minutes, toggles in steps:
+            at = start + timedelta(minutes=minutes)
+            with mock.patch('feed.karma.timezone.now', return_value=at):
+                for kind, fan, target in toggles:
+                    likes.toggle_like(kind, fan.id, target.id, now=at)
+            self.assert_windows_match(at)
+
+    def test_top_per_window(self):
+        """?window= picks the leaderboard, each cached separately and invalidated by likes"""
+        self.make_likes()
+        for window, length in (('1h', timedelta(hours=1)), ('7d', timedelta(days=7)), ('30d', timedelta(days=30))):
+            response = self.client.get(f'/api/leaderboard/?window={window}')
+            self.assertEqual(response['X-Cache'], 'MISS')
+            expected = [(username, points) for _, username, points in self.expected_ranking(timezone.now(), length)]
+            self.assertEqual([(row['username'], row['karma']) for row in response.data], expected[:5])
+            self.assertEqual(self.client.get(f'/api/leaderboard/?window={window}')['X-Cache'], 'HIT')
+
+        fan = User.objects.create_user('fan', password='x')
+        self.client.force_authenticate(fan)
+        self.client.post(f'/api/posts/{Post.objects.get(author=self.authors[0]).id}/like/')
+        self.assertEqual(self.client.get('/api/leaderboard/?window=30d')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/api/leaderboard/')['X-Cache'], 'MISS')
+
+    def test_ranking_pages(self):
+        """Following next links walks the whole ranking once, ranks continuing across pages"""
+        self.make_likes(authors=12)
+        seen = []
+        url = '/api/leaderboard/ranking/?window=30d&page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend((row['rank'], row['username'], row['karma']) for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, self.expected_ranking(timezone.now(), timedelta(days=30)))
+
+    def test_ties_share_a_rank(self):
+        """Users with equal karma share a rank, on pages and in lookups"""
+        authors = [User.objects.create_user(f'a{i}', password='x') for i in range(4)]
+        fan = User.objects.create_user('fan', password='x')
+        for author, likes in zip(authors, [2, 1, 1, 0]):
+            post = Post.objects.create(author=author, content="p")
+            for i in range(likes):
+                PostLike.objects.create(user=User.objects.create_user(f'{author.username}-{i}', password='x'), post=post)
+
+        response = self.client.get('/api/leaderboard/ranking/?page_size=2')
+        second = self.client.get(response.data['next']).data['results']
+        self.assertEqual(
+            [(row['rank'], row['username']) for row in response.data['results'] + second],
+            [(1, 'a0'), (2, 'a1'), (2, 'a2')],
+        )
+        for author, rank, points in ((authors[2], 2, 5), (authors[3], None, 0)):
+            self.client.force_authenticate(author)
+            self.assertEqual(self.client.get('/api/leaderboard/me/').data,
+                             {'rank': rank, 'username': author.username, 'karma': points})
+        self.client.force_authenticate(fan)
+        self.assertEqual(self.client.get('/api/leaderboard/me/?window=1h').data['rank'], None)
+
+    def test_invalid_parameters(self):
+        """Unknown windows and tampered cursors are rejected; rank lookups need a user"""
+        self.assertEqual(self.client.get('/api/leaderboard/?window=2d').status_code, 400)
+        self.assertEqual(self.client.get('/api/leaderboard/ranking/?window=2d').status_code, 400)
+        self.assertEqual(self.client.get('/api/leaderboard/ranking/?cursor=nope').status_code, 404)
+        self.assertEqual(self.client.get('/api/leaderboard/me/').status_code, 401)
+
+    def test_constant_queries(self):
+        """Pages and rank lookups cost the same number of queries however many users rank"""
+        from django.test.utils import CaptureQueriesContext
+
+        fan = User.objects.create_user('fan', password='x')
+        self.client.force_authenticate(fan)
+        counts = {}
+        authors = []
+        for size in (3, 30):
+            for i in range(len(authors), size):
+                authors.append(User.objects.create_user(f'a{i}', password='x'))
+                PostLike.objects.create(user=fan, post=Post.objects.create(author=authors[-1], content="p"))
+            cursor_url = self.client.get('/api/leaderboard/ranking/?window=30d&page_size=1').data['next']
+            self.client.force_authenticate(authors[-1])
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(cursor_url)
+                self.client.get('/api/leaderboard/me/?window=30d')
+            counts[size] = len(queries)
+        self.assertEqual(counts[3], counts[30], counts)
+
+
+class LeaderboardCacheTestCase(TestCase):
+    """Test the versioned leaderboard cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='testpass123')
+        self.fan = User.objects.create_user('fan', password='testpass123')
+        self.post = Post.objects.create(author=self.author, content="Test post")
+        PostLike.objects.create(user=self.fan, post=self.post)
+
+    def test_second_request_is_served_from_cache(self):
+        """A repeated request hits the cache without touching the database"""
+        from feed import caching
+
+        first = self.client.get('/api/leaderboard/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/leaderboard/')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(caching.stats('leaderboard'), {'hits': 1, 'misses': 1, 'stale': 0})
+
+    def test_like_toggle_bumps_version(self):
+        """Toggling a like invalidates the cached ranking"""
+        self.client.get('/api/leaderboard/')
+        self.client.force_authenticate(user=self.author)
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+
+        response = self.client.get('/api/leaderboard/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data[0]['karma'], 10)
+
+    @override_settings(LEADERBOARD_CACHE_TTL=0)
+    def test_expired_entry_served_stale_while_locked(self):
+        """While one worker recomputes, others get the previous value"""
+        self.client.get('/api/leaderboard/')
+        cache.add('leaderboard:lock', 1, 10)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/leaderboard/')
+        self.assertEqual(response['X-Cache'], 'STALE')
+        self.assertEqual(response.data[0]['karma'], 5)
+
+    def test_single_recompute_under_concurrency(self):
+        """Concurrent misses recompute the value only once"""
+        import threading
+        import time
+        from feed import caching
+
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                caching.get_or_compute('stampede', compute, ttl=60, poll_interval=0.01)
+            ))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([value for value, _ in results], ['value'] * 8)
+
+    def test_file_backend(self):
+        """The cache works with the file-based backend"""
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}):
+                self.assertEqual(self.client.get('/api/leaderboard/')['X-Cache'], 'MISS')
+                self.assertEqual(self.client.get('/api/leaderboard/')['X-Cache'], 'HIT')
+
+
+class CommentTreeFastPathTestCase(TestCase):
+    """Test the iterative, dict-emitting comment tree builder"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = User.objects.create_user('user1', password='pass')
+        self.user2 = User.objects.create_user('user2', password='pass')
+        self.post = Post.objects.create(author=self.user1, content="Test post")
+
+    def test_renders_same_json_as_serializer(self):
+        """The fast path renders byte-identical JSON to CommentSerializer"""
+        import random
+        from types import SimpleNamespace
+        from rest_framework.renderers import JSONRenderer
+        from feed.serializers import CommentSerializer, COMMENT_TREE_COLUMNS, build_comment_tree
+
+        rng = random.Random(5)
+        comments = []
+        for i in range(60):
+            parent = rng.choice(comments) if comments and rng.random() < 0.7 else None
+            comments.append(Comment.objects.create(
+                author=rng.choice([self.user1, self.user2]), post=self.post,
+                parent=parent, content=f"Comment {i} — \"quoted\"",
+            ))
+        for comment in rng.sample(comments, 15):
+            CommentLike.objects.create(user=self.user2, comment=comment)
+            Comment.objects.filter(pk=comment.pk).update(likes_count=1)
+        liked = set(CommentLike.objects.values_list('comment_id', flat=True))
+
+        queryset = Comment.objects.filter(post=self.post).select_related('author').order_by('created_at')
+        all_comments_map = {}
+        for comment in queryset:
+            all_comments_map.setdefault(comment.parent_id, []).append(comment)
+        context = {
+            'request': SimpleNamespace(user=self.user2),
+            'all_comments_map': all_comments_map,
+            'liked_comment_ids': liked,
+        }
+        expected = CommentSerializer(all_comments_map[None], many=True, context=context).data
+
+        rows = queryset.values_list(*COMMENT_TREE_COLUMNS)
+        actual = build_comment_tree(rows, self.post.id, liked)
+
+        self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_deep_chain_does_not_recurse(self):
+        """A reply chain deeper than the recursion limit still builds"""
+        import sys
+        from feed.serializers import COMMENT_TREE_COLUMNS, build_comment_tree
+
+        depth = sys.getrecursionlimit() + 200
+        parent = None
+        for i in range(depth):
+            parent = Comment.objects.create(author=self.user1, post=self.post, parent=parent, content=f"{i}")
+
+        rows = Comment.objects.filter(post=self.post).order_by('created_at').values_list(*COMMENT_TREE_COLUMNS)
+        tree = build_comment_tree(rows, self.post.id)
+
+        node, levels = tree[0], 1
+        while node['replies']:
+            node, levels = node['replies'][0], levels + 1
+        self.assertEqual(levels, depth)
+        self.assertEqual(node['parent_author'], 'user1')
+
+
+class MaterializedPathTestCase(TestCase):
+    """Test the materialized path kept on comments"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('user1', password='pass')
+        self.post = Post.objects.create(author=self.user, content="Test post")
+
+    def make_tree(self, count=40, seed=3):
+        import random
+        rng = random.Random(seed)
+        comments = []
+        for i in range(count):
+            parent = rng.choice(comments) if comments and rng.random() < 0.75 else None
+            comments.append(Comment.objects.create(author=self.user, post=self.post, parent=parent, content=f"{i}"))
+        return comments
+
+    def test_path_segments_sort_like_ids(self):
+        """Encoded segments compare in the same order as the ids"""
+        from feed.models import path_segment
+
+        ids = [1, 9, 10, 35, 36, 37, 1295, 1296, 46655, 46656, 10 ** 9, 10 ** 12]
+        self.assertEqual(sorted(ids, key=path_segment), ids)
+
+    def test_subtree_is_single_range_scan(self):
+        """subtree() returns exactly a comment and its descendants"""
+        from django.test.utils import CaptureQueriesContext
+
+        comments = self.make_tree()
+        children = {}
+        for comment in comments:
+            children.setdefault(comment.parent_id, []).append(comment.id)
+
+        for root in comments[::5]:
+            root.refresh_from_db()
+            expected, stack = set(), [root.id]
+            while stack:
+                node = stack.pop()
+                expected.add(node)
+                stack.extend(children.get(node, []))
+
+            with CaptureQueriesContext(connection) as queries:
+                actual = set(Comment.objects.subtree(root).values_list('id', flat=True))
+            self.assertEqual(actual, expected)
+            self.assertEqual(len(queries), 1)
+            self.assertNotIn('LIKE', queries[0]['sql'].upper())
+
+    def test_thread_order_is_depth_first(self):
+        """Ordering by path lists every comment right before its replies"""
+        self.make_tree()
+        seen = set()
+        for comment in Comment.objects.filter(post=self.post).in_thread_order():
+            if comment.parent_id is not None:
+                self.assertIn(comment.parent_id, seen)
+                self.assertEqual(comment.depth, Comment.objects.get(pk=comment.parent_id).depth + 1)
+            seen.add(comment.id)
+
+    def test_comment_thread_endpoint(self):
+        """The permalink view returns one comment with its nested replies"""
+        root = Comment.objects.create(author=self.user, post=self.post, content="root")
+        reply = Comment.objects.create(author=self.user, post=self.post, parent=root, content="reply")
+        Comment.objects.create(author=self.user, post=self.post, parent=reply, content="nested")
+        Comment.objects.create(author=self.user, post=self.post, content="other thread")
+
+        response = self.client.get(f'/api/comments/{reply.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['content'], 'reply')
+        self.assertEqual(response.data['parent_author'], 'user1')
+        self.assertEqual([r['content'] for r in response.data['replies']], ['nested'])
+
+    def test_reply_must_stay_in_thread(self):
+        """Replies cannot attach to another post's comment or exceed the depth cap"""
+        self.client.force_authenticate(user=self.user)
+        other_post = Post.objects.create(author=self.user, content="Other")
+        foreign = Comment.objects.create(author=self.user, post=other_post, content="x")
+        response = self.client.post(
+            f'/api/posts/{self.post.id}/comments/', {'content': 'hi', 'parent': foreign.id}
+        )
+        self.assertEqual(response.status_code, 404)
+
+        parent = None
+        for i in range(3):
+            parent = Comment.objects.create(author=self.user, post=self.post, parent=parent, content=f"{i}")
+        with override_settings(MAX_COMMENT_DEPTH=2):
+            response = self.client.post(
+                f'/api/posts/{self.post.id}/comments/', {'content': 'hi', 'parent': parent.id}
+            )
+        self.assertEqual(response.status_code, 400)
+
+
+class BoundedCommentLoadingTestCase(TestCase):
+    """Test paged, depth-limited comment loading"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('user1', password='pass')
+        self.post = Post.objects.create(author=self.user, content="Test post")
+
+    def comment(self, parent=None, content="c"):
+        return Comment.objects.create(author=self.user, post=self.post, parent=parent, content=content)
+
+    def collect(self, nodes, found):
+        """Gather ids from nodes, following every continuation link"""
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            found.append(node['id'])
+            stack.extend(node['replies'])
+            url = node['continuation']
+            while url:
+                page = self.client.get(url).data
+                stack.extend(page['results'])
+                url = page['next']
+
+    def test_depth_limit_marks_truncated_nodes(self):
+        """Comments at the depth cut-off report has_more with a continuation"""
+        parent = None
+        for i in range(5):
+            parent = self.comment(parent, f"Level {i}")
+
+        response = self.client.get(f'/api/posts/{self.post.id}/?depth=2')
+        top = response.data['comments'][0]
+        level1 = top['replies'][0]
+        self.assertFalse(top['has_more'])
+        self.assertEqual(level1['replies'], [])
+        self.assertTrue(level1['has_more'])
+
+        page = self.client.get(level1['continuation']).data
+        self.assertEqual(page['results'][0]['content'], 'Level 2')
+        self.assertEqual(page['results'][0]['parent_author'], 'user1')
+        self.assertEqual(page['results'][0]['replies'][0]['content'], 'Level 3')
+
+    def test_reply_cap_and_continuation(self):
+        """Replies beyond the cap are paged through the replies endpoint"""
+        root = self.comment(content="root")
+        replies = [self.comment(root, f"Reply {i}") for i in range(7)]
+
+        response = self.client.get(f'/api/posts/{self.post.id}/?replies=3')
+        node = response.data['comments'][0]
+        self.assertEqual([r['id'] for r in node['replies']], [r.id for r in replies[:3]])
+        self.assertTrue(node['has_more'])
+
+        page = self.client.get(node['continuation']).data
+        self.assertEqual([r['id'] for r in page['results']], [r.id for r in replies[3:6]])
+        page = self.client.get(page['next']).data
+        self.assertEqual([r['id'] for r in page['results']], [replies[6].id])
+        self.assertIsNone(page['next'])
+
+    def test_top_level_limit(self):
+        """Top-level comments are capped and continue via the post's comments endpoint"""
+        top = [self.comment(content=f"Top {i}") for i in range(5)]
+
+        response = self.client.get(f'/api/posts/{self.post.id}/?limit=2')
+        self.assertEqual([c['id'] for c in response.data['comments']], [c.id for c in top[:2]])
+        self.assertTrue(response.data['comments_has_more'])
+
+        page = self.client.get(response.data['comments_continuation']).data
+        self.assertEqual([c['id'] for c in page['results']], [c.id for c in top[2:4]])
+
+    def test_continuations_cover_whole_thread(self):
+        """Following every continuation reaches every comment exactly once"""
+        import random
+        rng = random.Random(11)
+        comments = []
+        for i in range(80):
+            parent = rng.choice(comments) if comments and rng.random() < 0.8 else None
+            comments.append(self.comment(parent, f"{i}"))
+
+        response = self.client.get(f'/api/posts/{self.post.id}/?limit=3&depth=2&replies=2')
+        found = []
+        self.collect(response.data['comments'], found)
+        url = response.data['comments_continuation']
+        while url:
+            page = self.client.get(url).data
+            self.collect(page['results'], found)
+            url = page['next']
+
+        self.assertEqual(sorted(found), sorted(c.id for c in comments))
+
+    def test_query_count_independent_of_thread_size(self):
+        """A bounded page costs the same queries for a small and a huge thread"""
+        from django.test.utils import CaptureQueriesContext
+
+        def measure():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(f'/api/posts/{self.post.id}/?limit=5&depth=3&replies=5')
+            return len(queries)
+
+        root = self.comment()
+        self.comment(root)
+        small = measure()
+
+        for i in range(10):
+            top = self.comment()
+            for j in range(10):
+                reply = self.comment(top)
+                self.comment(reply)
+        self.assertEqual(measure(), small)
+
+    def test_invalid_parameters(self):
+        """Non-positive limits are rejected"""
+        response = self.client.get(f'/api/posts/{self.post.id}/?depth=0')
+        self.assertEqual(response.status_code, 400)
+
+
+class GenerateDataTestCase(TestCase):
+    """Test the synthetic data generator"""
+
+    ARGS = ['--users', '20', '--posts', '15', '--comments-per-post', '8',
+            '--likes-per-post', '4', '--likes-per-comment', '2', '--max-depth', '4',
+            '--end', '2024-01-08T00:00:00+00:00', '--batch-size', '50']
+
+    def generate(self, *extra):
+        from io import StringIO
+        from django.core.management import call_command
+
+        call_command('generate_data', *self.ARGS, *extra, stdout=StringIO())
+
+    def snapshot(self):
+        return (
+            list(Post.objects.order_by('id').values_list('author__username', 'content', 'created_at', 'likes_count')),
+            list(Comment.objects.order_by('id').values_list('parent__content', 'content', 'created_at', 'depth')),
+            list(CommentLike.objects.order_by('comment_id', 'user__username').values_list('comment__content', 'user__username')),
+        )
+
+    def test_deterministic_from_seed(self):
+        """The same seed on an empty database generates the same dataset"""
+        self.generate('--seed', '7')
+        first = self.snapshot()
+        for model in (CommentLike, PostLike, Comment, Post):
+            model.objects.all().delete()
+        User.objects.all().delete()
+        self.generate('--seed', '7')
+        self.assertEqual(self.snapshot(), first)
+
+    def test_generated_data_is_consistent(self):
+        """Counters, paths, depths and karma match the generated rows"""
+        from io import StringIO
+        from django.core.management import call_command
+        from . import karma
+        from .models import path_segment
+
+        now = timezone.now()
+        self.generate('--end', now.isoformat(), '--days', '2')
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Post.objects.count(), 15)
+        self.assertTrue(User.objects.first().check_password('pass123'))
+
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertNotIn(' 1 row', out.getvalue())
+        self.assertEqual(out.getvalue().count(': 0 row(s) out of sync'), 3)
+
+        for comment in Comment.objects.select_related('parent'):
+            parent_path = comment.parent.path if comment.parent else ''
+            self.assertEqual(comment.path, parent_path + path_segment(comment.id))
+            self.assertLessEqual(comment.depth, 4)
+            if comment.parent:
+                self.assertEqual(comment.parent.post_id, comment.post_id)
+                self.assertGreaterEqual(comment.created_at, comment.parent.created_at)
+
+        now = timezone.now()
+        ranked = {row['username']: row['karma'] for row in karma.leaderboard(limit=20, now=now)}
+        self.assertTrue(ranked)
+        self.assertEqual(ranked, aggregate_karma(now))
+
+    def test_ids_continue_after_existing_rows(self):
+        """New rows get fresh ids, and the sequences are reset for later inserts"""
+        existing = User.objects.create_user('existing', password='testpass123')
+        self.generate()
+        self.assertEqual(User.objects.count(), 21)
+        post = Post.objects.create(author=existing, content="After generating")
+        self.assertEqual(post.id, Post.objects.order_by('-id').values_list('id', flat=True)[1] + 1)
+
+
+class QueryComplexityTestCase(TestCase):
+    """
+    Every endpoint must issue the same number of queries however much data
+    there is. Each check runs the request at several data sizes; `grow`
+    adds posts, comments, reply chains and likes around a fixed viewer,
+    post and comment so that a per-row lookup shows up as a growing count.
+    """
+
+    SIZES = (2, 25)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.viewer = User.objects.create_user('viewer', password='testpass123')
+        self.client.force_authenticate(self.viewer)
+        self.post = Post.objects.create(author=self.viewer, content="Hot post")
+        self.root = Comment.objects.create(author=self.viewer, post=self.post, content="Root")
+        self.deep = self.root
+        self.grown = 0
+
+    def grow(self, size):
+        """Add rows until there are `size` of each kind."""
+        for i in range(self.grown, size):
+            author = User.objects.create(username=f'author{i}')
+            post = Post.objects.create(author=author, content=f"Post {i}")
+            PostLike.objects.create(user=self.viewer, post=post)
+            PostLike.objects.create(user=author, post=self.post)
+            top = Comment.objects.create(author=author, post=self.post, content=f"Top {i}")
+            reply = Comment.objects.create(author=self.viewer, post=self.post, parent=top, content=f"Reply {i}")
+            Comment.objects.create(author=author, post=self.post, parent=self.root, content=f"Sibling {i}")
+            self.deep = Comment.objects.create(author=author, post=self.post, parent=self.deep, content=f"Deep {i}")
+            CommentLike.objects.create(user=self.viewer, comment=reply)
+            CommentLike.objects.create(user=author, comment=self.deep)
+        self.grown = max(self.grown, size)
+
+    def assertConstantQueries(self, request, setup=None, status=200):
+        """`request()` issues the same queries at every size in SIZES."""
+        from django.test.utils import CaptureQueriesContext
+
+        counts = {}
+        for size in self.SIZES:
+            self.grow(size)
+            if setup is not None:
+                setup()
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+            self.assertEqual(response.status_code, status, getattr(response, 'data', None))
+            counts[size] = len(queries)
+        self.assertEqual(
+            len(set(counts.values())), 1,
+            f"Query count grows with data: {counts}\n" +
+            '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+
+    def test_feed(self):
+        """Feed, anonymous and with the viewer's liked posts"""
+        self.assertConstantQueries(lambda: self.client.get('/api/posts/'))
+        self.client.force_authenticate(None)
+        self.assertConstantQueries(lambda: self.client.get('/api/posts/'))
+
+    def test_feed_next_page(self):
+        """Following a feed cursor"""
+        self.assertConstantQueries(
+            lambda: self.client.get(self.client.get('/api/posts/?page_size=1').data['next'])
+        )
+
+    def test_post_detail(self):
+        """Full comment tree (cache miss and hit) and a bounded page"""
+        self.assertConstantQueries(lambda: self.client.get(f'/api/posts/{self.post.id}/'), setup=cache.clear)
+        self.assertConstantQueries(
+            lambda: self.client.get(f'/api/posts/{self.post.id}/'),
+            setup=lambda: self.client.get(f'/api/posts/{self.post.id}/'),
+        )
+        self.assertConstantQueries(
+            lambda: self.client.get(f'/api/posts/{self.post.id}/?limit=5&depth=2&replies=3')
+        )
+
+    def test_comment_pages(self):
+        """Top-level comment pages, reply pages and comment permalinks"""
+        self.assertConstantQueries(lambda: self.client.get(f'/api/posts/{self.post.id}/comments/?limit=5'))
+        self.assertConstantQueries(lambda: self.client.get(f'/api/comments/{self.root.id}/replies/?limit=5'))
+        self.assertConstantQueries(lambda: self.client.get(f'/api/comments/{self.root.id}/'))
+
+    def test_comment_create(self):
+        """Top-level comments and replies deep in a growing chain"""
+        url = f'/api/posts/{self.post.id}/comments/'
+        self.assertConstantQueries(
+            lambda: self.client.post(url, {'content': 'New'}, format='json'), status=201
+        )
+        self.assertConstantQueries(
+            lambda: self.client.post(url, {'content': 'Reply', 'parent': self.deep.id}, format='json'),
+            status=201,
+        )
+
+    def test_like_toggles(self):
+        """Liking and unliking posts and comments"""
+        def toggle(url):
+            def request():
+                self.assertEqual(self.client.post(url).status_code, 201)
+                return self.client.post(url)
+            return request
+
+        self.assertConstantQueries(toggle(f'/api/posts/{self.post.id}/like/'))
+        self.assertConstantQueries(toggle(f'/api/comments/{self.deep.id}/like/'))
+
+    def test_leaderboard(self):
+        """Leaderboard, computed cold and served from the cache"""
+        self.assertConstantQueries(lambda: self.client.get('/api/leaderboard/'), setup=cache.clear)
+        self.assertConstantQueries(lambda: self.client.get('/api/leaderboard/'))
+
+
+class ParentAuthorQueryTestCase(TestCase):
+    """
+    `parent_author` comes from comments already fetched: a deep, wide thread
+    costs the same fixed number of queries as a single comment.
+    """
+
+    DEPTH = 12
+    WIDTH = 8
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.users = [User.objects.create_user(f'user{i}', password='pass') for i in range(self.WIDTH)]
+        self.client.force_authenticate(self.users[0])
+        self.post = Post.objects.create(author=self.users[0], content="Busy post")
+        # WIDTH chains of DEPTH comments, each level by another author, with
+        # WIDTH leaf replies under the last comment of every chain.
+        self.leaves = []
+        for chain in range(self.WIDTH):
+            parent = None
+            for level in range(self.DEPTH):
+                parent = Comment.objects.create(
+                    author=self.users[(chain + level) % self.WIDTH], post=self.post, parent=parent,
+                    content=f"{chain}.{level}",
+                )
+            for leaf in range(self.WIDTH):
+                Comment.objects.create(
+                    author=self.users[leaf], post=self.post, parent=parent, content=f"{chain}.leaf{leaf}",
+                )
+            self.leaves.append(parent)
+
+    def assertParentAuthors(self, nodes, parent_author=None):
+        """Every node names the author of the node it is nested in."""
+        for node in nodes:
+            self.assertEqual(node['parent_author'], parent_author)
+            self.assertParentAuthors(node['replies'], node['author']['username'])
+
+    def test_post_detail(self):
+        """Full tree: post, comment rows and the viewer's likes, whatever the thread's shape"""
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/posts/{self.post.id}/')
+        self.assertEqual(len(response.data['comments']), self.WIDTH)
+        self.assertParentAuthors(response.data['comments'])
+
+    def test_serializer_over_fetched_thread(self):
+        """CommentSerializer finds parents among the comments passed in its context"""
+        from types import SimpleNamespace
+        from feed.serializers import CommentSerializer
+
+        all_comments_map = {}
+        for comment in Comment.objects.filter(post=self.post).select_related('author').order_by('created_at'):
+            all_comments_map.setdefault(comment.parent_id, []).append(comment)
+        context = {
+            'request': SimpleNamespace(user=self.users[0]),
+            'all_comments_map': all_comments_map,
+            'liked_comment_ids': set(),
+        }
+        with self.assertNumQueries(0):
+            data = CommentSerializer(all_comments_map[None], many=True, context=context).data
+        self.assertParentAuthors(data)
+
+    def test_reply_create(self):
+        """Replying renders the parent's author without loading it separately"""
+        parent = self.leaves[-1]
+        with self.assertNumQueries(8):
+            response = self.client.post(
+                f'/api/posts/{self.post.id}/comments/', {'content': 'Reply', 'parent': parent.id}, format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['parent_author'], parent.author.username)
+
+
+class MetricsTestCase(TestCase):
+    """Test the request metrics middleware and the /metrics endpoint"""
+
+    def setUp(self):
+        from core.metrics import registry
+
+        registry.reset()
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.post = Post.objects.create(author=self.user, content="Test post")
+
+    def sample(self, text, line):
+        for row in text.splitlines():
+            if row.startswith(line + ' '):
+                return float(row.rsplit(' ', 1)[1])
+        self.fail(f"{line} not in metrics:\n{text}")
+
+    def test_per_route_metrics(self):
+        """Requests are counted per route pattern, status and method"""
+        self.client.get(f'/api/posts/{self.post.id}/')
+        self.client.get(f'/api/posts/{self.post.id}/')
+        self.client.get('/api/posts/999999/')
+        self.client.get('/no/such/page/')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+
+        route = 'method="GET",route="api/posts/<int:pk>/"'
+        self.assertEqual(self.sample(text, f'http_requests_total{{{route},status="200"}}'), 2)
+        self.assertEqual(self.sample(text, f'http_requests_total{{{route},status="404"}}'), 1)
+        self.assertEqual(self.sample(text, 'http_requests_total{method="GET",route="<unmatched>",status="404"}'), 1)
+        self.assertEqual(self.sample(text, f'http_request_duration_seconds_count{{{route}}}'), 3)
+        self.assertGreater(self.sample(text, f'http_request_db_queries_sum{{{route}}}'), 0)
+        self.assertEqual(self.sample(text, f'http_request_db_queries_bucket{{{route},le="0"}}'), 0)
+        self.assertGreater(self.sample(text, f'http_response_size_bytes_sum{{{route}}}'), 0)
+        self.assertEqual(
+            self.sample(text, f'http_request_duration_seconds_bucket{{{route},le="+Inf"}}'), 3
+        )
+        self.assertIn('cache_requests_total{namespace="leaderboard",outcome="hits"}', text)
+
+    def test_workers_are_summed(self):
+        """With METRICS_DIR, snapshots written by other workers are added up"""
+        import json
+        import os
+        import tempfile
+        from core.metrics import Registry, registry
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_DIR=directory, METRICS_FLUSH_INTERVAL=0):
+            self.client.get('/api/leaderboard/')
+            self.assertTrue(os.path.exists(os.path.join(directory, f'{registry.process_id}.json')))
+
+            other = Registry()
+            other.observe('GET', 'api/leaderboard/', 200, 0.5, 3, 0.1, 40)
+            other.observe('GET', 'api/leaderboard/', 500, 0.2, 1, 0.1, 10)
+            with open(os.path.join(directory, '1.json'), 'w') as f:
+                json.dump(other.snapshot(), f)
+
+            text = self.client.get('/metrics').content.decode()
+
+        route = 'method="GET",route="api/leaderboard/"'
+        self.assertEqual(self.sample(text, f'http_requests_total{{{route},status="200"}}'), 2)
+        self.assertEqual(self.sample(text, f'http_requests_total{{{route},status="500"}}'), 1)
+        self.assertEqual(self.sample(text, f'http_request_duration_seconds_count{{{route}}}'), 3)
+        self.assertEqual(self.sample(text, f'http_request_duration_seconds_bucket{{{route},le="0.25"}}'), 2)
+
+
+    def test_exited_worker_keeps_its_snapshot(self):
+        """A later worker with the same pid writes its own snapshot instead of replacing one"""
+        import json
+        import os
+        import tempfile
+        from core.metrics import Registry
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Both in this process, so with the same pid
+            for worker in (Registry(), Registry()):
+                worker.observe('GET', 'api/leaderboard/', 200, 0.5, 3, 0.1, 40)
+                worker.flush(directory)
+            snapshots = []
+            for filename in os.listdir(directory):
+                with open(os.path.join(directory, filename)) as f:
+                    snapshots.append(json.load(f))
+        self.assertEqual([snapshot['requests'] for snapshot in snapshots],
+                         [[['GET', 'api/leaderboard/', 200, 1]]] * 2)
+
+class AsyncReadViewsTestCase(TestCase):
+    """Test the async read views served through the ASGI handler"""
+
+    def setUp(self):
+        from rest_framework.authtoken.models import Token
+
+        cache.clear()
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.other = User.objects.create_user('other', password='testpass123')
+        self.token = Token.objects.create(user=self.user)
+        self.posts = [Post.objects.create(author=self.other, content=f"Post {i}") for i in range(5)]
+        self.post = self.posts[0]
+        root = Comment.objects.create(author=self.other, post=self.post, content="Root")
+        reply = Comment.objects.create(author=self.user, post=self.post, parent=root, content="Reply")
+        PostLike.objects.create(user=self.user, post=self.posts[2])
+        CommentLike.objects.create(user=self.user, comment=reply)
+        CommentLike.objects.create(user=self.other, comment=reply)
+        self.auth = {'headers': {'Authorization': f'Token {self.token.key}'}}
+
+    def sync_json(self, view, path, **kwargs):
+        """Render the sync DRF view for `path`."""
+        import json
+        from rest_framework.test import APIRequestFactory
+
+        request = APIRequestFactory().get(path, **self.auth)
+        response = view.as_view()(request, **kwargs)
+        response.render()
+        return json.loads(response.content)
+
+    async def test_responses_match_sync_views(self):
+        """Feed, post detail (full and bounded) and leaderboard match the DRF views"""
+        from asgiref.sync import sync_to_async
+        from .views import PostListView, PostDetailView, LeaderboardView
+
+        cases = [
+            ('/api/posts/?page_size=2', PostListView, {}),
+            (f'/api/posts/{self.post.id}/', PostDetailView, {'pk': self.post.id}),
+            (f'/api/posts/{self.post.id}/?limit=1&depth=1', PostDetailView, {'pk': self.post.id}),
+            ('/api/leaderboard/', LeaderboardView, {}),
+        ]
+        for path, view, kwargs in cases:
+            response = await self.async_client.get(path, **self.auth)
+            self.assertEqual(response.status_code, 200, path)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            expected = await sync_to_async(self.sync_json)(view, path, **kwargs)
+            self.assertEqual(response.json(), expected, path)
+
+        feed = (await self.async_client.get('/api/posts/', **self.auth)).json()
+        liked = [post['id'] for post in feed['results'] if post['is_liked']]
+        self.assertEqual(liked, [self.posts[2].id])
+
+    async def test_errors(self):
+        """Bad tokens, missing posts and bad parameters give DRF's error responses"""
+        response = await self.async_client.get('/api/posts/', headers={'Authorization': 'Token nope'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'detail': 'Invalid token.'})
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+        response = await self.async_client.get('/api/posts/999999/')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('detail', response.json())
+
+        response = await self.async_client.get(f'/api/posts/{self.post.id}/?depth=0')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('depth', response.json())
+
+        response = await self.async_client.get('/api/posts/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_writes_fall_through_to_sync_view(self):
+        """POST on an async route is handled by the DRF view"""
+        response = await self.async_client.post(
+            '/api/posts/', {'content': 'Created'}, content_type='application/json', **self.auth
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['content'], 'Created')
+
+        response = await self.async_client.post('/api/posts/', {'content': 'Anonymous'},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_browsable_api_falls_through_to_sync_view(self):
+        """GETs asking for HTML get the DRF view's browsable API"""
+        for path in ('/api/posts/', f'/api/posts/{self.post.id}/', '/api/leaderboard/'):
+            response = await self.async_client.get(path, headers={'Accept': 'text/html'})
+            self.assertEqual(response.status_code, 200, path)
+            self.assertTrue(response['Content-Type'].startswith('text/html'), path)
+        response = await self.async_client.get(f'/api/posts/{self.post.id}/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    async def test_queries_are_counted_in_metrics(self):
+        """Queries run in worker threads are attributed to the async request"""
+        from asgiref.sync import sync_to_async
+        from core.metrics import install_query_timer, registry
+
+        # The test database connection was opened before core.metrics was
+        # imported, so the connection_created hook never saw it.
+        await sync_to_async(install_query_timer)(connection)
+        registry.reset()
+        await self.async_client.get(f'/api/posts/{self.post.id}/', **self.auth)
+        snapshot = registry.snapshot()
+        series = dict(
+            ((method, route), values) for method, route, values in snapshot['histograms']['http_request_db_queries']
+        )
+        # Token, post, comments and liked comments.
+        self.assertEqual(series[('GET', 'api/posts/<int:pk>/')][-1], 4)
+
+
+class LikeToggleTestCase(TestCase):
+    """Test the single-statement like toggles"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='testpass123')
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(author=self.author, content="Test post")
+        self.comment = Comment.objects.create(author=self.author, post=self.post, content="Test")
+
+    def like_table_statements(self, url):
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url)
+        import re
+
+        like_table = re.compile(r'^(INSERT INTO|DELETE FROM|UPDATE|SELECT .*? FROM) "feed_(post|comment)like"')
+        statements = [q['sql'] for q in queries.captured_queries if like_table.match(q['sql'])]
+        return response, statements
+
+    def test_toggle_reports_state_and_count(self):
+        """Responses carry the new liked state and the current count"""
+        other = User.objects.create_user('other', password='testpass123')
+        PostLike.objects.create(user=other, post=self.post)
+        Post.objects.filter(pk=self.post.pk).update(likes_count=1)
+
+        response = self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'liked': True, 'likes_count': 2})
+        response = self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'liked': False, 'likes_count': 1})
+
+        response = self.client.post(f'/api/comments/{self.comment.id}/like/')
+        self.assertEqual(response.data, {'liked': True, 'likes_count': 1})
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 1)
+
+    def test_like_table_statement_count(self):
+        """Liking is one statement on the like table, unliking two, without SELECTs"""
+        for url in (f'/api/posts/{self.post.id}/like/', f'/api/comments/{self.comment.id}/like/'):
+            _, statements = self.like_table_statements(url)
+            self.assertEqual(len(statements), 1, statements)
+            self.assertTrue(statements[0].startswith('INSERT'))
+            _, statements = self.like_table_statements(url)
+            self.assertEqual([sql.split()[0] for sql in statements], ['INSERT', 'DELETE'])
+
+    def test_missing_target(self):
+        """Toggling a like on a missing post or comment is a 404 and writes nothing"""
+        self.assertEqual(self.client.post('/api/posts/999999/like/').status_code, 404)
+        self.assertEqual(self.client.post('/api/comments/999999/like/').status_code, 404)
+        self.assertFalse(PostLike.objects.exists())
+        self.assertFalse(CommentLike.objects.exists())
+
+    def test_losing_insert_leaves_counter_alone(self):
+        """An insert that conflicts with an existing like changes nothing"""
+        from .likes import TARGETS, insert_like
+
+        PostLike.objects.create(user=self.user, post=self.post)
+        with connection.cursor() as cursor:
+            self.assertIsNone(insert_like(cursor, TARGETS['post'], self.user.id, self.post.id, timezone.now()))
+        self.assertEqual(PostLike.objects.filter(user=self.user, post=self.post).count(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_karma_and_timestamps(self):
+        """Toggles credit and take back karma, and store the like's timestamp"""
+        from . import karma
+        from .likes import toggle_like
+
+        now = timezone.now()
+        toggle_like('post', self.user.id, self.post.id, now=now)
+        toggle_like('comment', self.user.id, self.comment.id, now=now)
+        self.assertEqual(PostLike.objects.get(user=self.user).created_at, now)
+        self.assertEqual(karma.leaderboard(), [{'username': 'author', 'karma': 6}])
+        self.assertEqual(aggregate_karma(timezone.now()), {'author': 6})
+
+        toggle_like('post', self.user.id, self.post.id)
+        self.assertEqual(karma.leaderboard(), [{'username': 'author', 'karma': 1}])
+
+
+class LikeBatchTestCase(TestCase):
+    """Test the batch like/unlike endpoint"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='testpass123')
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.posts = [Post.objects.create(author=self.author, content=f"Post {i}") for i in range(3)]
+        self.comment = Comment.objects.create(author=self.author, post=self.posts[0], content="Test")
+
+    def batch(self, *operations):
+        return self.client.post('/api/likes/batch/', {
+            'operations': [{'type': kind, 'id': pk, 'action': action} for kind, pk, action in operations]
+        }, format='json')
+
+    def test_applies_operations_and_returns_states(self):
+        """Likes and unlikes are applied and every target's new state is returned"""
+        p0, p1, p2 = self.posts
+        PostLike.objects.create(user=self.user, post=p1)
+        Post.objects.filter(pk=p1.pk).update(likes_count=1)
+
+        response = self.batch(
+            ('post', p0.id, 'like'), ('post', p1.id, 'unlike'), ('post', p2.id, 'unlike'),
+            ('comment', self.comment.id, 'like'),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [
+            {'type': 'post', 'id': p0.id, 'liked': True, 'likes_count': 1},
+            {'type': 'post', 'id': p1.id, 'liked': False, 'likes_count': 0},
+            {'type': 'post', 'id': p2.id, 'liked': False, 'likes_count': 0},
+            {'type': 'comment', 'id': self.comment.id, 'liked': True, 'likes_count': 1},
+        ])
+        self.assertEqual(list(PostLike.objects.values_list('post_id', flat=True)), [p0.id])
+        self.assertTrue(CommentLike.objects.filter(user=self.user, comment=self.comment).exists())
+
+    def test_idempotent_and_last_operation_wins(self):
+        """Repeating a batch changes nothing; the last operation on a target decides"""
+        p0 = self.posts[0]
+        self.batch(('post', p0.id, 'like'))
+        response = self.batch(('post', p0.id, 'like'))
+        self.assertEqual(response.data['results'][0]['likes_count'], 1)
+
+        response = self.batch(('post', p0.id, 'unlike'), ('post', p0.id, 'like'), ('post', p0.id, 'unlike'))
+        self.assertEqual(response.data['results'], [
+            {'type': 'post', 'id': p0.id, 'liked': False, 'likes_count': 0},
+        ])
+        self.assertFalse(PostLike.objects.exists())
+
+    def test_missing_targets_are_reported(self):
+        """Missing targets get an error entry while the rest of the batch applies"""
+        response = self.batch(('post', 999999, 'like'), ('post', self.posts[0].id, 'like'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0], {'type': 'post', 'id': 999999, 'error': 'Not found.'})
+        self.assertTrue(response.data['results'][1]['liked'])
+        self.assertEqual(PostLike.objects.count(), 1)
+
+    def test_validation(self):
+        """Malformed, empty and oversized batches are rejected; anonymous users get 401"""
+        self.assertEqual(self.batch().status_code, 400)
+        self.assertEqual(self.batch(('user', 1, 'like')).status_code, 400)
+        self.assertEqual(self.batch(('post', 1, 'toggle')).status_code, 400)
+        too_many = [('post', self.posts[0].id, 'like')] * 101
+        self.assertEqual(self.batch(*too_many).status_code, 400)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.batch(('post', self.posts[0].id, 'like')).status_code, 401)
+
+    def test_statements_per_type(self):
+        """Each target type costs one insert, one delete and one counter update (plus the comments' posts' versions)"""
+        from django.test.utils import CaptureQueriesContext
+
+        for post in self.posts[:2]:
+            PostLike.objects.create(user=self.user, post=post)
+        operations = [('post', post.id, 'unlike') for post in self.posts[:2]]
+        operations += [('post', self.posts[2].id, 'like'), ('comment', self.comment.id, 'like')]
+        with CaptureQueriesContext(connection) as queries:
+            self.batch(*operations)
+        import re
+
+        write = re.compile(r'^(INSERT INTO|DELETE FROM|UPDATE) ("feed_(?:post|comment)(?:like)?")')
+        statements = [
+            ' '.join(match.groups()) for match in map(write.match, (q['sql'] for q in queries.captured_queries))
+            if match
+        ]
+        self.assertEqual(statements, [
+            'INSERT INTO "feed_postlike"', 'DELETE FROM "feed_postlike"', 'UPDATE "feed_post"',
+            'INSERT INTO "feed_commentlike"', 'UPDATE "feed_comment"', 'UPDATE "feed_post"',
+        ])
+
+    def test_karma(self):
+        """Batched likes credit and take back karma like single toggles"""
+        from . import karma
+
+        self.batch(*[('post', post.id, 'like') for post in self.posts], ('comment', self.comment.id, 'like'))
+        self.assertEqual(karma.leaderboard(), [{'username': 'author', 'karma': 16}])
+        self.batch(('post', self.posts[0].id, 'unlike'), ('comment', self.comment.id, 'unlike'))
+        self.assertEqual(karma.leaderboard(), [{'username': 'author', 'karma': 10}])
+        self.assertEqual(aggregate_karma(timezone.now()), {'author': 10})
+
+
+@override_settings(LIKE_WRITE_BEHIND=True, LIKE_FLUSH_INTERVAL=0, LIKE_BUFFER_SIZE=1000)
+class LikeWriteBehindTestCase(TestCase):
+    """Test the write-behind like buffer"""
+
+    def setUp(self):
+        from .like_buffer import buffer
+
+        cache.clear()
+        self.buffer = buffer
+        # A lock of its own, so that parallel runs and dev servers don't count as other workers.
+        lock_settings = override_settings(LIKE_BUFFER_LOCK=buffer_lock_path(self))
+        lock_settings.enable()
+        self.addCleanup(lock_settings.disable)
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='testpass123')
+        self.users = [User.objects.create_user(f'user{i}', password='testpass123') for i in range(3)]
+        self.posts = [Post.objects.create(author=self.author, content=f"Post {i}") for i in range(2)]
+        self.comment = Comment.objects.create(author=self.author, post=self.posts[0], content="Test")
+
+    def tearDown(self):
+        self.buffer.pending.clear()
+        self.buffer.deltas.clear()
+        self.buffer.release()
+
+    def toggle(self, user, url):
+        self.client.force_authenticate(user)
+        response = self.client.post(url)
+        return response.status_code, response.data
+
+    def scenario(self):
+        p0, p1 = (f'/api/posts/{post.id}/like/' for post in self.posts)
+        c0 = f'/api/comments/{self.comment.id}/like/'
+        u0, u1, u2 = self.users
+        steps = [
+            (u0, p0), (u1, p0), (u2, p0), (u0, p0), (u1, c0), (u0, p1),
+            (u2, c0), (u2, c0), (u0, p0), (u1, p1), (u1, p1), (u2, p1),
+        ]
+        return [self.toggle(user, url) for user, url in steps]
+
+    def state(self):
+        from . import karma
+
+        return {
+            'post_likes': set(PostLike.objects.values_list('user_id', 'post_id')),
+            'comment_likes': set(CommentLike.objects.values_list('user_id', 'comment_id')),
+            'post_counts': dict(Post.objects.values_list('id', 'likes_count')),
+            'comment_counts': dict(Comment.objects.values_list('id', 'likes_count')),
+            'leaderboard': karma.leaderboard(),
+            'karma_24h': aggregate_karma(timezone.now()),
+        }
+
+    def reset(self):
+        PostLike.objects.all().delete()
+        CommentLike.objects.all().delete()
+        Post.objects.update(likes_count=0)
+        Comment.objects.update(likes_count=0)
+
+    def test_final_state_matches_synchronous_mode(self):
+        """After a flush, likes, counters and karma equal those of synchronous toggles"""
+        with override_settings(LIKE_WRITE_BEHIND=False):
+            sync_responses = self.scenario()
+        sync_state = self.state()
+        self.assertTrue(sync_state['post_likes'])
+
+        self.reset()
+        self.assertEqual(self.state()['leaderboard'], [])
+        buffered_responses = self.scenario()
+        self.assertFalse(PostLike.objects.exists())
+        self.assertEqual(self.buffer.flush(), 6)
+        self.assertEqual(buffered_responses, sync_responses)
+        self.assertEqual(self.state(), sync_state)
+
+    def test_batch_builds_on_pending_toggles(self):
+        """A batch goes through the buffer: it sees pending toggles, and the flush keeps its states"""
+        post, other = self.posts
+        user = self.users[0]
+        self.toggle(user, f'/api/posts/{post.id}/like/')
+        self.toggle(self.users[1], f'/api/posts/{other.id}/like/')
+
+        self.client.force_authenticate(user)
+        response = self.client.post('/api/likes/batch/', {'operations': [
+            {'type': 'post', 'id': post.id, 'action': 'unlike'},
+            {'type': 'post', 'id': other.id, 'action': 'like'},
+            {'type': 'comment', 'id': self.comment.id, 'action': 'like'},
+            {'type': 'comment', 'id': 999999, 'action': 'like'},
+        ]}, format='json')
+        self.assertEqual(response.data['results'], [
+            {'type': 'post', 'id': post.id, 'liked': False, 'likes_count': 0},
+            {'type': 'post', 'id': other.id, 'liked': True, 'likes_count': 2},
+            {'type': 'comment', 'id': self.comment.id, 'liked': True, 'likes_count': 1},
+            {'type': 'comment', 'id': 999999, 'error': 'Not found.'},
+        ])
+        self.assertFalse(PostLike.objects.exists())
+
+        self.buffer.flush()
+        self.assertEqual(set(PostLike.objects.values_list('user_id', 'post_id')),
+                         {(self.users[1].id, other.id), (user.id, other.id)})
+        self.assertEqual(set(CommentLike.objects.values_list('user_id', 'comment_id')), {(user.id, self.comment.id)})
+        self.assertEqual(dict(Post.objects.values_list('id', 'likes_count')), {post.id: 0, other.id: 2})
+
+    def test_single_worker_only(self):
+        """Buffering likes in a second process fails rather than losing toggles"""
+        import subprocess
+        import sys
+        from django.conf import settings
+        from django.core.exceptions import ImproperlyConfigured
+
+        path = settings.LIKE_BUFFER_LOCK
+        other_worker = subprocess.Popen(
+            [sys.executable, '-c', (
+                'import fcntl, sys, time\n'
+                f'lock_file = open({path!r}, "a")\n'
+                'fcntl.lockf(lock_file, fcntl.LOCK_EX)\n'
+                'print("locked", flush=True)\n'
+                'sys.stdin.read()\n'
+            )],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        self.assertEqual(other_worker.stdout.readline().strip(), 'locked')
+        url = f'/api/posts/{self.posts[0].id}/like/'
+        try:
+            with self.assertRaisesMessage(ImproperlyConfigured, 'single worker process'):
+                self.toggle(self.users[0], url)
+        finally:
+            other_worker.communicate()
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.toggle(self.users[0], url), (201, {'liked': True, 'likes_count': 1}))
+
+    def test_flush_between_read_and_record(self):
+        """A toggle whose read misses a flush that commits meanwhile reads again"""
+        from unittest import mock
+
+        url = f'/api/posts/{self.posts[0].id}/like/'
+        user = self.users[0]
+        self.toggle(user, url)
+        read = self.buffer._read
+        flushed = []
+
+        def read_then_flush(*args):
+            rows = read(*args)
+            if not flushed:
+                flushed.append(self.buffer.flush())
+            return rows
+
+        with mock.patch.object(self.buffer, '_read', side_effect=read_then_flush):
+            self.assertEqual(self.toggle(user, url), (200, {'liked': False, 'likes_count': 0}))
+        self.assertEqual(flushed, [1])
+        self.buffer.flush()
+        self.assertFalse(PostLike.objects.exists())
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].likes_count, 0)
+
+    def test_failed_flush_rebases_later_toggles(self):
+        """Toggles recorded during a flush that fails build on the database it left unchanged"""
+        from unittest import mock
+        from django.db import OperationalError
+
+        post, other = self.posts
+        user = self.users[0]
+        self.toggle(user, f'/api/posts/{post.id}/like/')
+        self.toggle(user, f'/api/posts/{other.id}/like/')
+
+        def toggle_then_fail(*args):
+            # Unlike the first post, unlike and like again the second one.
+            self.toggle(user, f'/api/posts/{post.id}/like/')
+            self.toggle(user, f'/api/posts/{other.id}/like/')
+            self.toggle(user, f'/api/posts/{other.id}/like/')
+            raise OperationalError('database is locked')
+
+        with mock.patch('feed.like_buffer.apply_likes', side_effect=toggle_then_fail):
+            with self.assertRaises(OperationalError):
+                self.buffer.flush()
+        self.assertEqual(self.buffer.pending, {('post', user.id, other.id): (True, False)})
+
+        self.client.force_authenticate(user)
+        feed = {p['id']: (p['is_liked'], p['likes_count']) for p in self.client.get('/api/posts/').data['results']}
+        self.assertEqual(feed, {post.id: (False, 0), other.id: (True, 1)})
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(set(PostLike.objects.values_list('user_id', 'post_id')), {(user.id, other.id)})
+        self.assertEqual(dict(Post.objects.values_list('id', 'likes_count')), {post.id: 0, other.id: 1})
+
+    def test_toggles_collapse(self):
+        """Toggling twice before a flush leaves nothing to write"""
+        url = f'/api/posts/{self.posts[0].id}/like/'
+        self.assertEqual(self.toggle(self.users[0], url), (201, {'liked': True, 'likes_count': 1}))
+        self.assertEqual(self.toggle(self.users[0], url), (200, {'liked': False, 'likes_count': 0}))
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_reads_merge_pending_likes(self):
+        """The feed, post detail and comment pages show pending likes before the flush"""
+        user = self.users[0]
+        post = self.posts[0]
+        self.toggle(user, f'/api/posts/{post.id}/like/')
+        self.toggle(user, f'/api/comments/{self.comment.id}/like/')
+        self.toggle(self.users[1], f'/api/comments/{self.comment.id}/like/')
+
+        self.client.force_authenticate(user)
+        feed_post = next(p for p in self.client.get('/api/posts/').data['results'] if p['id'] == post.id)
+        self.assertEqual((feed_post['is_liked'], feed_post['likes_count']), (True, 1))
+        for url in (f'/api/posts/{post.id}/', f'/api/posts/{post.id}/?limit=5'):
+            data = self.client.get(url).data
+            self.assertEqual((data['is_liked'], data['likes_count']), (True, 1))
+            comment = data['comments'][0]
+            self.assertEqual((comment['is_liked'], comment['likes_count']), (True, 2))
+
+        self.client.force_authenticate(self.users[2])
+        data = self.client.get(f'/api/comments/{self.comment.id}/').data
+        self.assertEqual((data['is_liked'], data['likes_count']), (False, 2))
+
+        self.buffer.flush()
+        data = self.client.get(f'/api/comments/{self.comment.id}/').data
+        self.assertEqual((data['is_liked'], data['likes_count']), (False, 2))
+
+    def test_flush_on_size_threshold(self):
+        """A full buffer is flushed by the toggle that fills it"""
+        with override_settings(LIKE_BUFFER_SIZE=3):
+            for user in self.users[:2]:
+                self.toggle(user, f'/api/posts/{self.posts[0].id}/like/')
+            self.assertFalse(PostLike.objects.exists())
+            self.toggle(self.users[2], f'/api/posts/{self.posts[0].id}/like/')
+        self.assertEqual(PostLike.objects.count(), 3)
+        self.assertEqual(len(self.buffer), 0)
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].likes_count, 3)
+
+    def test_missing_target(self):
+        """Toggling a missing target is still a 404"""
+        self.assertEqual(self.toggle(self.users[0], '/api/posts/999999/like/')[0], 404)
+        self.assertEqual(len(self.buffer), 0)
+
+
+class ConditionalGetTestCase(TestCase):
+    """Test ETag / Last-Modified validators on the feed and post detail"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(author=self.user, content="Test post")
+        self.comment = Comment.objects.create(author=self.user, post=self.post, content="Test")
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def assertNotModified(self, url, etag):
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        # Only the post (or page of posts) is read: no comments, no likes.
+        self.assertEqual(len(queries), 1, [q['sql'] for q in queries.captured_queries])
+
+    def test_post_detail(self):
+        """Unchanged posts answer If-None-Match with a 304 from one query"""
+        url = f'/api/posts/{self.post.id}/'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertIn('Authorization', response['Vary'])
+        self.assertNotModified(url, etag)
+        self.assertNotModified(url + '?limit=5', self.etag(url + '?limit=5'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='W/"other"').status_code, 200)
+
+    def test_activity_changes_etag(self):
+        """Comments and likes on the post or its comments change its ETag"""
+        url = f'/api/posts/{self.post.id}/'
+        etags = [self.etag(url)]
+        self.client.post(f'/api/posts/{self.post.id}/comments/', {'content': 'New'}, format='json')
+        etags.append(self.etag(url))
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        etags.append(self.etag(url))
+        self.client.post(f'/api/comments/{self.comment.id}/like/')
+        etags.append(self.etag(url))
+        self.client.post('/api/likes/batch/', {'operations': [
+            {'type': 'comment', 'id': self.comment.id, 'action': 'unlike'},
+        ]}, format='json')
+        etags.append(self.etag(url))
+        self.assertEqual(len(set(etags)), len(etags))
+
+        # A batch that changes nothing leaves the version alone.
+        self.client.post('/api/likes/batch/', {'operations': [
+            {'type': 'comment', 'id': self.comment.id, 'action': 'unlike'},
+        ]}, format='json')
+        self.assertEqual(self.etag(url), etags[-1])
+
+        # is_liked differs between users.
+        self.client.force_authenticate(User.objects.create_user('other', password='testpass123'))
+        self.assertNotEqual(self.etag(url), etags[-1])
+
+    def test_feed(self):
+        """The feed page's ETag follows its posts' versions"""
+        etag = self.etag('/api/posts/')
+        self.assertNotModified('/api/posts/', etag)
+        Post.objects.create(author=self.user, content="Newer")
+        new_etag = self.etag('/api/posts/')
+        self.assertNotEqual(new_etag, etag)
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertNotEqual(self.etag('/api/posts/'), new_etag)
+
+    def test_if_modified_since(self):
+        """If-Modified-Since is answered from last_activity_at"""
+        url = f'/api/posts/{self.post.id}/'
+        Post.objects.filter(pk=self.post.pk).update(last_activity_at=timezone.now() - timedelta(seconds=5))
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        Post.objects.filter(pk=self.post.pk).update(last_activity_at=timezone.now() - timedelta(seconds=2))
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_last_modified_within_a_second(self):
+        """Last-Modified rounds up, and is left out until that second is over"""
+        from email.utils import parsedate_to_datetime
+        from unittest import mock
+
+        url = f'/api/posts/{self.post.id}/'
+        activity = timezone.now().replace(microsecond=250000) - timedelta(seconds=10)
+        Post.objects.filter(pk=self.post.pk).update(last_activity_at=activity)
+        # Still within the second: a like later in it would get the same one.
+        with mock.patch('feed.views.time.time', return_value=activity.timestamp() + 0.5):
+            self.assertNotIn('Last-Modified', self.client.get(url))
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(parsedate_to_datetime(last_modified), activity.replace(microsecond=0) + timedelta(seconds=1))
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_no_last_modified_on_lists(self):
+        """Feed pages carry only an ETag: they change without their posts' activity"""
+        Post.objects.update(last_activity_at=timezone.now() - timedelta(hours=1))
+        for url in ('/api/posts/', '/api/posts/?sort=top&window=day'):
+            response = self.client.get(url)
+            self.assertIn('ETag', response)
+            self.assertNotIn('Last-Modified', response)
+
+    def test_sync_views(self):
+        """The sync DRF views answer conditional requests the same way"""
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from .views import PostDetailView, PostListView
+
+        factory = APIRequestFactory()
+        for view, path, kwargs in (
+            (PostDetailView, f'/api/posts/{self.post.id}/', {'pk': self.post.id}),
+            (PostListView, '/api/posts/', {}),
+        ):
+            request = factory.get(path)
+            force_authenticate(request, self.user)
+            etag = view.as_view()(request, **kwargs)['ETag']
+            self.assertEqual(etag, self.etag(path))
+            request = factory.get(path, HTTP_IF_NONE_MATCH=etag)
+            force_authenticate(request, self.user)
+            self.assertEqual(view.as_view()(request, **kwargs).status_code, 304)
+
+    @override_settings(LIKE_WRITE_BEHIND=True, LIKE_FLUSH_INTERVAL=0)
+    def test_no_validators_while_likes_are_pending(self):
+        """Responses overlaying buffered likes carry no validators"""
+        from .like_buffer import buffer
+
+        url = f'/api/posts/{self.post.id}/'
+        etag = self.etag(url)
+        with override_settings(LIKE_BUFFER_LOCK=buffer_lock_path(self)):
+            self.client.post(f'/api/posts/{self.post.id}/like/')
+            try:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('ETag', response)
+                buffer.flush()
+                self.assertNotEqual(self.etag(url), etag)
+            finally:
+                buffer.pending.clear()
+                buffer.deltas.clear()
+                buffer.release()
+
+
+class CommentTreeCacheTestCase(TestCase):
+    """Test the cached comment tree of the post detail view"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.other = User.objects.create_user('other', password='testpass123')
+        self.post = Post.objects.create(author=self.other, content="Test post")
+        self.root = Comment.objects.create(author=self.other, post=self.post, content="Root")
+        self.reply = Comment.objects.create(author=self.other, post=self.post, parent=self.root, content="Reply")
+        self.url = f'/api/posts/{self.post.id}/'
+
+    def get(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def liked(self, response):
+        root = response.data['comments'][0]
+        return root['is_liked'], root['replies'][0]['is_liked']
+
+    def test_hit_overlays_viewers_likes(self):
+        """A cached tree costs the post query and one CommentLike query"""
+        from django.test.utils import CaptureQueriesContext
+
+        CommentLike.objects.create(user=self.user, comment=self.reply)
+        self.assertEqual(self.get(self.user)['X-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(self.user)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(self.liked(response), (False, True))
+        self.assertEqual(len(queries), 2)
+        self.assertIn('feed_commentlike', queries.captured_queries[1]['sql'])
+
+        response = self.get(self.other)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(self.liked(response), (False, False))
+        self.client.force_authenticate(None)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.liked(self.client.get(self.url)), (False, False))
+        self.assertEqual(len(queries), 1)
+
+    def test_invalidated_by_comments_and_comment_likes(self):
+        """Creating a comment or toggling a comment like rebuilds the tree"""
+        self.get(self.user)
+        self.client.post(self.url + 'comments/', {'content': 'New', 'parent': self.root.id}, format='json')
+        response = self.get(self.user)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['comments'][0]['replies']), 2)
+
+        self.client.post(f'/api/comments/{self.reply.id}/like/')
+        response = self.get(self.user)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['comments'][0]['replies'][0]['likes_count'], 1)
+        self.assertEqual(self.liked(response), (False, True))
+
+        self.client.post('/api/likes/batch/', {'operations': [
+            {'type': 'comment', 'id': self.root.id, 'action': 'like'},
+        ]}, format='json')
+        response = self.get(self.other)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['comments'][0]['likes_count'], 1)
+        self.assertEqual(self.get(self.user)['X-Cache'], 'HIT')
+
+
+    def test_post_likes_keep_the_tree(self):
+        """Liking the post changes its ETag and count, but the cached tree is still used"""
+        etag = self.get(self.user)['ETag']
+        self.client.post(self.url + 'like/')
+        self.client.force_authenticate(self.other)
+        self.client.post('/api/likes/batch/', {'operations': [
+            {'type': 'post', 'id': self.post.id, 'action': 'like'},
+        ]}, format='json')
+
+        response = self.get(self.user)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual((response.data['likes_count'], response.data['is_liked']), (2, True))
+
+class LikedLookupTestCase(TestCase):
+    """Test that is_liked lookups are bounded to the posts rendered"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.posts = [Post.objects.create(author=self.user, content=f"Post {i}") for i in range(30)]
+        # A long like history, mostly outside the first page.
+        for post in self.posts[::2]:
+            PostLike.objects.create(user=self.user, post=post)
+
+    def test_feed_page(self):
+        """The feed page and its liked flags come from one query"""
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/posts/?page_size=5')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('EXISTS', queries.captured_queries[0]['sql'])
+        liked = {post.id for post in self.posts[::2]}
+        self.assertEqual(
+            [post['is_liked'] for post in response.data['results']],
+            [post['id'] in liked for post in response.data['results']],
+        )
+
+        self.client.force_authenticate(None)
+        response = self.client.get('/api/posts/?page_size=5')
+        self.assertFalse(any(post['is_liked'] for post in response.data['results']))
+
+    def test_post_detail(self):
+        """The post detail reports whether the viewer liked the post"""
+        self.assertTrue(self.client.get(f'/api/posts/{self.posts[0].id}/').data['is_liked'])
+        self.assertFalse(self.client.get(f'/api/posts/{self.posts[1].id}/').data['is_liked'])
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    """Test the cached token -> user lookups"""
+
+    def setUp(self):
+        from rest_framework.authtoken.models import Token
+        from . import authentication
+
+        cache.clear()
+        authentication.tokens.clear()
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.token = Token.objects.create(user=self.user)
+        self.post = Post.objects.create(author=self.user, content="Test post")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def token_queries(self, method, url):
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url)
+        return response, sum('authtoken_token' in q['sql'] for q in queries.captured_queries)
+
+    def test_lookup_is_cached(self):
+        """Only the first request with a token queries it, on sync and async views"""
+        response, queries = self.token_queries('get', '/api/posts/')
+        self.assertEqual((response.status_code, queries), (200, 1))
+        response, queries = self.token_queries('get', '/api/posts/')
+        self.assertEqual(queries, 0)
+        response, queries = self.token_queries('post', f'/api/posts/{self.post.id}/like/')
+        self.assertEqual((response.status_code, queries), (201, 0))
+        self.assertTrue(PostLike.objects.filter(user=self.user).exists())
+
+    def test_shared_cache(self):
+        """A worker with a cold LRU finds the user in the shared cache"""
+        from . import authentication
+
+        self.token_queries('get', '/api/posts/')
+        authentication.tokens.clear()
+        response, queries = self.token_queries('get', '/api/posts/')
+        self.assertEqual((response.status_code, queries), (200, 0))
+
+    def test_deleted_token(self):
+        """Deleting (or rotating) a token invalidates it immediately"""
+        from rest_framework.authtoken.models import Token
+
+        self.token_queries('get', '/api/posts/')
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/posts/').status_code, 401)
+        self.assertEqual(self.client.post(f'/api/posts/{self.post.id}/like/').status_code, 401)
+
+        rotated = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {rotated.key}')
+        self.assertEqual(self.client.post(f'/api/posts/{self.post.id}/like/').status_code, 201)
+
+    def test_lookup_during_delete_transaction(self):
+        """A lookup cached before the deleting transaction commits is dropped on commit"""
+        from django.db import transaction
+        from . import authentication
+
+        key = self.token.key
+        user = authentication.get_user(key)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.token.delete()
+                # A concurrent request, which still sees the token row
+                authentication.cache.set(authentication._cache_key(key), user)
+                authentication.tokens.set(key, user)
+        self.assertEqual(self.client.get('/api/posts/').status_code, 401)
+
+    def test_deactivated_user(self):
+        """Deactivating a user invalidates their cached token"""
+        self.token_queries('get', '/api/posts/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/posts/').status_code, 401)
+        self.assertEqual(self.client.post(f'/api/posts/{self.post.id}/like/').status_code, 401)
+
+    def test_invalid_token(self):
+        """Unknown tokens are rejected"""
+        self.client.credentials(HTTP_AUTHORIZATION='Token nope')
+        self.assertEqual(self.client.get('/api/posts/').status_code, 401)
+        self.assertEqual(self.client.post(f'/api/posts/{self.post.id}/like/').status_code, 401)
+
+    def test_lru_bounds(self):
+        """The LRU evicts the least recently used entry and expires entries after the TTL"""
+        import time
+        from unittest import mock
+        from .authentication import LRUCache
+
+        lru = LRUCache(size=2, ttl=10)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+        expired = time.monotonic() + 10
+        with mock.patch('feed.authentication.time.monotonic', return_value=expired):
+            self.assertIsNone(lru.get('a'))
+
+
+class StreamingTestCase(TestCase):
+    """Test the streamed comment tree and the NDJSON feed export"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', password='testpass123')
+        self.other = User.objects.create_user('other', password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.posts = [Post.objects.create(author=self.other, content=f"Post {i} ✓") for i in range(3)]
+        self.post = self.posts[0]
+        root = Comment.objects.create(author=self.other, post=self.post, content="Root")
+        reply = Comment.objects.create(author=self.user, post=self.post, parent=root, content="Reply \"quoted\"")
+        Comment.objects.create(author=self.other, post=self.post, parent=reply, content="Deeper")
+        Comment.objects.create(author=self.other, post=self.post, parent=root, content="Sibling")
+        Comment.objects.create(author=self.user, post=self.post, content="Second root")
+        CommentLike.objects.create(user=self.user, comment=reply)
+        PostLike.objects.create(user=self.user, post=self.posts[1])
+
+    def test_stream_matches_regular_response(self):
+        """?stream=1 yields the same JSON as the regular post detail"""
+        import json
+
+        url = f'/api/posts/{self.post.id}/'
+        regular = json.loads(self.client.get(url).content)
+        response = self.client.get(url + '?stream=1')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('ETag', response)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), regular)
+
+        self.client.force_authenticate(None)
+        regular = json.loads(self.client.get(url).content)
+        self.assertEqual(json.loads(b''.join(self.client.get(url + '?stream=1').streaming_content)), regular)
+
+        empty = self.posts[2]
+        streamed = json.loads(b''.join(self.client.get(f'/api/posts/{empty.id}/?stream=1').streaming_content))
+        self.assertEqual(streamed['comments'], [])
+
+    def test_sync_view_stream(self):
+        """The sync DRF view streams the same body"""
+        import json
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from .views import PostDetailView
+
+        request = APIRequestFactory().get(f'/api/posts/{self.post.id}/?stream=1')
+        force_authenticate(request, self.user)
+        response = PostDetailView.as_view()(request, pk=self.post.id)
+        self.assertTrue(response.streaming)
+        regular = json.loads(self.client.get(f'/api/posts/{self.post.id}/').content)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), regular)
+
+    def test_stream_is_chunked(self):
+        """The tree is sent in several chunks rather than one body"""
+        from unittest import mock
+
+        with mock.patch('feed.streaming.CHUNK_BYTES', 100):
+            chunks = list(self.client.get(f'/api/posts/{self.post.id}/?stream=1').streaming_content)
+        self.assertGreater(len(chunks), 3)
+
+    async def test_stream_over_asgi(self):
+        """Under ASGI the body is an async iterator"""
+        import json
+        from django.test import AsyncClient
+
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        regular = json.loads((await client.get(f'/api/posts/{self.post.id}/')).content)
+        response = await client.get(f'/api/posts/{self.post.id}/?stream=1')
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(json.loads(body), regular)
+
+    def test_export(self):
+        """The export has one feed entry per line, newest first"""
+        import json
+
+        response = self.client.get('/api/posts/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        feed = json.loads(self.client.get('/api/posts/').content)['results']
+        self.assertEqual([json.loads(line) for line in lines], feed)
+        self.assertTrue(json.loads(lines[1])['is_liked'])
+
+
+class SqliteProfileTestCase(TransactionTestCase):
+    """The SQLite profile of the settings, and retries of writes that time out on its lock"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('writer', password='testpass123')
+        self.post = Post.objects.create(author=self.user, content="Contended post")
+        self.client.force_authenticate(user=self.user)
+
+    def file_connection(self, path, **options):
+        """A connection to the SQLite file `path`, configured like the default one."""
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+
+        settings_dict = dict(connection.settings_dict, NAME=path)
+        settings_dict['OPTIONS'] = {**settings_dict['OPTIONS'], **options}
+        wrapper = DatabaseWrapper(settings_dict, alias='sqlite-profile')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_connection_pragmas(self):
+        """Every connection is switched to WAL with the tuned pragmas"""
+        import os
+        import tempfile
+
+        directory = tempfile.mkdtemp()
+        wrapper = self.file_connection(os.path.join(directory, 'profile.sqlite3'))
+        with wrapper.cursor() as cursor:
+            pragmas = {
+                name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size')
+            }
+        self.assertEqual(pragmas, {
+            'journal_mode': 'wal',
+            'synchronous': 1,  # NORMAL
+            'busy_timeout': int(connection.settings_dict['OPTIONS']['timeout'] * 1000),
+            'mmap_size': 268435456,
+            'cache_size': -65536,
+        })
+
+    def test_transactions_take_the_write_lock_first(self):
+        """A second writer waits at BEGIN, while reads go on alongside the writer"""
+        import os
+        import tempfile
+        from django.db import OperationalError
+
+        path = os.path.join(tempfile.mkdtemp(), 'profile.sqlite3')
+        writer = self.file_connection(path, timeout=0.05)
+        other = self.file_connection(path, timeout=0.05)
+        with writer.cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+        writer._start_transaction_under_autocommit()
+        with writer.cursor() as cursor:
+            cursor.execute('INSERT INTO item DEFAULT VALUES')
+
+        other.ensure_connection()
+        with self.assertRaisesMessage(OperationalError, 'database is locked'):
+            other._start_transaction_under_autocommit()
+        with other.cursor() as cursor:
+            self.assertEqual(cursor.execute('SELECT COUNT(*) FROM item').fetchone()[0], 0)
+
+    def test_toggle_retried_on_lock(self):
+        """A toggle whose transaction hits the lock is rolled back and run again"""
+        from unittest import mock
+        from django.db import OperationalError
+        from . import likes
+
+        insert_like = likes.insert_like
+        calls = []
+
+        def locked_twice(*args):
+            calls.append(args)
+            if len(calls) <= 2:
+                raise OperationalError('database is locked')
+            return insert_like(*args)
+
+        with override_settings(DATABASE_LOCK_RETRY_DELAY=0), \
+                mock.patch('feed.likes.insert_like', side_effect=locked_twice):
+            response = self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['likes_count'], 1)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(PostLike.objects.filter(post=self.post).count(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+    def test_retries_are_bounded(self):
+        """Only lock errors are retried, DATABASE_LOCK_RETRIES times, and not inside a transaction"""
+        from unittest import mock
+        from django.db import OperationalError, transaction
+        from . import likes
+
+        cases = [
+            ('database is locked', False, 3),
+            ('no such table: feed_postlike', False, 1),
+            ('database is locked', True, 1),
+        ]
+        for message, in_transaction, attempts in cases:
+            with self.subTest(message=message, in_transaction=in_transaction):
+                insert_like = mock.Mock(side_effect=OperationalError(message))
+                with override_settings(DATABASE_LOCK_RETRIES=2, DATABASE_LOCK_RETRY_DELAY=0), \
+                        mock.patch('feed.likes.insert_like', insert_like), \
+                        self.assertRaisesMessage(OperationalError, message):
+                    if in_transaction:
+                        with transaction.atomic():
+                            likes.toggle_like('post', self.user.id, self.post.id)
+                    else:
+                        likes.toggle_like('post', self.user.id, self.post.id)
+                self.assertEqual(insert_like.call_count, attempts)
@@ -0,0 +1,176 @@
+"""
+Bounded loading of comment threads.
+
+A page of comments is the first `limit` children of a parent (or of the
+post), each with its replies down to `depth` levels and at most `replies`
+children per comment. Whatever the size of the thread, a page costs three
+queries: the page of children, one range scan over their subtrees on
+(post, path) that caps siblings with ROW_NUMBER(), and the viewer's likes.
+
+Comments whose replies were cut off carry `has_more: true` and a
+`continuation` URL that loads the next page of their replies.
+"""
+import base64
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.urls import reverse
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.utils.urls import replace_query_param
+
+from .like_buffer import buffer as like_buffer
+from .models import Comment, CommentLike, PATH_END
+from .serializers import COMMENT_TREE_COLUMNS, build_comment_tree
+
+ROW_COLUMNS = COMMENT_TREE_COLUMNS + ('path', 'depth')
+PATH = len(COMMENT_TREE_COLUMNS)
+DEPTH = PATH + 1
+
+
+class ThreadLimits(namedtuple('ThreadLimits', ['limit', 'depth', 'replies'])):
+    """Page size of the first level, levels to include, replies per comment."""
+
+    PARAMS = ('limit', 'depth', 'replies')
+
+    @property
+    def bounded(self):
+        return any(value is not None for value in self)
+
+    @classmethod
+    def from_request(cls, request, default_limit=None):
+        values = {}
+        for name in cls.PARAMS:
+            raw = request.query_params.get(name)
+            if raw is None:
+                values[name] = None
+                continue
+            try:
+                value = int(raw)
+            except ValueError:
+                value = 0
+            if value < 1:
+                raise ValidationError({name: 'Must be a positive integer.'})
+            values[name] = min(value, settings.MAX_COMMENT_PAGE_SIZE)
+        if values['limit'] is None:
+            values['limit'] = default_limit
+        return cls(**values)
+
+    def query_params(self, limit):
+        params = {'limit': limit, 'depth': self.depth, 'replies': self.replies}
+        return {name: value for name, value in params.items() if value is not None}
+
+
+def encode_cursor(after_id):
+    payload = json.dumps({'a': after_id}, separators=(',', ':')).encode('ascii')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_cursor(request):
+    encoded = request.query_params.get('cursor')
+    if encoded is None:
+        return None
+    try:
+        after_id = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))['a']
+        if not isinstance(after_id, int):
+            raise ValueError
+        return after_id
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        raise NotFound('Invalid cursor')
+
+
+def continuation_url(request, url_name, pk, after_id, params):
+    url = request.build_absolute_uri(reverse(url_name, args=[pk]))
+    for name, value in params.items():
+        url = replace_query_param(url, name, value)
+    if after_id is not None:
+        url = replace_query_param(url, 'cursor', encode_cursor(after_id))
+    return url
+
+
+def load_comment_page(request, post_id, limits, parent=None, parent_author=None, after_id=None):
+    """
+    Load one page of `parent`'s replies (top-level comments when `parent`
+    is None) after comment `after_id`. Returns (nodes, next_after_id), where
+    next_after_id is None when there is nothing more to load.
+    """
+    children = Comment.objects.filter(post_id=post_id, parent=parent).order_by('id')
+    if after_id is not None:
+        children = children.filter(id__gt=after_id)
+    children = children.values_list(*ROW_COLUMNS)
+    if limits.limit is not None:
+        top = list(children[:limits.limit + 1])
+        has_more = len(top) > limits.limit
+        top = top[:limits.limit]
+    else:
+        top = list(children)
+        has_more = False
+    if not top:
+        return [], None
+
+    base_depth = top[0][DEPTH]
+    descendants = Comment.objects.filter(
+        post_id=post_id,
+        path__gt=top[0][PATH],
+        path__lt=top[-1][PATH] + PATH_END,
+        depth__gt=base_depth,
+    )
+    if limits.depth is not None:
+        # One level past the cut-off tells us which comments have more replies.
+        descendants = descendants.filter(depth__lte=base_depth + limits.depth)
+    if limits.replies is not None:
+        descendants = descendants.annotate(
+            sibling_rank=Window(RowNumber(), partition_by=[F('parent_id')], order_by=F('path').asc())
+        ).filter(sibling_rank__lte=limits.replies + 1)
+    descendants = descendants.order_by('path').values_list(*ROW_COLUMNS)
+
+    kept = list(top)
+    present = {row[0] for row in top}
+    shown = {}
+    truncated = {}  # comment id -> id of its last shown reply (None: none shown)
+    max_depth = base_depth + limits.depth - 1 if limits.depth is not None else None
+    for row in descendants:
+        comment_id, parent_id, depth = row[0], row[1], row[DEPTH]
+        if parent_id not in present:
+            continue
+        if max_depth is not None and depth > max_depth:
+            truncated.setdefault(parent_id, None)
+            continue
+        if limits.replies is not None and len(shown.get(parent_id, ())) >= limits.replies:
+            truncated[parent_id] = shown[parent_id][-1]
+            continue
+        shown.setdefault(parent_id, []).append(comment_id)
+        present.add(comment_id)
+        kept.append(row)
+
+    liked_comment_ids = set()
+    if request.user.is_authenticated:
+        liked_comment_ids = set(
+            CommentLike.objects.filter(user=request.user, comment_id__in=present)
+            .values_list('comment_id', flat=True)
+        )
+
+    nodes = build_comment_tree(
+        [row[:PATH] for row in kept], post_id, liked_comment_ids,
+        root_parent_id=parent.id if parent is not None else None,
+        root_parent_author=parent_author,
+    )
+    like_buffer.overlay('comment', request.user, nodes)
+
+    reply_params = limits.query_params(limit=limits.replies)
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        if node['id'] in truncated:
+            node['has_more'] = True
+            node['continuation'] = continuation_url(
+                request, 'comment-replies', node['id'], truncated[node['id']], reply_params
+            )
+        else:
+            node['has_more'] = False
+            node['continuation'] = None
+        stack.extend(node['replies'])
+
+    return nodes, (top[-1][0] if has_more else None)
@@ -1,15 +1,23 @@
 from django.urls import path
 from .views import (
-    PostListView, PostDetailView, LikePostView, LikeCommentView, 
-    LeaderboardView, CommentCreateView, RegisterView
+    LikePostView, LikeCommentView, LikeBatchView, CommentCreateView, CommentThreadView, CommentRepliesView,
+    LeaderboardRankingView, LeaderboardRankView, PostExportView, RegisterView, SearchView
 )
+from . import async_views
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
-    path('posts/', PostListView.as_view(), name='post-list'),
-    path('posts/<int:pk>/', PostDetailView.as_view(), name='post-detail'),
+    path('posts/', async_views.post_list, name='post-list'),
+    path('posts/export/', PostExportView.as_view(), name='post-export'),
+    path('posts/<int:pk>/', async_views.post_detail, name='post-detail'),
     path('posts/<int:pk>/like/', LikePostView.as_view(), name='post-like'),
     path('posts/<int:pk>/comments/', CommentCreateView.as_view(), name='comment-create'),
+    path('comments/<int:pk>/', CommentThreadView.as_view(), name='comment-thread'),
+    path('comments/<int:pk>/replies/', CommentRepliesView.as_view(), name='comment-replies'),
     path('comments/<int:pk>/like/', LikeCommentView.as_view(), name='comment-like'),
-    path('leaderboard/', LeaderboardView.as_view(), name='leaderboard'),
+    path('likes/batch/', LikeBatchView.as_view(), name='like-batch'),
+    path('leaderboard/', async_views.leaderboard, name='leaderboard'),
+    path('leaderboard/ranking/', LeaderboardRankingView.as_view(), name='leaderboard-ranking'),
+    path('leaderboard/me/', LeaderboardRankView.as_view(), name='leaderboard-rank'),
+    path('search/', SearchView.as_view(), name='search'),
 ]
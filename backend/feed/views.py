@@ -1,19 +1,80 @@
+import base64
+import hashlib
+import json
+import math
+import time
+
 from rest_framework import generics, status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.exceptions import NotFound, ValidationError
 from django.shortcuts import get_object_or_404
 from django.db import transaction
-from django.db.models import Count, Q, F, IntegerField
-from django.db.models.functions import Coalesce
-from django.utils import timezone
-from datetime import timedelta
-from .models import Post, Comment, PostLike, CommentLike
+from django.db.models import F
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.utils.urls import replace_query_param
+from .models import Post, Comment, CommentLike, post_activity
+from . import caching, karma, likes, ranking, search, streaming
+from .like_buffer import buffer as like_buffer
+from .db import retry_on_lock
 from .serializers import (
-    PostSerializer, CommentSerializer, UserSerializer, LeaderboardSerializer
+    PostSerializer, CommentSerializer, CommentResultSerializer, UserSerializer, LeaderboardSerializer,
+    RankedUserSerializer, LikeBatchSerializer,
+    COMMENT_TREE_COLUMNS, build_comment_tree, mark_liked,
 )
+from .pagination import PostFeedPagination
+from .threads import ThreadLimits, continuation_url, decode_cursor, load_comment_page
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 
+def post_validators(request, posts, dated=False):
+    """
+    (ETag, Last-Modified) of a response serializing `posts` for this user,
+    from their `Post.version`. Last-Modified only when `dated`, for a single
+    post: a list page can change while none of its posts does, as when one
+    drops out of a top window. (None, None) while write-behind likes are
+    pending, as the response then overlays them.
+    """
+    if like_buffer.has_pending:
+        return None, None
+    user_id = request.user.id if request.user.is_authenticated else 0
+    versions = ','.join(f'{post.id}.{post.version}' for post in posts)
+    etag = 'W/"%s"' % hashlib.md5(f'{user_id}:{versions}'.encode()).hexdigest()
+    last_modified = None
+    if dated and posts:
+        last_modified = last_modified_seconds(max(post.last_activity_at for post in posts))
+    return etag, last_modified
+
+def last_modified_seconds(moment):
+    """
+    `moment` rounded up to a whole second, as a timestamp for Last-Modified;
+    None while that second is not over, as a later change within it would
+    get the same Last-Modified (and one in the future must not be sent).
+    """
+    seconds = math.ceil(moment.timestamp())
+    return seconds if seconds < time.time() else None
+
+def not_modified(request, validators):
+    """A 304 response if the request's If-None-Match / If-Modified-Since match, else None."""
+    etag, last_modified = validators
+    if etag is None:
+        return None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    return set_validators(response, validators) if response is not None else None
+
+def set_validators(response, validators):
+    etag, last_modified = validators
+    if etag is not None:
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    # The body depends on the user (is_liked).
+    patch_vary_headers(response, ('Authorization', 'Cookie'))
+    return response
+
 class RegisterView(APIView):
     permission_classes = [permissions.AllowAny]
     def post(self, request):
@@ -28,99 +89,229 @@ class RegisterView(APIView):
         return Response({'token': token.key, 'username': user.username}, status=status.HTTP_201_CREATED)
 
 class PostListView(generics.ListCreateAPIView):
-    queryset = Post.objects.annotate(
-        likes_count=Count('likes', distinct=True),
-        comments_count=Count('comments', distinct=True)
-    ).order_by('-created_at')
+    queryset = Post.objects.select_related('author').order_by('-created_at', '-id')
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = PostFeedPagination
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        if self.request.user.is_authenticated:
-            context['liked_post_ids'] = set(
-                PostLike.objects.filter(user=self.request.user).values_list('post_id', flat=True)
-            )
-        return context
+    def get_queryset(self):
+        return super().get_queryset().with_liked(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return feed_page_response(request, page, self.paginator)
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
 class PostDetailView(generics.RetrieveAPIView):
-    queryset = Post.objects.annotate(
-        likes_count=Count('likes', distinct=True),
-        comments_count=Count('comments', distinct=True)
-    )
+    queryset = Post.objects.select_related('author')
     serializer_class = PostSerializer
 
+    def get_queryset(self):
+        return super().get_queryset().with_liked(self.request.user)
+
     def get(self, request, *args, **kwargs):
         post = self.get_object()
-        
-        # N+1 Nightmare Solution:
-        # 1. Fetch all comments for this post in a single query with author data.
-        comments = Comment.objects.filter(post=post).select_related('author').annotate(
-            likes_count=Count('likes', distinct=True)
-        ).order_by('created_at')
-        
-        # 2. Build a map of parent_id -> [children]
-        all_comments_map = {}
-        for comment in comments:
-            parent_id = comment.parent_id
-            if parent_id not in all_comments_map:
-                all_comments_map[parent_id] = []
-            all_comments_map[parent_id].append(comment)
-        
-        # 3. Get liked comment IDs for the user
-        liked_comment_ids = set()
-        if request.user.is_authenticated:
-            liked_comment_ids = set(
-                CommentLike.objects.filter(user=request.user, comment__post=post).values_list('comment_id', flat=True)
+        # Answer a matching If-None-Match before loading the comments.
+        validators = post_validators(request, [post], dated=True)
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+        return set_validators(post_response(request, post), validators)
+
+def feed_page_response(request, posts, paginator):
+    """
+    The feed page of `posts` from `paginator`, for PostListView and its
+    async twin: a 304 for a matching If-None-Match before the serializers run.
+    """
+    validators = post_validators(request, posts)
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+    data = PostSerializer(posts, many=True, context={'request': request}).data
+    like_buffer.overlay('post', request.user, data)
+    return set_validators(paginator.get_paginated_response(data), validators)
+
+def post_response(request, post):
+    """The post detail of `post` with its comments, for PostDetailView and its async twin."""
+    post_data = PostSerializer(post, context={'request': request}).data
+    like_buffer.overlay('post', request.user, [post_data])
+
+    # ?limit= / ?depth= / ?replies= load a bounded page of the thread
+    # instead of the whole tree (see feed.threads).
+    limits = ThreadLimits.from_request(request)
+    if limits.bounded:
+        return Response(add_comment_page(request, post_data, limits))
+
+    # ?stream=1 writes the tree out row by row instead (see feed.streaming).
+    if wants_stream(request):
+        return streaming.streaming_response(
+            request, streaming.comment_tree_pieces(post_data, request.user), 'application/json'
+        )
+
+    # N+1 Nightmare Solution:
+    # 1. Take the user-independent comment tree from the cache, or build
+    #    it from a single query of plain tuples (see cached_comment_tree).
+    comments, outcome = cached_comment_tree(post)
+
+    # 2. Mark the comments the user liked.
+    if request.user.is_authenticated:
+        mark_liked(comments, set(
+            CommentLike.objects.filter(user=request.user, comment__post=post).values_list('comment_id', flat=True)
+        ))
+
+    post_data['comments'] = like_buffer.overlay('comment', request.user, comments)
+    response = Response(post_data)
+    response['X-Cache'] = outcome.upper()
+    return response
+
+def wants_stream(request):
+    return request.query_params.get('stream') in ('1', 'true')
+
+class PostExportView(APIView):
+    """Every post, newest first, as NDJSON: one PostSerializer object per line, streamed."""
+
+    def get(self, request):
+        queryset = PostListView.queryset.with_liked(request.user)
+        return streaming.streaming_response(
+            request, streaming.feed_export_pieces(queryset, request.user), 'application/x-ndjson'
+        )
+
+class SearchView(APIView):
+    """
+    Posts (`?type=posts`, the default) or comments (`?type=comments`)
+    containing every word of `?q=`, best match first (see feed.search).
+    """
+
+    def get(self, request):
+        words = search.terms(request.query_params.get('q', ''))
+        if not words:
+            raise ValidationError({'q': ['Enter at least one word to search for.']})
+        kind = request.query_params.get('type', 'posts')
+        if kind not in search.TABLES:
+            raise ValidationError({'type': [f"Must be one of: {', '.join(search.TABLES)}."]})
+        page_size = settings.SEARCH_PAGE_SIZE
+        try:
+            page_size = int(request.query_params['page_size']) or page_size
+        except (KeyError, ValueError):
+            pass
+        page_size = max(1, min(page_size, 100))
+
+        matches = search.search(kind, words, search.decode_cursor(request), page_size + 1)
+        next_url = None
+        if len(matches) > page_size:
+            matches = matches[:page_size]
+            last_id, last_score = matches[-1]
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor', search.encode_cursor(last_score, last_id)
             )
-        
-        # 4. Serialize top-level comments (parent=None)
-        context = {
-            'request': request,
-            'all_comments_map': all_comments_map,
-            'liked_comment_ids': liked_comment_ids
-        }
-        
-        top_level_comments = all_comments_map.get(None, [])
-        post_data = self.get_serializer(post, context=self.get_serializer_context()).data
-        post_data['comments'] = CommentSerializer(top_level_comments, many=True, context=context).data
-        
-        return Response(post_data)
+
+        ids = [result_id for result_id, _ in matches]
+        if kind == 'posts':
+            found = Post.objects.select_related('author').with_liked(request.user).in_bulk(ids)
+            serializer_class, like_kind = PostSerializer, 'post'
+        else:
+            found = Comment.objects.select_related('author').with_liked(request.user).in_bulk(ids)
+            serializer_class, like_kind = CommentResultSerializer, 'comment'
+        results = serializer_class(
+            [found[result_id] for result_id in ids if result_id in found], many=True, context={'request': request}
+        ).data
+        like_buffer.overlay(like_kind, request.user, results)
+        return Response({'next': next_url, 'results': results})
+
+def cached_comment_tree(post):
+    """
+    (tree, cache outcome) for `post`'s whole comment tree as built by
+    `build_comment_tree`, with every `is_liked` False. Cached per
+    `Post.comments_version`, which comment creation and comment likes bump,
+    but not likes of the post. Cache reads return a fresh copy, so callers
+    may mark the tree in place.
+    """
+    # created_at keeps the key unique should post ids be reused, e.g. after
+    # the database is reset.
+    key = f'comment-tree:{post.id}:{post.comments_version}:{post.created_at.timestamp()}'
+    comments = cache.get(key)
+    if comments is not None:
+        return comments, 'hit'
+    rows = Comment.objects.filter(post=post).order_by('created_at').values_list(*COMMENT_TREE_COLUMNS)
+    comments = build_comment_tree(rows, post.id)
+    cache.set(key, comments, settings.COMMENT_TREE_CACHE_TTL)
+    return comments, 'miss'
+
+def add_comment_page(request, post_data, limits):
+    """Attach a bounded page of the post's comments to its serialized data."""
+    comments, after_id = load_comment_page(request, post_data['id'], limits)
+    post_data['comments'] = comments
+    post_data['comments_has_more'] = after_id is not None
+    post_data['comments_continuation'] = None
+    if after_id is not None:
+        post_data['comments_continuation'] = continuation_url(
+            request, 'comment-create', post_data['id'], after_id, limits.query_params(limits.limit)
+        )
+    return post_data
+
+def toggle_like_response(kind, request, pk):
+    # Toggle with an INSERT ... ON CONFLICT / DELETE ... RETURNING pair
+    # instead of get_or_create (see feed.likes), or buffer the toggle in
+    # write-behind mode (see feed.like_buffer).
+    if settings.LIKE_WRITE_BEHIND:
+        liked, likes_count = like_buffer.toggle(kind, request.user.id, pk)
+    else:
+        liked, likes_count = likes.toggle_like(kind, request.user.id, pk)
+    return Response(
+        {'liked': liked, 'likes_count': likes_count},
+        status=status.HTTP_201_CREATED if liked else status.HTTP_200_OK,
+    )
 
 class LikePostView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk):
-        post = get_object_or_404(Post, pk=pk)
-        # Handle Race Condition with get_or_create or atomic transaction
-        with transaction.atomic():
-            like, created = PostLike.objects.get_or_create(user=request.user, post=post)
-            if not created:
-                # If already liked, then unlike (toggle behavior)
-                like.delete()
-                return Response({'liked': False}, status=status.HTTP_200_OK)
-            
-        return Response({'liked': True}, status=status.HTTP_201_CREATED)
+        return toggle_like_response('post', request, pk)
 
 class LikeCommentView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk):
-        comment = get_object_or_404(Comment, pk=pk)
-        with transaction.atomic():
-            like, created = CommentLike.objects.get_or_create(user=request.user, comment=comment)
-            if not created:
-                like.delete()
-                return Response({'liked': False}, status=status.HTTP_200_OK)
-                
-        return Response({'liked': True}, status=status.HTTP_201_CREATED)
+        return toggle_like_response('comment', request, pk)
+
+class LikeBatchView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = LikeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = [
+            (op['type'], op['id'], op['action'] == 'like') for op in serializer.validated_data['operations']
+        ]
+        # In write-behind mode, through the buffer, which may hold toggles of
+        # the same pairs that the batch has to build on.
+        if settings.LIKE_WRITE_BEHIND:
+            results = like_buffer.apply(request.user.id, operations)
+        else:
+            results = likes.apply_likes(request.user.id, operations)
+        return Response({'results': results})
+
+def comment_page_response(request, url_name, pk, post_id, limits, parent=None, parent_author=None):
+    nodes, after_id = load_comment_page(
+        request, post_id, limits, parent=parent, parent_author=parent_author,
+        after_id=decode_cursor(request),
+    )
+    next_url = None
+    if after_id is not None:
+        next_url = continuation_url(request, url_name, pk, after_id, limits.query_params(limits.limit))
+    return Response({'next': next_url, 'results': nodes})
 
 class CommentCreateView(generics.CreateAPIView):
     serializer_class = CommentSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+
+    def get(self, request, pk):
+        """Page through a post's top-level comments (with bounded replies)."""
+        post = get_object_or_404(Post.objects.only('id'), pk=pk)
+        limits = ThreadLimits.from_request(request, default_limit=settings.COMMENT_PAGE_SIZE)
+        return comment_page_response(request, 'comment-create', pk, post.id, limits)
 
     def perform_create(self, serializer):
         post_id = self.kwargs.get('pk')
@@ -128,26 +319,140 @@ class CommentCreateView(generics.CreateAPIView):
         parent_id = self.request.data.get('parent')
         parent = None
         if parent_id:
-            parent = get_object_or_404(Comment, pk=parent_id)
-        serializer.save(author=self.request.user, post=post, parent=parent)
+            # The parent must be in the same thread: its materialized path is
+            # the prefix of the reply's.
+            parent = get_object_or_404(Comment.objects.select_related('author'), pk=parent_id, post=post)
+            if parent.depth + 1 > settings.MAX_COMMENT_DEPTH:
+                raise ValidationError({'parent': 'This thread is too deep to reply to.'})
+        self.save_comment(serializer, post, parent)
+
+    @retry_on_lock
+    def save_comment(self, serializer, post, parent):
+        with transaction.atomic():
+            serializer.save(author=self.request.user, post=post, parent=parent)
+            Post.objects.filter(pk=post.pk).update(
+                comments_count=F('comments_count') + 1, hot_score=ranking.hot_score_after(comments=1),
+                **post_activity(comments=True),
+            )
+
+class CommentThreadView(APIView):
+    """Permalink / "continue this thread": one comment with all of its replies."""
+
+    def get(self, request, pk):
+        comment = get_object_or_404(Comment.objects.select_related('parent__author'), pk=pk)
+        subtree = Comment.objects.subtree(comment)
+        rows = subtree.in_thread_order().values_list(*COMMENT_TREE_COLUMNS)
+
+        liked_comment_ids = set()
+        if request.user.is_authenticated:
+            liked_comment_ids = set(
+                CommentLike.objects.filter(user=request.user, comment__in=subtree).values_list('comment_id', flat=True)
+            )
+
+        parent_author = comment.parent.author.username if comment.parent_id else None
+        tree = build_comment_tree(
+            rows, comment.post_id, liked_comment_ids,
+            root_parent_id=comment.parent_id, root_parent_author=parent_author,
+        )
+        like_buffer.overlay('comment', request.user, tree)
+        return Response(tree[0])
+
+class CommentRepliesView(APIView):
+    """Next page of replies under a comment; target of `continuation` links."""
+
+    def get(self, request, pk):
+        parent = get_object_or_404(Comment.objects.select_related('author'), pk=pk)
+        limits = ThreadLimits.from_request(request, default_limit=settings.COMMENT_PAGE_SIZE)
+        return comment_page_response(
+            request, 'comment-replies', pk, parent.post_id, limits,
+            parent=parent, parent_author=parent.author.username,
+        )
+
+def leaderboard_window(request):
+    window = request.query_params.get('window', karma.DEFAULT_WINDOW)
+    if window not in karma.WINDOWS:
+        raise ValidationError({'window': [f"Must be one of: {', '.join(karma.WINDOWS)}."]})
+    return window
+
+def cached_leaderboard(window=karma.DEFAULT_WINDOW):
+    """(leaderboard, cache outcome) for the top 5 by karma earned in `window`."""
+    # Read from the rolling-window rollups maintained by feed.karma instead of
+    # aggregating every like. The result is shared by every caller, so it is
+    # cached until a like toggle bumps the version or the short TTL covers the
+    # window drifting.
+    return caching.get_or_compute(
+        karma.LEADERBOARD_CACHE,
+        lambda: karma.leaderboard(limit=5, window=window),
+        ttl=settings.LEADERBOARD_CACHE_TTL,
+        entry_name=None if window == karma.DEFAULT_WINDOW else window,
+    )
 
 class LeaderboardView(APIView):
     def get(self, request):
-        twenty_four_hours_ago = timezone.now() - timedelta(hours=24)
-        
-        # The Math: Dynamically calculate karma from last 24h likes
-        leaderboard = User.objects.annotate(
-            post_karma=Coalesce(
-                Count('posts__likes', filter=Q(posts__likes__created_at__gte=twenty_four_hours_ago), distinct=True),
-                0, output_field=IntegerField()
-            ) * 5,
-            comment_karma=Coalesce(
-                Count('comments__likes', filter=Q(comments__likes__created_at__gte=twenty_four_hours_ago), distinct=True),
-                0, output_field=IntegerField()
-            ) * 1
-        ).annotate(
-            karma=F('post_karma') + F('comment_karma')
-        ).filter(karma__gt=0).order_by('-karma')[:5]
-        
-        data = LeaderboardSerializer(leaderboard, many=True).data
-        return Response(data)
+        return leaderboard_response(request)
+
+def leaderboard_response(request):
+    """The top users of the requested window, for LeaderboardView and its async twin."""
+    leaderboard, outcome = cached_leaderboard(leaderboard_window(request))
+    response = Response(LeaderboardSerializer(leaderboard, many=True).data)
+    response['X-Cache'] = outcome.upper()
+    return response
+
+def encode_ranking_cursor(karma_points, user_id, position, rank):
+    payload = json.dumps({'k': karma_points, 'u': user_id, 'p': position, 'r': rank}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+
+def decode_ranking_cursor(request):
+    """(karma, user_id, position, rank) of the last row of the previous page, or None."""
+    encoded = request.query_params.get('cursor')
+    if encoded is None:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        cursor = (payload['k'], payload['u'], payload['p'], payload['r'])
+        if not all(isinstance(value, int) for value in cursor):
+            raise ValueError
+        return cursor
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        raise NotFound('Invalid cursor')
+
+class LeaderboardRankingView(APIView):
+    """The whole ranking of a window, a page at a time, with each user's rank (ties share one)."""
+
+    def get(self, request):
+        window = leaderboard_window(request)
+        page_size = settings.LEADERBOARD_PAGE_SIZE
+        try:
+            page_size = int(request.query_params['page_size']) or page_size
+        except (KeyError, ValueError):
+            pass
+        page_size = max(1, min(page_size, 100))
+        cursor = decode_ranking_cursor(request)
+        previous_karma, _, position, rank = cursor or (None, None, 0, 0)
+
+        rows = karma.ranking(window, page_size + 1, after=cursor and cursor[:2])
+        usernames = dict(User.objects.filter(pk__in=[user_id for user_id, _ in rows]).values_list('id', 'username'))
+        results = []
+        for user_id, points in rows[:page_size]:
+            position += 1
+            if points != previous_karma:
+                rank = position
+            previous_karma = points
+            results.append({'rank': rank, 'username': usernames[user_id], 'karma': points})
+
+        next_url = None
+        if len(rows) > page_size:
+            last_id = rows[page_size - 1][0]
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor',
+                encode_ranking_cursor(previous_karma, last_id, position, rank),
+            )
+        return Response({'next': next_url, 'results': RankedUserSerializer(results, many=True).data})
+
+class LeaderboardRankView(APIView):
+    """The current user's rank and karma in a window; rank is null without karma."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        rank, points = karma.rank(request.user.id, leaderboard_window(request))
+        return Response(RankedUserSerializer({'rank': rank, 'username': request.user.username, 'karma': points}).data)
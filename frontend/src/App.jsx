@@ -9,6 +9,7 @@ import { Plus, Layout, Flame, Hash } from 'lucide-react';
 function App() {
   const [user, setUser] = useState(null);
   const [posts, setPosts] = useState([]);
+  const [nextPage, setNextPage] = useState(null);
   const [isAuthOpen, setIsAuthOpen] = useState(false);
   const [loading, setLoading] = useState(true);
   const [showCreatePost, setShowCreatePost] = useState(false);
@@ -17,7 +18,8 @@ function App() {
   const fetchPosts = async () => {
     try {
       const res = await api.get('posts/');
-      setPosts(res.data);
+      setPosts(res.data.results);
+      setNextPage(res.data.next);
     } catch (err) {
       console.error("Fetch Posts Error:", err);
     } finally {
@@ -25,6 +27,17 @@ function App() {
     }
   };
 
+  const fetchMorePosts = async () => {
+    if (!nextPage) return;
+    try {
+      const res = await api.get(nextPage);
+      setPosts(prev => [...prev, ...res.data.results]);
+      setNextPage(res.data.next);
+    } catch (err) {
+      console.error("Fetch More Posts Error:", err);
+    }
+  };
+
   useEffect(() => {
     fetchPosts();
     // In a real app, you'd check token validity on mount
@@ -125,6 +138,12 @@ function App() {
                   onAuthRequired={() => setIsAuthOpen(true)}
                 />
               ))}
+
+              {!loading && nextPage && (
+                <button onClick={fetchMorePosts} className="btn-ghost w-full">
+                  Load more
+                </button>
+              )}
             </div>
           </div>
 
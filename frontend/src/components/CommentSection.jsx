@@ -17,7 +17,7 @@ const CommentItem = ({ comment, depth = 0, onReplyAdded, onAuthRequired }) => {
         try {
             const res = await api.post(`comments/${comment.id}/like/`);
             setIsLiked(res.data.liked);
-            setLikesCount(prev => res.data.liked ? prev + 1 : prev - 1);
+            setLikesCount(res.data.likes_count);
         } catch (err) {
             console.error("Comment Like Error:", err.response?.data || err.message);
             if (err.response?.status === 401) onAuthRequired();
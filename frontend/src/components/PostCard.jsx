@@ -16,7 +16,7 @@ export default function PostCard({ post: initialPost, onAuthRequired }) {
             setPost(prev => ({
                 ...prev,
                 is_liked: res.data.liked,
-                likes_count: res.data.liked ? prev.likes_count + 1 : prev.likes_count - 1
+                likes_count: res.data.likes_count
             }));
         } catch (err) {
             if (err.response?.status === 401) onAuthRequired();